@@ -0,0 +1,201 @@
+#Judge agent: leases solutions from the verifier coordinator (see coordinator.py), judges them with Checker
+#and sends verdicts back. Solution files and task data are fetched by content hash and cached in AGENT_CACHE_DIR.
+#Several agents may run on one machine if they have different names.
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import hashlib
+import logging
+import argparse
+import threading
+import traceback
+import multiprocessing
+import multiprocessing.connection
+import urllib.error
+import urllib.request
+import checker
+import config
+from checker import Checker
+from status import Status
+from taskregistry import Task
+
+class LeaseExpired(Exception):
+    pass
+
+class Agent:
+    def __init__(self, url, name, workers_count):
+        self.url = url.rstrip('/')
+        self.name = name
+        self.workers_count = workers_count
+        self.cache_dir = config.AGENT_CACHE_DIR
+        self.work_dir = checker.get_workspace_dir() + '/agent-' + name
+        self.workers = {}
+
+    def request(self, path, data=None, timeout=30):
+        headers = {'X-Verifier-Token': config.COORDINATOR_TOKEN}
+        if data is not None:
+            data = json.dumps(data).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(self.url + path, data, headers)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 410:
+                raise LeaseExpired(path)
+            raise
+
+    def fetch_file(self, file_hash):
+        path = self.cache_dir + '/files/' + file_hash
+        if os.path.exists(path):
+            return path
+        status, data = self.request('/files/' + file_hash)
+        if hashlib.sha256(data).hexdigest() != file_hash:
+            raise Exception('Corrupted file {0} from the coordinator'.format(file_hash))
+        os.makedirs(self.cache_dir + '/files', exist_ok=True)
+        staging = '{0}.{1}'.format(path, os.getpid())
+        with open(staging, 'wb') as file:
+            file.write(data)
+        os.rename(staging, path)
+        return path
+
+    def copy_files(self, files, dir_path):
+        os.makedirs(dir_path)
+        for name, file_hash in files.items():
+            if '/' in name or name in ('.', '..'):
+                raise Exception('Invalid file name: ' + name)
+            path = self.fetch_file(file_hash)
+            try:
+                os.link(path, dir_path + '/' + name)
+            except OSError:
+                shutil.copyfile(path, dir_path + '/' + name)
+
+    def get_task(self, task_info):
+        #Task dirs are kept by fingerprint, so a task is assembled once per version
+        path = os.path.abspath(self.cache_dir + '/tasks/' + task_info['fingerprint'])
+        if not os.path.exists(path):
+            staging = '{0}.{1}'.format(path, os.getpid())
+            shutil.rmtree(staging, ignore_errors=True)
+            self.copy_files(task_info['files'], staging)
+            try:
+                os.rename(staging, path)
+            except OSError:
+                #Another worker has assembled it
+                shutil.rmtree(staging, ignore_errors=True)
+        return Task(task_info['name'], path)
+
+    def send_heartbeats(self, lease_id, stopped):
+        while not stopped.wait(config.LEASE_TIMEOUT / 4):
+            try:
+                self.request('/heartbeat', {'lease': lease_id})
+            except LeaseExpired:
+                logging.warning('Lease {0} has expired'.format(lease_id))
+                return
+            except:
+                logging.warning('Unable to send heartbeat: ' + traceback.format_exc())
+
+    def judge(self, lease, temp_dir, solution_dir):
+        solution_id, datetime, email, task, language, status, queued_at = lease['solution']
+        result = {'lease': lease['lease'], 'compiler_output': '', 'failed_test_num': -1,
+                  'stderr': '', 'details': '', 'timings': []}
+        try:
+            shutil.rmtree(solution_dir, ignore_errors=True)
+            self.copy_files(lease['files'], solution_dir)
+            c = Checker(language, solution_dir, self.get_task(lease['task']), temp_dir)
+            result['status'] = c.check()
+            result['compiler_output'] = c.get_compiler_output()
+            result['failed_test_num'] = c.get_failed_test_num()
+            result['stderr'] = c.get_stderr()
+            result['details'] = c.get_message()
+            result['timings'] = [(t.stage, t.wall, t.cpu, t.memory, t.test_num) for t in c.get_timings()]
+        except Exception:
+            logging.warning('Internal error: ' + traceback.format_exc())
+            result['status'] = Status.INTERNAL_ERROR
+        return result
+
+    def send_result(self, result):
+        #The lease is kept alive by heartbeats while the coordinator is unreachable
+        while True:
+            try:
+                self.request('/result', result)
+                return
+            except LeaseExpired:
+                logging.warning('Lease {0} has expired, the verdict is dropped'.format(result['lease']))
+                return
+            except:
+                logging.warning('Unable to send result: ' + traceback.format_exc())
+                time.sleep(config.AGENT_RETRY_DELAY)
+
+    def process_lease(self, lease, temp_dir, solution_dir):
+        logging.info('Got solution {0}'.format(lease['solution'][:5]))
+        stopped = threading.Event()
+        heartbeats = threading.Thread(target=self.send_heartbeats, args=(lease['lease'], stopped), daemon=True)
+        heartbeats.start()
+        try:
+            result = self.judge(lease, temp_dir, solution_dir)
+            self.send_result(result)
+        finally:
+            stopped.set()
+        logging.info('Checked solution {0}: {1}'.format(lease['solution'][0], Status.get_string(result['status'])))
+
+    def run_worker(self, slot):
+        temp_dir = self.work_dir + '/' + str(slot)
+        solution_dir = self.work_dir + '/solution' + str(slot)
+        while True:
+            try:
+                status, data = self.request('/lease', {'agent': self.name}, config.LEASE_POLL_TIMEOUT + 30)
+            except:
+                logging.warning('Unable to lease a solution: ' + traceback.format_exc())
+                time.sleep(config.AGENT_RETRY_DELAY)
+                continue
+            if status == 204:
+                continue
+            self.process_lease(json.loads(data), temp_dir, solution_dir)
+
+    def start_worker(self, slot):
+        worker = multiprocessing.Process(target=self.run_worker, args=(slot,), daemon=True)
+        worker.start()
+        self.workers[slot] = worker
+
+    def run(self):
+        os.makedirs(self.work_dir, exist_ok=True)
+        if config.APPARMOR:
+            temp_dirs = [self.work_dir + '/' + str(slot) for slot in range(self.workers_count)]
+            logging.info('Reloaded {0} apparmor profiles'.format(checker.load_apparmor_profiles(temp_dirs)))
+        for language in checker.PCH_COMMANDS:
+            checker.get_pch_dir(language)
+        for slot in range(self.workers_count):
+            self.start_worker(slot)
+        #A lost lease of a dead worker expires on the coordinator
+        while True:
+            multiprocessing.connection.wait([worker.sentinel for worker in self.workers.values()])
+            for slot, worker in list(self.workers.items()):
+                if not worker.is_alive():
+                    logging.warning('Worker {0} died with exit code {1}'.format(slot, worker.exitcode))
+                    self.start_worker(slot)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Verifier judge agent')
+    parser.add_argument('--url', default=config.COORDINATOR_URL, help='coordinator URL')
+    parser.add_argument('--name', default=socket.gethostname(), help='unique name of the agent')
+    parser.add_argument('--workers', type=int, default=config.AGENT_WORKERS, help='0 - one per CPU core')
+    parser.add_argument('--log', default='agent.log')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(filename=args.log,
+                        format='[%(asctime)s][%(levelname)s]: %(message)s',
+                        datefmt='%d %b %Y %H:%M:%S',
+                        level=logging.DEBUG)
+    if os.getuid() != 0:
+        print('You should run agent with sudo privileges!')
+        sys.exit(1)
+    logging.info('Agent {0} started'.format(args.name))
+    try:
+        Agent(args.url, args.name, args.workers if args.workers > 0 else os.cpu_count() or 1).run()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -1,4 +1,3 @@
-import sqlite3
 import time
 import datetime
 import os
@@ -6,52 +5,76 @@ import sys
 import shutil
 import logging
 import traceback
-import smtplib
+import threading
 import email
-import re
+import html
+import multiprocessing
+import multiprocessing.connection
+import socket
+import signal
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 import checker
 import config
+import database
+import scheduler
+import metrics
 from checker import Checker
 from status import Status
+from taskregistry import registry, natural_key
+from outbox import Outbox, SMTPSession
+from coordinator import Coordinator
+from metrics import Timing, Stopwatch
 
-#TODO: Limit to 50 attempts per email per day
+#Solutions with these statuses are not judged, the user just gets the error
+WAITING_ERRORS = {
+    Status.INVALID_SOLUTION_FORMAT_WAITING : Status.INVALID_SOLUTION_FORMAT_ERROR,
+    Status.SIZE_LIMIT_EXCEEDED_WAITING     : Status.SIZE_LIMIT_EXCEEDED,
+    Status.ATTEMPTS_LIMIT_EXCEEDED_WAITING : Status.ATTEMPTS_LIMIT_EXCEEDED,
+}
+
+#Stages shown in the daily report, see metrics.py
+REPORT_STAGES = ('queue', 'compile', 'test', 'tests', 'judge', 'send')
+
+def reset_signals():
+    #Forked workers must not run the handlers of the supervisor loop (see supervisor.py),
+    #they are stopped by the drain instead
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
 
 class App:
     def __init__(self, server, port, user, password):
         self.solutions_dir = 'solutions'
-        self.tasks_dir = config.TASKS_DIR
-        self.temp_dir = 'temp'
+        self.temp_dir = checker.get_workspace_dir()
         self.report_file = config.REPORT_FILE
         self.server = server
         self.port = port
         self.user = user
         self.password = password
+        self.workers = {}
+        session = SMTPSession(server, port, user, password, config.SMTP_SSL)
+        self.outbox = Outbox(config.OUTBOX_DIR, session, user, self.record_delivery)
+        self.wakeup = multiprocessing.Event()
+        self.draining = multiprocessing.Event()
+        self.outbox_thread = None
+        self.scheduler = scheduler.Scheduler(config.FIRST_ATTEMPT_PRIORITY)
+        self.metrics_written = 0
+        self.coordinator = Coordinator(self) if config.COORDINATOR_PORT else None
         if not os.path.exists(self.solutions_dir):
             os.makedirs(self.solutions_dir)
         if not os.path.exists(self.temp_dir):
             os.makedirs(self.temp_dir)
 
     def get_available_tasks(self):
-        return os.listdir(self.tasks_dir)
+        return registry.get_names()
 
     def try_create_solutions_table(self, conn):
-        cur = conn.cursor()
-        cur.execute('''
-        CREATE TABLE IF NOT EXISTS solutions (
-            id          INTEGER PRIMARY KEY AUTOINCREMENT,
-            datetime    INTEGER,
-            email       TEXT,
-            task        TEXT,
-            language    TEXT,
-            status      INTEGER
-        )
-        ''')
-        conn.commit()
-        res = cur.execute("SELECT count(*) FROM solutions")
+        database.migrate(conn)
+        res = conn.execute("SELECT count(*) FROM solutions")
         size = res.fetchone()[0]
         if size == 0:
             try:
@@ -60,125 +83,146 @@ class App:
                 pass
             os.makedirs(self.solutions_dir)
 
-    def try_create_report_file(self):
-        if not os.path.exists(self.report_file):
-            file = open(self.report_file, 'w')
-            now = datetime.datetime.now()
-            text = '''
-            <html>
-            <head>
-            <style>
-            table, th, td {{ border: 1px solid black; border-spacing: 1px; }}
-            td, th {{ padding: 4px; }}
-            </style>
-            </head>
-            <body>
-            <h3>From {0} To [[NOW]]</h3>
-            <h3>ACCEPTED SOLUTIONS:</h3>
-            No new solutions
-            <h3>REJECTED SOLUTIONS:</h3>
-            No new solutions
-            '''.format(now.strftime('%d-%m-%Y %H:%M'))
-            file.write(text)
-            file.close()
+    def try_create_report_table(self, conn):
+        database.migrate(conn)
+        conn.execute('INSERT OR IGNORE INTO settings (name, value) VALUES (?, ?)',
+                     ('report_from', str(int(time.time()))))
+        conn.commit()
 
-    #Quick and dirty solution
-    def try_make_table(self, text, header):
-        regex = '{0}\s*?No new solutions'.format(header)
-        res = re.findall(regex, text, re.DOTALL)
-        if not res:
-            return text
-        res = res[0]
-        table = '''
-        <table>
-          <tr>
-            <th>User</th>
-            <th>Datetime</th>
-            <th>Task</th>
-            <th>Language</th>
-            <th>Result</th>
-          </tr>
-        </table>
-        '''
-        replacement = res.replace('No new solutions', table)
-        text = text.replace(res, replacement)
+    def add_solution_to_report(self, conn, solution_id, user, timestamp, task, language, result, queue_wait):
+        cur = conn.cursor()
+        cur.execute('INSERT INTO report (solution_id, datetime, email, task, language, status, queue_wait) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (solution_id, timestamp, user, task, language, result, queue_wait))
+
+    def make_table(self, header, rows):
+        text = '<table>\n<tr>'
+        for column in header:
+            text += '<th>{0}</th>'.format(html.escape(column))
+        text += '</tr>\n'
+        for row in rows:
+            text += '<tr>'
+            for value, color in row:
+                value = html.escape(str(value))
+                if color is not None:
+                    value = '<font color="{0}">{1}</font>'.format(color, value)
+                text += '<td>{0}</td>'.format(value)
+            text += '</tr>\n'
+        text += '</table>\n'
         return text
 
-    def rreplace(self, s, old, new, occurrence):
-        li = s.rsplit(old, occurrence)
-        return new.join(li)
-
-    def add_table_data(self, text, header, user, timestamp, task, language, result, result_color):
-        regex = '{0}\s*?<table>.*?</table>'.format(header)
-        res = re.findall(regex, text, re.DOTALL)[0]
-        new_data = '''
-        <tr>
-          <td>{0}</td>
-          <td>{1}</td>
-          <td>{2}</td>
-          <td>{3}</td>
-          <td><font color="{5}">{4}</font></td>
-        </tr>
-        '''.format(user, timestamp, task, language, result, result_color)
-        replacement = self.rreplace(res, '</tr>', '</tr>' + new_data, 1)
-        text = text.replace(res, replacement)
+    def make_solutions_table(self, rows):
+        if not rows:
+            return 'No new solutions\n'
+        table = []
+        for timestamp, user, task, language, result in rows:
+            datetime_str = datetime.datetime.fromtimestamp(timestamp).strftime('%d-%m-%Y %H:%M')
+            color = 'green' if result == Status.OK else 'red'
+            table.append(((user, None),
+                          (datetime_str, None),
+                          ('-' if not task else task, None),
+                          ('-' if not language else language, None),
+                          (Status.get_string(result), color)))
+        return self.make_table(('User', 'Datetime', 'Task', 'Language', 'Result'), table)
+
+    def make_summary_table(self, conn, last_id, column, title):
+        rows = conn.execute('''
+        SELECT {0}, count(*), sum(status = ?) FROM report WHERE id <= ? GROUP BY {0} ORDER BY {0}
+        '''.format(column), (Status.OK, last_id)).fetchall()
+        table = []
+        for value, total, accepted in rows:
+            if column == 'status':
+                value = Status.get_string(value)
+            table.append((('-' if value is None else value, None),
+                          (total, None),
+                          (accepted, 'green'),
+                          (total - accepted, 'red')))
+        return self.make_table((title, 'Total', 'Accepted', 'Rejected'), table)
+
+    def make_queue_wait_table(self, conn, last_id):
+        rows = conn.execute('''
+        SELECT email, count(queue_wait), avg(queue_wait), max(queue_wait) FROM report
+        WHERE id <= ? AND queue_wait IS NOT NULL GROUP BY email ORDER BY max(queue_wait) DESC
+        ''', (last_id,)).fetchall()
+        table = []
+        for user, total, average, maximum in rows:
+            table.append(((user, None),
+                          (total, None),
+                          ('{0:.1f}'.format(average), None),
+                          ('{0:.1f}'.format(maximum), None)))
+        return self.make_table(('User', 'Judged', 'Average wait, sec', 'Max wait, sec'), table)
+
+    def make_timings_table(self, conn, from_datetime, to_datetime):
+        values = metrics.get_values(conn, 'wall', from_datetime.timestamp(), to_datetime.timestamp(), by_task=True)
+        tasks = sorted(set(task for task, stage in values if task is not None), key=natural_key)
+        table = []
+        for task, stage in [(task, stage) for task in tasks for stage in REPORT_STAGES]:
+            stage_values = values.get((task, stage))
+            if not stage_values:
+                continue
+            row = [(task, None), (stage, None), (len(stage_values), None)]
+            for q in metrics.QUANTILES:
+                row.append(('{0:.2f}'.format(metrics.percentile(stage_values, q)), None))
+            row.append(('{0:.2f}'.format(stage_values[-1]), None))
+            table.append(row)
+        if not table:
+            return 'No timings\n'
+        header = ['Task', 'Stage', 'Count'] + ['p{0:g}, sec'.format(q * 100) for q in metrics.QUANTILES] + ['Max, sec']
+        return self.make_table(header, table)
+
+    def render_report(self, conn, last_id, from_datetime, to_datetime):
+        query = 'SELECT datetime, email, task, language, status FROM report WHERE id <= ? AND status {0} ? ORDER BY id'
+        accepted = conn.execute(query.format('='), (last_id, Status.OK)).fetchall()
+        rejected = conn.execute(query.format('!='), (last_id, Status.OK)).fetchall()
+        text = '''
+        <html>
+        <head>
+        <style>
+        table, th, td {{ border: 1px solid black; border-spacing: 1px; }}
+        td, th {{ padding: 4px; }}
+        </style>
+        </head>
+        <body>
+        <h3>From {0} To {1}</h3>
+        '''.format(from_datetime.strftime('%d-%m-%Y %H:%M'), to_datetime.strftime('%d-%m-%Y %H:%M'))
+        if accepted or rejected:
+            text += '<h3>SUMMARY BY TASK:</h3>\n' + self.make_summary_table(conn, last_id, 'task', 'Task')
+            text += '<h3>SUMMARY BY LANGUAGE:</h3>\n' + self.make_summary_table(conn, last_id, 'language', 'Language')
+            text += '<h3>SUMMARY BY RESULT:</h3>\n' + self.make_summary_table(conn, last_id, 'status', 'Result')
+            text += '<h3>QUEUE WAIT BY USER:</h3>\n' + self.make_queue_wait_table(conn, last_id)
+            text += '<h3>TIMINGS BY TASK:</h3>\n' + self.make_timings_table(conn, from_datetime, to_datetime)
+        text += '<h3>ACCEPTED SOLUTIONS:</h3>\n' + self.make_solutions_table(accepted)
+        text += '<h3>REJECTED SOLUTIONS:</h3>\n' + self.make_solutions_table(rejected)
+        text += '</body>\n</html>\n'
         return text
 
-    def add_solution_to_report(self, user, timestamp, task, language, result):
-        file = open(self.report_file, 'r')
-        text = file.read()
-        file.close()
-        if result == Status.OK:
-            header = '<h3>ACCEPTED SOLUTIONS:</h3>'
-            color = 'green'
-        else:
-            header = '<h3>REJECTED SOLUTIONS:</h3>'
-            color = 'red'
-        text = self.try_make_table(text, header)
-        result_str = Status.get_string(result)
-        timestamp = datetime.datetime.fromtimestamp(timestamp)
-        datetime_str = timestamp.strftime('%d-%m-%Y %H:%M')
-        language = '-' if not language else language
-        task = '-' if not task else task
-        text = self.add_table_data(text, header, user, datetime_str, task, language, result_str, color)
-        file = open(self.report_file, 'w')
-        file.write(text)
-        file.close()
-
-    def try_send_daily_report(self):
+    def try_send_daily_report(self, conn):
+        cur = conn.cursor()
         report_time = datetime.datetime.strptime(config.REPORT_TIME, '%H:%M').time()
-        regex = '<h3>From (.*?) To'
-        file = open(self.report_file, 'r')
-        text = file.read()
-        file.close()
-        res = re.findall(regex, text, re.DOTALL)[0]
-        from_date = datetime.datetime.strptime(res, '%d-%m-%Y %H:%M').date()
+        report_from = database.get_setting(conn, 'report_from')
+        from_datetime = datetime.datetime.fromtimestamp(int(report_from))
         now = datetime.datetime.now()
-        now_date = now.date()
-        now_time = now.time()
-        if now_time >= report_time and from_date < now_date:
+        if now.time() >= report_time and from_datetime.date() < now.date():
+            last_id = cur.execute('SELECT coalesce(max(id), 0) FROM report').fetchone()[0]
             file = open(self.report_file, 'w')
-            text = text.replace('[[NOW]]', now.strftime('%d-%m-%Y %H:%M'), 1)
-            file.write(text)
+            file.write(self.render_report(conn, last_id, from_datetime, now))
             file.close()
-            for admin in config.ADMINS:
-                smtp = smtplib.SMTP_SSL(self.server, self.port)
-                smtp.login(self.user, self.password)
-                msg = MIMEMultipart('alternative')
-                msg['Subject'] = 'Daily Report'
-                part1 = MIMEBase('application', "octet-stream")
-                part1.set_payload(open(self.report_file, "rb").read())
-                encoders.encode_base64(part1)
-                part1.add_header('Content-Disposition', 'attachment; filename="report.html"')
-                msg.attach(part1)
-                smtp.sendmail(self.user, admin, msg.as_string())
-                smtp.quit()
-            os.remove(self.report_file)
-            self.try_create_report_file()
-
-    def send_response(self, receiver, task, language, solution_id, new_status, compiler_output, failed_test_num, stderr):
-        smtp = smtplib.SMTP_SSL(self.server, self.port)
-        smtp.login(self.user, self.password)
+            msg = MIMEMultipart('alternative')
+            msg['Subject'] = 'Daily Report'
+            part1 = MIMEBase('application', "octet-stream")
+            part1.set_payload(open(self.report_file, "rb").read())
+            encoders.encode_base64(part1)
+            part1.add_header('Content-Disposition', 'attachment; filename="report.html"')
+            msg.attach(part1)
+            #One message for all admins, so it is delivered in a single session
+            self.outbox.put(config.ADMINS, msg.as_string())
+            cur.execute('DELETE FROM report WHERE id <= ?', (last_id,))
+            database.set_setting(conn, 'report_from', str(int(now.timestamp())))
+            metrics.prune(conn, time.time() - config.METRICS_RETENTION * 24 * 3600)
+            cur.execute('DELETE FROM results WHERE solution_id IN (SELECT id FROM solutions WHERE finished_at < ?)',
+                        (time.time() - config.HTTP_RESULTS_RETENTION * 24 * 3600,))
+            conn.commit()
+
+    def send_response(self, receiver, task, language, solution_id, new_status, compiler_output, failed_test_num, stderr, details, compile_time=None):
         msg = MIMEMultipart('alternative')
         msg['Subject'] = 'Result'
         message = ''
@@ -188,88 +232,344 @@ class App:
             message += 'Language: {0}\n'.format(language)
         message += 'Solution Id: {0}\n'.format(solution_id)
         message += '### Result: {0} ###\n'.format(Status.get_string(new_status))
+        if compile_time is not None:
+            message += 'Compilation time: {0:.2f} sec\n'.format(compile_time)
         fails = (Status.WRONG_ANSWER,
                  Status.RUNTIME_ERROR,
                  Status.SECURITY_VIOLATION_ERROR,
                  Status.TIME_LIMIT_EXCEEDED,
-                 Status.MEMORY_LIMIT_EXCEEDED)
+                 Status.MEMORY_LIMIT_EXCEEDED,
+                 Status.OUTPUT_LIMIT_EXCEEDED)
         if failed_test_num != -1 and new_status in fails:
             message += 'Failed test: {0}\n'.format(failed_test_num)
+            if details:
+                message += 'Details: {0}\n'.format(details)
             if stderr:
                 message += 'Stderr:\n{0}'.format(stderr.lstrip())
         if compiler_output and new_status == Status.COMPILATION_ERROR:
             message += 'Compiler output:\n{0}'.format(compiler_output.lstrip())
+        if new_status == Status.ATTEMPTS_LIMIT_EXCEEDED:
+            message += 'Daily attempts limit: {0}, further solutions are ignored until tomorrow\n'.format(config.DAILY_ATTEMPTS_LIMIT)
+        if new_status == Status.SIZE_LIMIT_EXCEEDED:
+            message += 'Size limits: e-mail {0} Kb, all files {1} Kb, single file {2} Kb\n'.format(
+                config.MESSAGE_SIZE_LIMIT, config.SOLUTION_SIZE_LIMIT, config.ATTACHMENT_SIZE_LIMIT)
         part1 = MIMEText(message, 'plain', 'utf-8')
         msg.attach(part1)
-        smtp.sendmail(self.user, receiver, msg.as_string())
-        smtp.quit()
+        self.outbox.put([receiver], msg.as_string(), solution_id)
 
-    def run(self):
-        conn = sqlite3.connect("database.db")
+    def get_workers_count(self):
+        if self.coordinator is not None and not config.COORDINATOR_LOCAL_WORKERS:
+            return 0
+        if config.VERIFIER_WORKERS > 0:
+            return config.VERIFIER_WORKERS
+        return os.cpu_count() or 1
+
+    def claim_solution(self, conn, claimed=None):
         cur = conn.cursor()
-        self.try_create_solutions_table(conn)
-        self.try_create_report_file()
         while True:
-            compiler_output = ''
-            failed_test_num = -1
-            stderr = ''
-            next_solution = cur.execute('SELECT * FROM solutions WHERE status = ? OR status = ? ORDER BY id LIMIT 1',
-                                        (Status.WAITING, Status.INVALID_SOLUTION_FORMAT_WAITING)).fetchone()
-            if next_solution != None:
-                solution_id, datetime, email, task, language, status = next_solution
-                logging.info('Got new solution: ' + str((solution_id, datetime, email,
-                                                         task, language, Status.get_string(status))))
-                if status == Status.INVALID_SOLUTION_FORMAT_WAITING:
-                    new_status = Status.INVALID_SOLUTION_FORMAT_ERROR
-                else:
-                    solution_path = self.solutions_dir + '/' + str(solution_id)
-                    task_path = self.tasks_dir + '/' + str(task)
-                    solution_files = []
-                    if os.path.exists(solution_path):
-                        for f in os.listdir(solution_path):
-                            if f.endswith(checker.EXTENSIONS[language]):
-                                solution_files.append(f)
-                    if language not in checker.RUN_COMMANDS or   \
-                       task not in self.get_available_tasks() or \
-                       not os.path.exists(solution_path) or      \
-                       not solution_files:
-                        new_status = Status.INVALID_SOLUTION_FORMAT_ERROR
-                    else:
-                        try:
-                            c = Checker(language, solution_path, task_path, self.temp_dir)
-                            new_status = c.check()
-                            compiler_output = c.get_compiler_output()
-                            failed_test_num = c.get_failed_test_num()
-                            stderr = c.get_stderr()
-                        except Exception as e:
-                            logging.warning('Internal error: ' + traceback.format_exc())
-                            new_status = Status.INTERNAL_ERROR
-                try:
-                    cur.execute('UPDATE solutions SET status = ? WHERE id = ?',
-                                (new_status, solution_id))
-                    conn.commit()
-                    try:
-                        self.add_solution_to_report(email, datetime, task, language, new_status)
-                    except:
-                        logging.warning('Unable to update report file: ' + traceback.format_exc())
-                    self.send_response(email, task, language, solution_id, new_status, compiler_output, failed_test_num, stderr)
-                    logging.info('Checked solution: ' + str((solution_id, datetime, email,
-                                                             task, language, Status.get_string(new_status))))
-                except:
-                    logging.warning('Unable to send response: ' + traceback.format_exc())
+            solution = self.scheduler.get_next(conn)
+            if solution is None:
+                return None
+            solution_id, status = solution[0], solution[5]
+            if status == Status.WAITING:
+                new_status = Status.JUDGING
+            else:
+                new_status = WAITING_ERRORS[status]
+            #Remember the id before claiming, so the row can be requeued if the worker dies
+            if claimed is not None:
+                claimed.value = solution_id
+            cur.execute('UPDATE solutions SET status = ?, started_at = ? WHERE id = ? AND status = ?',
+                        (new_status, time.time(), solution_id, status))
+            updated = cur.rowcount
+            conn.commit()
+            if updated == 1:
+                return solution
+            #Someone else has already claimed it
+            if claimed is not None:
+                claimed.value = -1
+
+    def requeue_solution(self, conn, solution_id):
+        cur = conn.cursor()
+        cur.execute('UPDATE solutions SET status = ?, started_at = NULL WHERE id = ? AND status = ?',
+                    (Status.WAITING, solution_id, Status.JUDGING))
+        conn.commit()
+
+    def get_early_status(self, solution):
+        #Status of a solution that is not judged, None if it has to be judged
+        solution_id, datetime, email, task, language, status, queued_at = solution
+        if status in WAITING_ERRORS:
+            return WAITING_ERRORS[status]
+        solution_path = self.solutions_dir + '/' + str(solution_id)
+        solution_files = []
+        if os.path.exists(solution_path):
+            for f in os.listdir(solution_path):
+                if f.endswith(checker.EXTENSIONS[language]):
+                    solution_files.append(f)
+        if language not in checker.RUN_COMMANDS or   \
+           task not in self.get_available_tasks() or \
+           not os.path.exists(solution_path) or      \
+           not solution_files:
+            return Status.INVALID_SOLUTION_FORMAT_ERROR
+        return None
+
+    def judge_solution(self, solution, temp_dir):
+        compiler_output = ''
+        failed_test_num = -1
+        stderr = ''
+        details = ''
+        timings = []
+        solution_id, datetime, email, task, language, status, queued_at = solution
+        new_status = self.get_early_status(solution)
+        if new_status is None:
+            try:
+                c = Checker(language, self.solutions_dir + '/' + str(solution_id), registry.get(task), temp_dir)
+                new_status = c.check()
+                compiler_output = c.get_compiler_output()
+                failed_test_num = c.get_failed_test_num()
+                stderr = c.get_stderr()
+                details = c.get_message()
+                timings = c.get_timings()
+            except Exception as e:
+                logging.warning('Internal error: ' + traceback.format_exc())
+                new_status = Status.INTERNAL_ERROR
+        return new_status, compiler_output, failed_test_num, stderr, details, timings
+
+    def start_solution(self, solution):
+        #Returns time the solution has waited in the queue
+        solution_id, datetime, email, task, language, status, queued_at = solution
+        queue_wait = None if queued_at is None else time.time() - queued_at
+        logging.info('Got new solution: ' + str((solution_id, datetime, email,
+                                                 task, language, Status.get_string(status))))
+        if queue_wait is not None:
+            logging.info('Solution {0} from {1} waited {2:.1f} sec in the queue'.format(solution_id, email, queue_wait))
+        return queue_wait
+
+    def process_solution(self, conn, solution, temp_dir):
+        queue_wait = self.start_solution(solution)
+        stopwatch = Stopwatch()
+        result = self.judge_solution(solution, temp_dir)
+        self.finish_solution(conn, solution, result, stopwatch.get_elapsed(), queue_wait)
+
+    def finish_solution(self, conn, solution, result, judge_time, queue_wait):
+        solution_id, datetime, email, task, language, status, queued_at = solution
+        new_status, compiler_output, failed_test_num, stderr, details, timings = result
+        timings.append(Timing('judge', judge_time))
+        if queue_wait is not None:
+            timings.append(Timing('queue', queue_wait))
+        try:
+            cur = conn.cursor()
+            cur.execute('UPDATE solutions SET status = ?, finished_at = ? WHERE id = ?',
+                        (new_status, time.time(), solution_id))
+            source, mail_result = cur.execute('SELECT source, mail_result FROM solutions WHERE id = ?',
+                                              (solution_id,)).fetchone()
+            if source == 'http':
+                cur.execute('INSERT OR REPLACE INTO results (solution_id, failed_test_num, compiler_output, stderr, details) VALUES (?, ?, ?, ?, ?)',
+                            (solution_id, failed_test_num, compiler_output, stderr, details))
             try:
-                self.try_send_daily_report()
+                self.add_solution_to_report(conn, solution_id, email, datetime, task, language, new_status, queue_wait)
             except:
-                logging.warning('Unable to send daily report: ' + traceback.format_exc())
-            time.sleep(config.VERIFIER_UPDATE_PERIOD)
-
-logging.basicConfig(filename='log.txt',
-                    format='[%(asctime)s][%(levelname)s]: %(message)s',
-                    datefmt='%d %b %Y %H:%M:%S',
-                    level=logging.DEBUG)
-logging.info('App started')
-try:
-    app = App(config.SMTP_SERVER, config.SMTP_PORT, config.LOGIN, config.PASSWORD)
-    app.run()
-except KeyboardInterrupt:
-    sys.exit(0)
+                logging.warning('Unable to update report: ' + traceback.format_exc())
+            try:
+                metrics.record(conn, timings, solution_id, task, language)
+            except:
+                logging.warning('Unable to record timings: ' + traceback.format_exc())
+            conn.commit()
+            compile_times = [timing.wall for timing in timings if timing.stage == 'compile']
+            compile_time = compile_times[0] if compile_times else None
+            if mail_result:
+                self.send_response(email, task, language, solution_id, new_status, compiler_output, failed_test_num, stderr, details, compile_time)
+            logging.info('Checked solution: ' + str((solution_id, datetime, email,
+                                                     task, language, Status.get_string(new_status))))
+        except:
+            logging.warning('Unable to send response: ' + traceback.format_exc())
+
+    def record_delivery(self, item):
+        #Called from the outbox thread
+        if item.get('solution_id') is None or item.get('created') is None:
+            return
+        conn = database.connect()
+        try:
+            task, language = conn.execute('SELECT task, language FROM solutions WHERE id = ?',
+                                          (item['solution_id'],)).fetchone()
+            metrics.record(conn, [Timing('send', time.time() - item['created'])], item['solution_id'], task, language)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def try_write_metrics(self, conn):
+        if not config.METRICS_FILE or time.time() - self.metrics_written < config.METRICS_UPDATE_PERIOD:
+            return
+        self.metrics_written = time.time()
+        metrics.write_textfile(conn, config.METRICS_FILE, config.METRICS_WINDOW)
+
+    def run_worker(self, slot, claimed):
+        reset_signals()
+        temp_dir = self.temp_dir + '/' + str(slot)
+        conn = database.connect()
+        while True:
+            self.wakeup.clear()
+            #Checked after clear, so the wakeup of a drain is never missed
+            if self.draining.is_set():
+                return
+            solution = self.claim_solution(conn, claimed)
+            if solution is None:
+                self.wakeup.wait(config.VERIFIER_UPDATE_PERIOD)
+                continue
+            self.process_solution(conn, solution, temp_dir)
+            claimed.value = -1
+
+    def start_worker(self, slot):
+        claimed = multiprocessing.Value('i', -1)
+        worker = multiprocessing.Process(target=self.run_worker, args=(slot, claimed), daemon=True)
+        worker.start()
+        self.workers[slot] = (worker, claimed)
+
+    def check_workers(self, conn):
+        for slot, (worker, claimed) in list(self.workers.items()):
+            if worker.is_alive():
+                continue
+            logging.warning('Worker {0} died with exit code {1}'.format(slot, worker.exitcode))
+            if claimed.value != -1:
+                self.requeue_solution(conn, claimed.value)
+                logging.info('Returned solution {0} to the queue'.format(claimed.value))
+            self.start_worker(slot)
+
+    def requeue_interrupted(self, conn):
+        #Solutions left judging by a stopped verifier go back to the queue, the time they were
+        #judged is lost work and is recorded as the requeue stage
+        now = time.time()
+        rows = conn.execute('SELECT id, task, language, started_at FROM solutions WHERE status = ?',
+                            (Status.JUDGING,)).fetchall()
+        for solution_id, task, language, started_at in rows:
+            lost = 0.0 if started_at is None else max(0.0, now - started_at)
+            metrics.record(conn, [Timing('requeue', lost)], solution_id, task, language)
+            logging.info('Returned interrupted solution {0} to the queue, {1:.1f} sec of judging lost'.format(solution_id, lost))
+        conn.execute('UPDATE solutions SET status = ?, started_at = NULL WHERE status = ?', (Status.WAITING, Status.JUDGING))
+        conn.commit()
+        return len(rows)
+
+    def create_notify_socket(self):
+        try:
+            os.unlink(config.NOTIFY_SOCKET)
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(config.NOTIFY_SOCKET)
+        sock.setblocking(False)
+        return sock
+
+    def read_notifications(self, sock):
+        notified = False
+        while True:
+            try:
+                sock.recv(64)
+                notified = True
+            except BlockingIOError:
+                return notified
+
+    def start(self):
+        #Returns the notify socket
+        conn = database.connect()
+        self.try_create_solutions_table(conn)
+        self.try_create_report_table(conn)
+        resumed = self.requeue_interrupted(conn)
+        if resumed:
+            logging.info('Resumed {0} solutions interrupted by the previous run'.format(resumed))
+        conn.close()
+        sock = self.create_notify_socket()
+        self.outbox_thread = threading.Thread(target=self.outbox.run, daemon=True)
+        self.outbox_thread.start()
+        if config.APPARMOR:
+            #Workers inherit the loaded profiles, so solutions don't wait for the parser
+            try:
+                temp_dirs = [self.temp_dir + '/' + str(slot) for slot in range(self.get_workers_count())]
+                reloaded = checker.load_apparmor_profiles(temp_dirs)
+                logging.info('Reloaded {0} apparmor profiles'.format(reloaded))
+            except:
+                logging.warning('Unable to load apparmor profiles: ' + traceback.format_exc())
+        #Built before the workers are forked, so they don't build it concurrently
+        for language in checker.PCH_COMMANDS:
+            checker.get_pch_dir(language)
+        for slot in range(self.get_workers_count()):
+            self.start_worker(slot)
+        if self.coordinator is not None:
+            self.coordinator.start((config.COORDINATOR_ADDRESS, config.COORDINATOR_PORT))
+        return sock
+
+    def get_sentinels(self):
+        return [worker.sentinel for worker, claimed in self.workers.values()]
+
+    def get_poll_timeout(self):
+        timeout = config.VERIFIER_UPDATE_PERIOD
+        if config.METRICS_FILE:
+            timeout = min(timeout, config.METRICS_UPDATE_PERIOD)
+        if self.coordinator is not None:
+            timeout = min(timeout, config.LEASE_TIMEOUT / 2)
+        return timeout
+
+    def poll(self, conn, sock):
+        if self.read_notifications(sock):
+            self.wakeup.set()
+        self.check_workers(conn)
+        if self.coordinator is not None:
+            self.coordinator.expire_leases(conn)
+        try:
+            self.try_send_daily_report(conn)
+        except:
+            logging.warning('Unable to send daily report: ' + traceback.format_exc())
+        try:
+            self.try_write_metrics(conn)
+        except:
+            logging.warning('Unable to write metrics: ' + traceback.format_exc())
+
+    def drain(self, timeout):
+        #Workers and agents finish the solutions they are judging but don't take new ones,
+        #solutions still judged after the timeout are returned to the queue.
+        #Queued responses stay in the outbox and are sent after restart.
+        #Returns the number of interrupted solutions.
+        stopwatch = Stopwatch()
+        deadline = time.monotonic() + timeout
+        self.draining.set()
+        self.wakeup.set()
+        workers = [worker for worker, claimed in self.workers.values()]
+        while time.monotonic() < deadline:
+            alive = [worker for worker in workers if worker.is_alive()]
+            if not alive and (self.coordinator is None or not self.coordinator.get_leases_count()):
+                break
+            multiprocessing.connection.wait([worker.sentinel for worker in alive], min(1.0, deadline - time.monotonic()))
+        for worker in workers:
+            if worker.is_alive():
+                worker.kill()
+            worker.join()
+        if self.coordinator is not None:
+            self.coordinator.drop_leases()
+        conn = database.connect()
+        try:
+            interrupted = self.requeue_interrupted(conn)
+            metrics.record(conn, [Timing('drain', stopwatch.get_elapsed())])
+            conn.commit()
+        finally:
+            conn.close()
+        self.outbox.stop()
+        self.outbox_thread.join(max(0, deadline - time.monotonic()))
+        logging.info('Drained in {0:.1f} sec, {1} solutions returned to the queue'.format(stopwatch.get_elapsed(), interrupted))
+        return interrupted
+
+    def run(self):
+        sock = self.start()
+        conn = database.connect()
+        while True:
+            multiprocessing.connection.wait([sock] + self.get_sentinels(), self.get_poll_timeout())
+            self.poll(conn, sock)
+
+if __name__ == '__main__':
+    logging.basicConfig(filename='log.txt',
+                        format='[%(asctime)s][%(levelname)s]: %(message)s',
+                        datefmt='%d %b %Y %H:%M:%S',
+                        level=logging.DEBUG)
+    logging.info('App started')
+    try:
+        app = App(config.SMTP_SERVER, config.SMTP_PORT, config.LOGIN, config.PASSWORD)
+        app.run()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,71 @@
+import os
+import hashlib
+import subprocess
+
+#Profiles are attached to fixed target paths (one per worker slot and language), so they are loaded once
+#and stay in the kernel between solutions. A profile is written and reloaded only when its text differs
+#from the file in PROFILES_DIR or the kernel doesn't enforce it, e.g. after a template change.
+
+PROFILES_DIR = '/etc/apparmor.d'
+LOADED_PROFILES = '/sys/kernel/security/apparmor/profiles'
+PARSER_TIMEOUT = 30 #sec
+
+#target path --> hash of the profile known to be enforced, per process
+enforced = {}
+
+def get_profile_name(target):
+    return target.replace('/', '.')[1:]
+
+def get_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def get_file_hash(path):
+    try:
+        with open(path, 'rb') as file:
+            return get_hash(file.read())
+    except OSError:
+        return None
+
+def get_loaded_profiles():
+    #Lines look like '/path/to/target (enforce)'
+    profiles = {}
+    try:
+        with open(LOADED_PROFILES, 'r') as file:
+            for line in file:
+                name, _, mode = line.rstrip('\n').rpartition(' ')
+                profiles[name] = mode.strip('()')
+    except OSError:
+        return None
+    return profiles
+
+def write_profile(path, data):
+    temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'wb') as file:
+        file.write(data)
+    os.rename(temp_path, path)
+
+def load_profile(target, profile, loaded_profiles=None):
+    #Returns True if the profile had to be (re)loaded
+    data = profile.encode('utf-8')
+    profile_hash = get_hash(data)
+    if enforced.get(target) == profile_hash:
+        return False
+    profile_name = get_profile_name(target)
+    profile_path = PROFILES_DIR + '/' + profile_name
+    if loaded_profiles is None:
+        loaded_profiles = get_loaded_profiles()
+    up_to_date = get_file_hash(profile_path) == profile_hash and \
+                 loaded_profiles is not None and loaded_profiles.get(target) == 'enforce'
+    if not up_to_date:
+        write_profile(profile_path, data)
+        #A profile disabled by aa-disable wouldn't be loaded on boot
+        try:
+            os.remove(PROFILES_DIR + '/disable/' + profile_name)
+        except FileNotFoundError:
+            pass
+        process = subprocess.run(['apparmor_parser', '--replace', profile_path], stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT, timeout=PARSER_TIMEOUT)
+        if process.returncode != 0:
+            raise Exception('Unable to enforce apparmor profile: ' + process.stdout.decode('utf-8', 'replace'))
+    enforced[target] = profile_hash
+    return not up_to_date
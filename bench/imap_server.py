@@ -0,0 +1,194 @@
+#Minimal single-mailbox IMAP server, used instead of a real mail server for testing and benchmarks.
+#Supports the commands used by mailmon.py: LOGIN, SELECT, CAPABILITY, UID SEARCH/FETCH/STORE, IDLE.
+#Usage: python3 imap_server.py [port] [dir with .eml files to put into the mailbox]
+import os
+import re
+import sys
+import time
+import select
+import threading
+import socketserver
+
+def parse_uid_set(text, last_uid):
+    uids = set()
+    for item in text.split(','):
+        if ':' in item:
+            first, last = item.split(':')
+            first = last_uid if first == '*' else int(first)
+            last = last_uid if last == '*' else int(last)
+            uids.update(range(min(first, last), max(first, last) + 1))
+        else:
+            uids.add(last_uid if item == '*' else int(item))
+    return uids
+
+class IMAPHandler(socketserver.StreamRequestHandler):
+    def write(self, data):
+        if isinstance(data, str):
+            data = (data + '\r\n').encode('utf-8')
+        self.wfile.write(data)
+
+    def handle(self):
+        self.server.add_connection()
+        self.write('* OK Stand-in IMAP server ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.decode('utf-8', 'replace').strip().split(' ', 2)
+            if len(parts) < 2:
+                self.write('* BAD Invalid command')
+                continue
+            tag, command = parts[0], parts[1].upper()
+            args = parts[2] if len(parts) > 2 else ''
+            if command == 'UID':
+                command, args = (args.split(' ', 1) + [''])[:2]
+                command = 'UID ' + command.upper()
+            if command == 'CAPABILITY':
+                capabilities = 'IMAP4rev1 IDLE' if self.server.idle_supported else 'IMAP4rev1'
+                self.write('* CAPABILITY ' + capabilities)
+                self.write(tag + ' OK CAPABILITY completed')
+            elif command == 'LOGIN':
+                self.write(tag + ' OK LOGIN completed')
+            elif command in ('SELECT', 'EXAMINE'):
+                with self.server.lock:
+                    self.write('* {0} EXISTS'.format(len(self.server.messages)))
+                    self.write('* OK [UIDVALIDITY {0}] UIDs valid'.format(self.server.uidvalidity))
+                    self.write('* OK [UIDNEXT {0}] Predicted next UID'.format(self.server.last_uid + 1))
+                self.write(tag + ' OK [READ-WRITE] SELECT completed')
+            elif command == 'UID SEARCH':
+                self.search(tag, args)
+            elif command == 'UID FETCH':
+                self.fetch(tag, args)
+            elif command == 'UID STORE':
+                self.store(tag, args)
+            elif command == 'IDLE':
+                if not self.idle(tag):
+                    return
+            elif command == 'NOOP':
+                self.write(tag + ' OK NOOP completed')
+            elif command == 'LOGOUT':
+                self.write('* BYE Logging out')
+                self.write(tag + ' OK LOGOUT completed')
+                return
+            else:
+                self.write(tag + ' BAD Command not implemented')
+
+    def search(self, tag, args):
+        #Only 'UNSEEN', 'ALL' and 'UID <set>' criteria are supported
+        with self.server.lock:
+            messages = list(self.server.messages)
+            last_uid = self.server.last_uid
+        tokens = args.upper().split()
+        uids = set(message['uid'] for message in messages)
+        i = 0
+        while i < len(tokens):
+            if tokens[i] == 'UNSEEN':
+                uids &= set(message['uid'] for message in messages if not message['seen'])
+            elif tokens[i] == 'UID' and i + 1 < len(tokens):
+                uids &= parse_uid_set(tokens[i + 1], last_uid)
+                i += 1
+            i += 1
+        self.write('* SEARCH' + ''.join(' ' + str(uid) for uid in sorted(uids)))
+        self.write(tag + ' OK SEARCH completed')
+
+    def fetch(self, tag, args):
+        uid_set, items = args.split(' ', 1)
+        items = items.upper()
+        with self.server.lock:
+            messages = list(enumerate(self.server.messages, 1))
+            last_uid = self.server.last_uid
+        uids = parse_uid_set(uid_set, last_uid)
+        for num, message in messages:
+            if message['uid'] not in uids:
+                continue
+            data = message['data']
+            response = '* {0} FETCH (UID {1}'.format(num, message['uid'])
+            if 'RFC822.SIZE' in items:
+                response += ' RFC822.SIZE {0}'.format(len(data))
+            literal = None
+            if 'BODY.PEEK[HEADER]' in items or 'BODY[HEADER]' in items:
+                end = data.find(b'\r\n\r\n')
+                literal = data if end == -1 else data[:end + 4]
+                response += ' BODY[HEADER]'
+            elif 'BODY.PEEK[TEXT]<' in items or 'BODY[TEXT]<' in items:
+                start, count = re.search(r'\[TEXT\]<(\d+)\.(\d+)>', items).groups()
+                end = data.find(b'\r\n\r\n')
+                text = b'' if end == -1 else data[end + 4:]
+                literal = text[int(start):int(start) + int(count)]
+                response += ' BODY[TEXT]<{0}>'.format(start)
+            elif 'BODY.PEEK[]' in items or 'BODY[]' in items or 'RFC822' in items.split():
+                literal = data
+                response += ' BODY[]'
+            if literal is None:
+                self.write(response + ')')
+                continue
+            self.write(response.encode('utf-8') + ' {{{0}}}\r\n'.format(len(literal)).encode('ascii') + literal + b')\r\n')
+        self.write(tag + ' OK FETCH completed')
+
+    def store(self, tag, args):
+        uid_set, rest = args.split(' ', 1)
+        with self.server.lock:
+            uids = parse_uid_set(uid_set, self.server.last_uid)
+            for message in self.server.messages:
+                if message['uid'] in uids and '\\SEEN' in rest.upper():
+                    message['seen'] = not rest.startswith('-')
+        self.write(tag + ' OK STORE completed')
+
+    def idle(self, tag):
+        with self.server.lock:
+            count = len(self.server.messages)
+        self.write('+ idling')
+        while True:
+            with self.server.lock:
+                if len(self.server.messages) != count:
+                    count = len(self.server.messages)
+                    self.write('* {0} EXISTS'.format(count))
+            readable, _, _ = select.select([self.connection], [], [], 0.05)
+            if not readable:
+                continue
+            line = self.rfile.readline()
+            if not line:
+                return False
+            if line.strip().upper() == b'DONE':
+                self.write(tag + ' OK IDLE terminated')
+                return True
+
+class IMAPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, idle_supported=True):
+        super().__init__(address, IMAPHandler)
+        self.idle_supported = idle_supported
+        self.uidvalidity = int(time.time())
+        self.last_uid = 0
+        self.messages = []
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def add_connection(self):
+        with self.lock:
+            self.connections += 1
+
+    def add_message(self, data):
+        #IMAP literals are sent with CRLF line endings
+        data = re.sub(rb'\r?\n', b'\r\n', data)
+        with self.lock:
+            self.last_uid += 1
+            self.messages.append({'uid': self.last_uid, 'seen': False, 'data': data})
+            return self.last_uid
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 1143
+    server = IMAPServer(('127.0.0.1', port))
+    if len(sys.argv) > 2:
+        for name in sorted(os.listdir(sys.argv[2])):
+            if name.endswith('.eml'):
+                with open(sys.argv[2] + '/' + name, 'rb') as file:
+                    server.add_message(file.read())
+    print('Listening on 127.0.0.1:{0}'.format(port))
+    server.serve_forever()
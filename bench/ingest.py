@@ -0,0 +1,77 @@
+#Measures how fast a burst of e-mailed solutions is parsed and queued by MailMonitor,
+#e.g. a whole class submitting right before a deadline.
+#Usage: python3 bench/ingest.py [messages] [batch size]
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import database
+from app import App
+from mailmon import MailMonitor
+
+SOURCE = '''#include <iostream>
+int main() {
+    long long a, b;
+    std::cin >> a >> b;
+    std::cout << a + b << std::endl;
+}
+'''
+
+def make_email(i):
+    message = EmailMessage()
+    message['From'] = 'Student {0} <student{0}@example.com>'.format(i % 30)
+    message['Date'] = 'Sun, 18 Oct 2026 10:00:00 +0000'
+    message['Subject'] = 'Solution'
+    message.set_content('task=1\nlanguage=C++\n')
+    message.add_attachment(SOURCE.encode('utf-8') * 20, maintype='application',
+                           subtype='octet-stream', filename='main.cpp')
+    return message.as_bytes()
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else config.MAILMON_FETCH_BATCH
+    work_dir = tempfile.mkdtemp(prefix='ingest-bench-')
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        app = App(config.SMTP_SERVER, config.SMTP_PORT, config.LOGIN, config.PASSWORD)
+        conn = database.connect()
+        app.try_create_solutions_table(conn)
+        conn.close()
+        mailmon = MailMonitor(config.IMAP_SERVER, config.IMAP_PORT, config.LOGIN, config.PASSWORD)
+        mailmon.recover()
+        emails = [make_email(i) for i in range(count)]
+        parse_time = 0.0
+        ingest_time = 0.0
+        for i in range(0, count, batch_size):
+            start = time.perf_counter()
+            messages = [mailmon.get_message(raw) for raw in emails[i:i + batch_size]]
+            parse_time += time.perf_counter() - start
+            start = time.perf_counter()
+            mailmon.apply_messages(messages, list(range(i + 1, i + len(messages) + 1)))
+            ingest_time += time.perf_counter() - start
+        conn = database.connect()
+        queued = conn.execute('SELECT count(*) FROM solutions').fetchone()[0]
+        conn.close()
+        print(json.dumps({
+            'benchmark': 'ingest',
+            'messages': count,
+            'batch_size': batch_size,
+            'queued': queued,
+            'parse_seconds': round(parse_time, 4),
+            'ingest_seconds': round(ingest_time, 4),
+            'messages_per_second': round(count / (parse_time + ingest_time), 1),
+        }))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
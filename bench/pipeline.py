@@ -0,0 +1,379 @@
+#End-to-end benchmark of the whole verifier. Synthetic submissions are put into a stand-in IMAP server,
+#the verifier runs as the supervisor process like in production, and verdicts are collected
+#from a stand-in SMTP server. Works offline, results are printed as JSON so that runs can be compared.
+#With --restart-after the verifier is stopped gracefully in the middle of the run and started again,
+#to measure the restart and the work that is lost or repeated.
+#Must be run as root, like the verifier itself.
+#Usage: sudo python3 bench/pipeline.py [--submissions 100] [--rate 0] [--workers 0] [--output result.json]
+import os
+import re
+import sys
+import json
+import time
+import email
+import email.utils
+import email.message
+import random
+import socket
+import shutil
+import signal
+import logging
+import argparse
+import platform
+import tempfile
+import multiprocessing
+import psutil
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import config
+from imap_server import IMAPServer
+from smtp_server import SMTPServer
+
+#Expected verdicts of the synthetic submissions
+KINDS = {
+    'ac'  : 'Accepted',
+    'wa'  : 'Wrong Answer',
+    'tle' : 'Time Limit Exceeded',
+    'mle' : 'Memory Limit Exceeded',
+    'ce'  : 'Compilation Error',
+    'ole' : 'Output Limit Exceeded',
+}
+
+#Share of every kind among the generated submissions
+KIND_WEIGHTS = {'ac': 50, 'wa': 15, 'tle': 10, 'mle': 5, 'ce': 10, 'ole': 10}
+
+#'sum' task: a b --> a + b, 'io' task: n numbers --> every number doubled, one per line
+SOURCES = {
+    ('sum', 'ac', 'C++') : '#include <iostream>\nint main() { long long a, b; std::cin >> a >> b; std::cout << a + b << std::endl; }\n',
+    ('sum', 'ac', 'C')   : '#include <stdio.h>\nint main(void) { long long a, b; scanf("%lld %lld", &a, &b); printf("%lld\\n", a + b); return 0; }\n',
+    ('sum', 'wa', 'C++') : '#include <iostream>\nint main() { long long a, b; std::cin >> a >> b; std::cout << a - b << std::endl; }\n',
+    ('sum', 'wa', 'C')   : '#include <stdio.h>\nint main(void) { long long a, b; scanf("%lld %lld", &a, &b); printf("%lld\\n", a - b); return 0; }\n',
+    ('sum', 'tle', 'C++'): 'int main() { volatile unsigned long long x = 0; for (;;) x++; }\n',
+    ('sum', 'tle', 'C')  : 'int main(void) { volatile unsigned long long x = 0; for (;;) x++; }\n',
+    ('sum', 'mle', 'C++'): '#include <cstdlib>\n#include <cstring>\nint main() { for (;;) { char *p = (char *)malloc(1 << 20); if (!p) return 1; memset(p, 1, 1 << 20); } }\n',
+    ('sum', 'mle', 'C')  : '#include <stdlib.h>\n#include <string.h>\nint main(void) { for (;;) { char *p = malloc(1 << 20); if (!p) return 1; memset(p, 1, 1 << 20); } }\n',
+    ('sum', 'ce', 'C++') : 'int main() { return x; }\n',
+    ('sum', 'ce', 'C')   : 'int main(void) { return x; }\n',
+    ('sum', 'ole', 'C++'): '#include <cstdio>\nint main() { for (;;) puts("flood flood flood flood flood flood flood"); }\n',
+    ('sum', 'ole', 'C')  : '#include <stdio.h>\nint main(void) { for (;;) puts("flood flood flood flood flood flood flood"); }\n',
+    ('io', 'ac', 'C++')  : '#include <cstdio>\nint main() { int n; long long x; scanf("%d", &n); while (n--) { scanf("%lld", &x); printf("%lld\\n", 2 * x); } }\n',
+    ('io', 'ac', 'C')    : '#include <stdio.h>\nint main(void) { int n; long long x; scanf("%d", &n); while (n--) { scanf("%lld", &x); printf("%lld\\n", 2 * x); } return 0; }\n',
+    ('io', 'wa', 'C++')  : '#include <cstdio>\nint main() { int n; long long x; scanf("%d", &n); while (n--) { scanf("%lld", &x); printf("%lld\\n", x); } }\n',
+    ('io', 'wa', 'C')    : '#include <stdio.h>\nint main(void) { int n; long long x; scanf("%d", &n); while (n--) { scanf("%lld", &x); printf("%lld\\n", x); } return 0; }\n',
+}
+
+EXTENSIONS = {'C++': 'cpp', 'C': 'c'}
+
+def write_task(tasks_dir, name, tests, output_limit):
+    task_dir = tasks_dir + '/' + name
+    os.makedirs(task_dir)
+    for i, (test_input, test_output) in enumerate(tests, 1):
+        with open('{0}/{1}.in'.format(task_dir, i), 'w') as file:
+            file.write(test_input)
+        with open('{0}/{1}.out'.format(task_dir, i), 'w') as file:
+            file.write(test_output)
+    with open(task_dir + '/task_info.ini', 'w') as file:
+        file.write('[general]\nparallel=no\noutput={0}\ncompare=exact\n\n'.format(output_limit))
+        for language in EXTENSIONS:
+            file.write('[{0}]\nmemory=64\ntime=1.0\n\n'.format(language))
+
+def create_tasks(tasks_dir, tests_count, io_size, rnd):
+    tests = []
+    for i in range(tests_count):
+        a = rnd.randint(-10 ** 9, 10 ** 9)
+        b = rnd.randint(1, 10 ** 9)
+        tests.append(('{0} {1}\n'.format(a, b), '{0}\n'.format(a + b)))
+    write_task(tasks_dir, 'sum', tests, 1)
+    #Every number takes about 10 bytes
+    count = max(1, int(io_size * 1024 * 1024 / 10))
+    tests = []
+    for i in range(3):
+        numbers = [rnd.randint(-10 ** 8, 10 ** 8) for j in range(count)]
+        tests.append(('{0}\n{1}\n'.format(count, ' '.join(map(str, numbers))),
+                      ''.join('{0}\n'.format(2 * x) for x in numbers)))
+    write_task(tasks_dir, 'io', tests, int(io_size * 4) + 1)
+
+def create_submissions(count, io_share, rnd):
+    kinds = [kind for kind, weight in KIND_WEIGHTS.items() for i in range(weight)]
+    submissions = []
+    for i in range(count):
+        language = rnd.choice(list(EXTENSIONS))
+        if rnd.random() < io_share:
+            task, kind = 'io', rnd.choice(('ac', 'ac', 'ac', 'wa'))
+        else:
+            task, kind = 'sum', rnd.choice(kinds)
+        #Every source is unique, like real submissions, so the build cache doesn't hide compilation
+        source = '/* submission {0} */\n'.format(i) + SOURCES[(task, kind, language)]
+        submissions.append({'sender': 'student{0}@bench.example.com'.format(i), 'task': task,
+                            'kind': kind, 'language': language, 'source': source})
+    return submissions
+
+def make_email(submission):
+    message = email.message.EmailMessage()
+    message['From'] = '<{0}>'.format(submission['sender'])
+    message['To'] = config.LOGIN
+    message['Date'] = email.utils.formatdate(localtime=True)
+    message['Subject'] = 'Solution'
+    message.set_content('task={0}\nlanguage={1}\n'.format(submission['task'], submission['language']))
+    message.add_attachment(submission['source'].encode('utf-8'), maintype='application', subtype='octet-stream',
+                           filename='main.' + EXTENSIONS[submission['language']])
+    return message.as_bytes()
+
+def get_verdict(data):
+    message = email.message_from_bytes(data)
+    for part in message.walk():
+        if part.get_content_type() == 'text/plain':
+            text = part.get_payload(decode=True).decode('utf-8', 'replace')
+            match = re.search(r'### Result: (.*) ###', text)
+            if match:
+                return match.group(1)
+    return None
+
+def setup_logging():
+    logging.basicConfig(filename='log.txt',
+                        format='[%(asctime)s][%(levelname)s]: %(message)s',
+                        datefmt='%d %b %Y %H:%M:%S',
+                        level=logging.DEBUG)
+
+def run_verifier():
+    #Own process group, so the judge workers and solutions are killed together with the verifier
+    os.setpgrp()
+    setup_logging()
+    from supervisor import Supervisor
+    Supervisor().run()
+
+def run_agent(name, workers):
+    os.setpgrp()
+    setup_logging()
+    from agent import Agent
+    Agent(config.COORDINATOR_URL, name, workers).run()
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def get_cpu_times(processes):
+    own = 0.0
+    children = 0.0
+    for process in processes:
+        try:
+            times = process.cpu_times()
+        except psutil.Error:
+            continue
+        own += times.user + times.system
+        children += times.children_user + times.children_system
+    return own, children
+
+def get_stage_percentiles():
+    import database
+    import metrics
+    conn = database.connect()
+    try:
+        values = metrics.get_values(conn, 'wall', 0, time.time())
+    finally:
+        conn.close()
+    stages = {}
+    for stage, stage_values in sorted(values.items()):
+        stages[stage] = {'count': len(stage_values),
+                         'p50': round(metrics.percentile(stage_values, 0.5), 4),
+                         'p95': round(metrics.percentile(stage_values, 0.95), 4)}
+    return stages
+
+def get_lost_work():
+    #Solutions interrupted by the restart and the judging time spent on them before it
+    import database
+    conn = database.connect()
+    try:
+        return conn.execute("SELECT count(*), coalesce(sum(wall), 0) FROM timings WHERE stage = 'requeue'").fetchone()
+    finally:
+        conn.close()
+
+def percentile(values, q):
+    import metrics
+    value = metrics.percentile(sorted(values), q)
+    return None if value is None else round(value, 3)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='End-to-end verifier benchmark')
+    parser.add_argument('--submissions', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=0, help='submissions per minute, 0 - all at once')
+    parser.add_argument('--workers', type=int, default=config.VERIFIER_WORKERS, help='0 - one per CPU core')
+    parser.add_argument('--tests', type=int, default=30, help='number of tests of the small task')
+    parser.add_argument('--io-size', type=float, default=2.0, help='Mb, input size of every large test')
+    parser.add_argument('--io-share', type=float, default=0.2, help='share of submissions for the large task')
+    parser.add_argument('--limits-mode', default=config.LIMITS_MODE, choices=('rlimit', 'poll'))
+    parser.add_argument('--apparmor', action='store_true', help='enforce AppArmor profiles')
+    parser.add_argument('--agents', type=int, default=0,
+                        help='judge only with this number of agents on this machine, every agent has --workers workers')
+    parser.add_argument('--workspace', default=config.WORKSPACE_DIR, help="temp dirs of the workers, '' - on disk")
+    parser.add_argument('--restart-after', type=int, default=0,
+                        help='stop the verifier with SIGTERM after this number of verdicts and start it again, 0 - never')
+    parser.add_argument('--no-idle', action='store_true', help='IMAP server without IDLE, mailmon polls')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=900, help='sec')
+    parser.add_argument('--output', help='also write the JSON result to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the work dir')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if os.getuid() != 0:
+        print('You should run the benchmark with sudo privileges!')
+        sys.exit(1)
+    rnd = random.Random(args.seed)
+    work_dir = tempfile.mkdtemp(prefix='pipeline-bench-')
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    imap_server = IMAPServer(('127.0.0.1', 0), not args.no_idle).start()
+    smtp_server = SMTPServer(('127.0.0.1', 0)).start()
+    config.IMAP_SERVER, config.IMAP_PORT = imap_server.server_address
+    config.SMTP_SERVER, config.SMTP_PORT = smtp_server.server_address
+    config.IMAP_SSL = False
+    config.SMTP_SSL = False
+    config.LOGIN = 'verifier@bench.example.com'
+    config.TASKS_DIR = work_dir + '/tasks'
+    config.REPORT_FILE = work_dir + '/report.html'
+    config.VERIFIER_WORKERS = args.workers
+    config.LIMITS_MODE = args.limits_mode
+    config.APPARMOR = args.apparmor
+    config.WORKSPACE_DIR = args.workspace
+    config.DAILY_ATTEMPTS_LIMIT = 0
+    #Submissions of the same source compile to the same binary, cached verdicts would skip judging
+    config.VERDICT_CACHE_SIZE = 0
+    if args.agents > 0:
+        config.COORDINATOR_PORT = get_free_port()
+        config.COORDINATOR_URL = 'http://127.0.0.1:{0}'.format(config.COORDINATOR_PORT)
+        config.COORDINATOR_LOCAL_WORKERS = False
+    create_tasks(config.TASKS_DIR, args.tests, args.io_size, rnd)
+    submissions = create_submissions(args.submissions, args.io_share, rnd)
+    by_sender = dict((submission['sender'], submission) for submission in submissions)
+    processes = [multiprocessing.Process(target=run_verifier)]
+    restart = None
+    agent_workers = args.workers if args.workers > 0 else os.cpu_count() or 1
+    for i in range(args.agents):
+        processes.append(multiprocessing.Process(target=run_agent, args=('bench{0}'.format(i), agent_workers)))
+    try:
+        for process in processes:
+            process.start()
+        start = time.time()
+        for i, submission in enumerate(submissions):
+            if args.rate > 0:
+                time.sleep(max(0, start + i * 60 / args.rate - time.time()))
+            submission['submitted'] = time.time()
+            imap_server.add_message(make_email(submission))
+        received = 0
+        duplicates = 0
+        while time.time() - start < args.timeout:
+            with smtp_server.lock:
+                messages = list(smtp_server.messages)
+            for arrived, sender, receivers, data in messages[received:]:
+                submission = by_sender.get(receivers[0])
+                if submission is not None and 'verdict' in submission:
+                    #Judged again after the restart
+                    duplicates += 1
+                if submission is not None and 'verdict' not in submission:
+                    submission['verdict'] = get_verdict(data)
+                    submission['turnaround'] = arrived - submission['submitted']
+                    submission['finished'] = arrived
+            received = len(messages)
+            if args.restart_after > 0 and restart is None and received >= args.restart_after:
+                stopped_at = time.time()
+                os.kill(processes[0].pid, signal.SIGTERM)
+                processes[0].join()
+                restart = {'after': received, 'stop_seconds': round(time.time() - stopped_at, 3)}
+                processes[0] = multiprocessing.Process(target=run_verifier)
+                processes[0].start()
+            if all('verdict' in submission for submission in submissions):
+                break
+            time.sleep(0.1)
+        verifier = [psutil.Process(process.pid) for process in processes]
+        for process in list(verifier):
+            try:
+                verifier += process.children(recursive=True)
+            except psutil.Error:
+                pass
+        own_cpu, children_cpu = get_cpu_times(verifier)
+    finally:
+        for process in processes:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            process.join()
+        imap_server.shutdown()
+        smtp_server.shutdown()
+    completed = [s for s in submissions if 'verdict' in s]
+    duration = max(s['finished'] for s in completed) - start if completed else 0
+    verdicts = {}
+    unexpected = []
+    for submission in completed:
+        verdicts[submission['verdict']] = verdicts.get(submission['verdict'], 0) + 1
+        if submission['verdict'] != KINDS[submission['kind']]:
+            unexpected.append((submission['task'], submission['kind'], submission['language'], submission['verdict']))
+    turnarounds = [s['turnaround'] for s in completed]
+    result = {
+        'benchmark': 'pipeline',
+        'params': {
+            'submissions': args.submissions,
+            'rate': args.rate,
+            'workers': args.workers,
+            'agents': args.agents,
+            'tests': args.tests,
+            'io_size': args.io_size,
+            'io_share': args.io_share,
+            'limits_mode': args.limits_mode,
+            'apparmor': args.apparmor,
+            'idle': not args.no_idle,
+            'restart_after': args.restart_after,
+            'seed': args.seed,
+        },
+        'environment': {
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'submitted': len(submissions),
+        'completed': len(completed),
+        'duration_seconds': round(duration, 3),
+        'submissions_per_minute': round(len(completed) / duration * 60, 2) if duration > 0 else None,
+        'turnaround_seconds': {
+            'p50': percentile(turnarounds, 0.5),
+            'p95': percentile(turnarounds, 0.95),
+            'max': percentile(turnarounds, 1.0),
+        },
+        'verdicts': verdicts,
+        'unexpected_verdicts': len(unexpected),
+        'unexpected_examples': unexpected[:10],
+        'cpu_seconds': {
+            #CPU time of the verifier processes themselves, i.e. the judging overhead
+            'verifier': round(own_cpu, 3),
+            'verifier_per_submission': round(own_cpu / len(completed), 4) if completed else None,
+            #Compilers, solutions and task checkers
+            'children': round(children_cpu, 3),
+        },
+        'stages': get_stage_percentiles(),
+    }
+    if restart is not None:
+        restart['interrupted'], lost = get_lost_work()
+        restart['lost_judging_seconds'] = round(lost, 3)
+        restart['duplicate_responses'] = duplicates
+        result['restart'] = restart
+    os.chdir(cwd)
+    if not args.keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    else:
+        result['work_dir'] = work_dir
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    if len(completed) < len(submissions):
+        sys.exit(2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#Minimal SMTP server that accepts everything, used instead of a real mail server
+#for testing and benchmarks. Usage: python3 smtp_server.py [port] [dir]
+import os
+import sys
+import time
+import threading
+import socketserver
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def write(self, line):
+        self.wfile.write((line + '\r\n').encode('utf-8'))
+
+    def read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b'.\r\n', b'.\n'):
+                break
+            if line.startswith(b'..'):
+                line = line[1:]
+            lines.append(line)
+        return b''.join(lines)
+
+    def handle(self):
+        self.server.add_connection()
+        self.write('220 localhost Stand-in SMTP server')
+        sender = None
+        receivers = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.write('250-localhost')
+                self.write('250 AUTH PLAIN LOGIN')
+            elif verb == 'HELO':
+                self.write('250 localhost')
+            elif verb == 'AUTH':
+                self.write('235 Authentication successful')
+            elif verb == 'MAIL':
+                sender = command[10:].strip('<> ')
+                receivers = []
+                self.write('250 OK')
+            elif verb == 'RCPT':
+                receivers.append(command[8:].strip('<> '))
+                self.write('250 OK')
+            elif verb == 'DATA':
+                self.write('354 End data with <CR><LF>.<CR><LF>')
+                self.server.add_message(sender, receivers, self.read_data())
+                self.write('250 OK')
+            elif verb in ('RSET', 'NOOP'):
+                self.write('250 OK')
+            elif verb == 'QUIT':
+                self.write('221 Bye')
+                return
+            else:
+                self.write('502 Command not implemented')
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, messages_dir=None):
+        super().__init__(address, SMTPHandler)
+        self.messages_dir = messages_dir
+        self.messages = []
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def add_connection(self):
+        with self.lock:
+            self.connections += 1
+
+    def add_message(self, sender, receivers, data):
+        with self.lock:
+            self.messages.append((time.time(), sender, receivers, data))
+            count = len(self.messages)
+        if self.messages_dir is not None:
+            with open('{0}/{1}.eml'.format(self.messages_dir, count), 'wb') as file:
+                file.write(data)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 2525
+    messages_dir = sys.argv[2] if len(sys.argv) > 2 else None
+    if messages_dir is not None:
+        os.makedirs(messages_dir, exist_ok=True)
+    server = SMTPServer(('127.0.0.1', port), messages_dir)
+    print('Listening on 127.0.0.1:{0}'.format(port))
+    server.serve_forever()
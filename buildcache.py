@@ -0,0 +1,98 @@
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+from status import Status
+
+#Cache entry layout:
+#<cache_dir>/<key>/status           --> compilation status
+#<cache_dir>/<key>/compiler_output  --> compiler stdout and stderr
+#<cache_dir>/<key>/target           --> compiled binary (only for Status.OK)
+#Entry mtime is used as the last access time for LRU eviction.
+
+class BuildCache:
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def is_enabled(self):
+        return self.max_size > 0
+
+    def get_key(self, language, command, files):
+        key = hashlib.sha256()
+        key.update(language.encode('utf-8') + b'\0')
+        key.update(command.encode('utf-8') + b'\0')
+        for path in sorted(files, key=os.path.basename):
+            key.update(os.path.basename(path).encode('utf-8') + b'\0')
+            content = hashlib.sha256()
+            with open(path, 'rb') as file:
+                for chunk in iter(lambda: file.read(65536), b''):
+                    content.update(chunk)
+            key.update(content.digest())
+        return key.hexdigest()
+
+    def load(self, key, target, compiler_output_path):
+        entry = os.path.join(self.cache_dir, key)
+        try:
+            with open(entry + '/status', 'r') as file:
+                status = int(file.read())
+            shutil.copyfile(entry + '/compiler_output', compiler_output_path)
+            if status == Status.OK:
+                shutil.copy2(entry + '/target', target)
+            os.utime(entry)
+        except (OSError, ValueError):
+            self.misses += 1
+            logging.info('Build cache miss: {0} (hits: {1}, misses: {2})'.format(key, self.hits, self.misses))
+            return None
+        self.hits += 1
+        logging.info('Build cache hit: {0} (hits: {1}, misses: {2})'.format(key, self.hits, self.misses))
+        return status
+
+    def store(self, key, status, target, compiler_output_path):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = os.path.join(self.cache_dir, key)
+        staging = tempfile.mkdtemp(prefix='.tmp-', dir=self.cache_dir)
+        try:
+            with open(staging + '/status', 'w') as file:
+                file.write(str(status))
+            shutil.copyfile(compiler_output_path, staging + '/compiler_output')
+            if status == Status.OK:
+                shutil.copy2(target, staging + '/target')
+            os.rename(staging, entry)
+        except OSError:
+            #Another worker has stored the same entry
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict()
+
+    def get_entry_size(self, path):
+        size = 0
+        for file in os.scandir(path):
+            size += file.stat().st_size
+        return size
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            try:
+                mtime = entry.stat().st_mtime
+                if entry.name.startswith('.'):
+                    #Staging dirs left by crashed workers
+                    if time.time() - mtime > 3600:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    continue
+                size = self.get_entry_size(entry.path)
+            except OSError:
+                continue
+            entries.append((mtime, size, entry.path))
+            total_size += size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total_size -= size
@@ -5,9 +5,26 @@ import os
 import shutil
 import sys
 import shlex
-import configparser
+import math
+import hashlib
+import logging
+import traceback
+import signal
+import resource
+import subprocess
+import select
+import threading
+import functools
+import concurrent.futures
 import config
 from status import Status
+from buildcache import BuildCache
+from testcache import TestCache, make_private_dir
+from verdictcache import VerdictCache
+from comparator import Comparator
+from metrics import Timing, Stopwatch
+from launcher import get_launcher
+import apparmor
 
 #[[$SRC_FILES...]] usage examples:
 #[[$SRC_FILES...]]         --> a.cppb.cppc.cpp
@@ -19,11 +36,33 @@ from status import Status
 #[[$SRC_FILES_RHEAD]]      --> c.cpp
 
 COMPILE_COMMANDS = {
-    'C++' : 'g++ [[$SRC_FILES... ]] -o [[$TARGET_PATH]] -std=c++14 -O2',
+    'C++' : 'g++ [[$SRC_FILES... ]] -o [[$TARGET_PATH]] [[-I$PCH_DIR]] -std=c++14 -O2',
     'C'   : 'gcc [[$SRC_FILES... ]] -o [[$TARGET_PATH]] -std=c11 -O2',
     'C#'  : 'mcs [[$SRC_FILES... ]] -out:[[$TARGET_PATH]] -optimize',
 }
 
+#Solutions with several translation units are compiled one unit at a time in parallel and then linked,
+#object files are kept in the build cache, so a resubmission recompiles only the changed units
+OBJECT_COMMANDS = {
+    'C++' : 'g++ -c [[$SRC_FILES_HEAD]] -o [[$TARGET_PATH]] [[-I$PCH_DIR]] -std=c++14 -O2',
+    'C'   : 'gcc -c [[$SRC_FILES_HEAD]] -o [[$TARGET_PATH]] -std=c11 -O2',
+}
+
+LINK_COMMANDS = {
+    'C++' : 'g++ [[$SRC_FILES... ]] -o [[$TARGET_PATH]]',
+    'C'   : 'gcc [[$SRC_FILES... ]] -o [[$TARGET_PATH]]',
+}
+
+HEADER_EXTENSIONS = ('.h', '.hpp', '.hxx')
+
+#Precompiled header, flags must be the same as in the compile commands or gcc silently ignores it.
+#It is built once per compiler version and used by '#include <bits/stdc++.h>'
+PCH_COMMANDS = {
+    'C++' : 'g++ -x c++-header [[$SRC_FILES_HEAD]] -o [[$TARGET_PATH]] -std=c++14 -O2',
+}
+
+PCH_HEADER = 'bits/stdc++.h'
+
 EXTENSIONS = {
     'C++' : ('.cpp', '.hpp', '.cxx', '.hxx', '.c', '.h', ),
     'C'   : ('.c', '.h'),
@@ -67,24 +106,223 @@ APPARMOR_PROFILES = {
 ''',
 }
 
+#Every language has its own target path in a worker temp dir, so every path has a single AppArmor profile
+TARGET_NAMES = {
+    'C++' : 'target_cpp',
+    'C'   : 'target_c',
+    'C#'  : 'target_cs',
+}
+
+build_cache = BuildCache(config.BUILD_CACHE_DIR, config.BUILD_CACHE_SIZE * 1024 * 1024)
+test_cache = TestCache(config.TEST_CACHE_DIR, config.TEST_CACHE_SIZE * 1024 * 1024)
+verdict_cache = VerdictCache(config.VERDICT_CACHE_DIR, config.VERDICT_CACHE_SIZE * 1024 * 1024)
+
+#Address space limits break runtimes that reserve a lot of virtual memory
+MEMORY_RLIMITS = {
+    'C++' : resource.RLIMIT_AS,
+    'C'   : resource.RLIMIT_AS,
+    'C#'  : None,
+}
+
+#Without a memory cgroup (see launcher.py) an allocation over the address space limit fails instead of
+#getting the target OOM killed, the runtime reports it to stderr like this
+ALLOCATION_FAILURES = {
+    'C++' : b'std::bad_alloc',
+    'C'   : None,
+    'C#'  : None,
+}
+
+#Language --> dir with the precompiled header or None, per process
+pch_dirs = {}
+
+def build_pch(language):
+    cmd = PCH_COMMANDS[language]
+    compiler = shlex.split(cmd)[0]
+    version = subprocess.run([compiler, '--version'], stdout=subprocess.PIPE, check=True).stdout
+    key = hashlib.sha256(version + b'\0' + cmd.encode('utf-8')).hexdigest()
+    pch_dir = os.path.abspath(config.PCH_DIR + '/' + key)
+    pch_path = pch_dir + '/' + PCH_HEADER + '.gch'
+    if os.path.exists(pch_path):
+        return pch_dir
+    os.makedirs(os.path.dirname(pch_path), exist_ok=True)
+    staging = '{0}.{1}'.format(pch_path, os.getpid())
+    source = staging + '.h'
+    with open(source, 'w') as file:
+        file.write('#include <{0}>\n'.format(PCH_HEADER))
+    cmd = cmd.replace('[[$SRC_FILES_HEAD]]', source).replace('[[$TARGET_PATH]]', staging)
+    try:
+        process = subprocess.run(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 timeout=config.COMPILATION_TIME_LIMIT)
+        if process.returncode != 0:
+            raise Exception('Unable to build precompiled header: ' + process.stdout.decode('utf-8', 'replace'))
+        os.rename(staging, pch_path)
+    finally:
+        os.remove(source)
+    return pch_dir
+
+def get_pch_dir(language):
+    if not config.PCH_DIR or language not in PCH_COMMANDS:
+        return None
+    if language not in pch_dirs:
+        try:
+            pch_dirs[language] = build_pch(language)
+        except Exception:
+            #Solutions are still compiled, just slower
+            logging.warning('Precompiled header for {0} is not available: {1}'.format(language, traceback.format_exc()))
+            pch_dirs[language] = None
+    return pch_dirs[language]
+
+#Everything besides the binary and the task that may change a verdict
+def get_judge_settings(language):
+    return (RUN_COMMANDS[language], MEMORY_RLIMITS[language], config.LIMITS_MODE, config.WALL_TIME_LIMIT_FACTOR,
+            config.MEMORY_RLIMIT_FACTOR, config.OUTPUT_LIMIT, config.COMPARE_MODE, config.COMPARE_EPSILON,
+            config.PARALLEL_TESTS, APPARMOR_PROFILES[language] if config.APPARMOR else None, config.MEMORY_CGROUPS)
+
+def get_workspace_dir():
+    #Solutions are executed from the workspace, so it can't be mounted with noexec
+    if config.WORKSPACE_DIR:
+        try:
+            make_private_dir(config.WORKSPACE_DIR)
+            if not os.statvfs(config.WORKSPACE_DIR).f_flag & os.ST_NOEXEC:
+                return config.WORKSPACE_DIR
+            logging.warning('Workspace {0} is mounted with noexec'.format(config.WORKSPACE_DIR))
+        except OSError:
+            logging.warning('Unable to create workspace: ' + traceback.format_exc())
+    return 'temp'
+
+def get_target_path(temp_dir, language):
+    return os.path.abspath(temp_dir + '/' + TARGET_NAMES[language])
+
+def get_apparmor_profile(language, target):
+    return APPARMOR_PROFILES[language].replace('[[$TARGET_PATH]]', target)
+
+def load_apparmor_profiles(temp_dirs):
+    #Called once before workers are started, returns the number of profiles that had to be reloaded
+    loaded_profiles = apparmor.get_loaded_profiles()
+    reloaded = 0
+    for temp_dir in temp_dirs:
+        for language in APPARMOR_PROFILES:
+            target = get_target_path(temp_dir, language)
+            if apparmor.load_profile(target, get_apparmor_profile(language, target), loaded_profiles):
+                reloaded += 1
+    return reloaded
+
+#Targets are started by the launcher (see launcher.py), which also enforces the wall clock limit
+class TargetProcess:
+    def __init__(self, args, stdin_path, stdout_path, stderr_path, limits, memory, timeout):
+        self.launcher = get_launcher()
+        self.request_id = self.launcher.start(args, stdin_path, stdout_path, stderr_path, limits, memory, timeout)
+        self.killed = False
+        self.cgroup = False
+        self.oom_killed = False
+
+    def kill(self):
+        self.launcher.kill(self.request_id)
+
+    def wait(self):
+        result = self.launcher.wait(self.request_id)
+        self.killed = result['killed']
+        self.cgroup = result['cgroup']
+        self.oom_killed = result['oom_killed']
+        return result['code'], result['utime'] + result['stime'], result['maxrss'] / 1024
+
+#Task checker protocol:
+#once mode       --> checker <input> <output> <answer>, exit code 0 - OK, 1 - WA,
+#                    the first line of its output is sent to the user
+#persistent mode --> checker is started once, reads lines '<input>\t<output>\t<answer>'
+#                    from stdin and answers with lines 'OK [message]' or 'WA [message]'
+
+class TaskChecker:
+    def __init__(self, target, persistent):
+        self.target = target
+        self.persistent = persistent
+        self.process = None
+        self.lock = threading.Lock()
+
+    def check(self, input_path, output_path, etalon_path):
+        paths = [os.path.abspath(input_path), os.path.abspath(output_path), os.path.abspath(etalon_path)]
+        if self.persistent:
+            return self.check_persistent(paths)
+        process = subprocess.run([self.target] + paths, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 timeout=config.TASK_CHECKER_TIME_LIMIT)
+        output = process.stdout.decode('utf-8', 'replace').strip()
+        message = output.split('\n')[0]
+        if process.returncode == 0:
+            return True, message
+        elif process.returncode == 1:
+            return False, message
+        raise Exception('Task checker failed with exit code {0}: {1}'.format(process.returncode, output))
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    def check_persistent(self, paths):
+        with self.lock:
+            if self.process is None or self.process.poll() is not None:
+                self.process = subprocess.Popen([self.target], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                                universal_newlines=True)
+            self.process.stdin.write('\t'.join(paths) + '\n')
+            self.process.stdin.flush()
+            ready, _, _ = select.select([self.process.stdout], [], [], config.TASK_CHECKER_TIME_LIMIT)
+            response = self.process.stdout.readline() if ready else ''
+            if not response:
+                self.stop()
+                raise Exception('Task checker has not responded')
+        verdict, _, message = response.rstrip('\n').partition(' ')
+        if verdict == 'OK':
+            return True, message
+        elif verdict == 'WA':
+            return False, message
+        raise Exception('Unexpected task checker response: ' + response)
+
+#Task checkers are kept between solutions, so persistent checkers are started once per worker
+task_checkers = {}
+
+def get_task_checker(target, persistent):
+    key = (target, persistent)
+    if key not in task_checkers:
+        task_checkers[key] = TaskChecker(target, persistent)
+    return task_checkers[key]
+
 class Checker:
-    def __init__(self, language, solution_dir, task_dir, temp_dir):
+    def __init__(self, language, solution_dir, task, temp_dir):
         self.language = language
         self.solution_dir = solution_dir
-        self.task_dir = task_dir
+        self.task = task
+        self.task_dir = task.path
         self.temp_dir = temp_dir
         self.solution_files = []
         for file in os.listdir(solution_dir):
             if file.endswith(EXTENSIONS[language]):
                 self.solution_files.append(solution_dir + '/' + file)
-        self.target = os.path.abspath(temp_dir + '/target')
-        config = configparser.ConfigParser()
-        config.read(task_dir + '/task_info.ini')
-        self.memory_limit = float(config[language]['memory'])
-        self.time_limit = float(config[language]['time'])
+        self.target = get_target_path(temp_dir, language)
+        task_info = task.info
+        self.memory_limit, self.time_limit = task.get_limits(language)
+        self.parallel = task_info.getboolean('general', 'parallel', fallback=config.PARALLEL_TESTS)
+        self.compare_mode = task_info.get('general', 'compare', fallback=config.COMPARE_MODE)
+        self.epsilon = task_info.getfloat('general', 'epsilon', fallback=config.COMPARE_EPSILON)
+        self.output_limit = task_info.getfloat('general', 'output', fallback=config.OUTPUT_LIMIT)
+        self.checker_source = task_info.get('general', 'checker', fallback=None)
+        self.checker_mode = task_info.get('general', 'checker_mode', fallback='once')
+        self.task_checker = None
+        self.messages = {}
         self.failed_test_num = -1
+        self.first_failed_test_num = None
+        self.processes = {}
+        self.usage = {}
+        self.cached_stderr = None
+        self.timings = []
+        self.run_args = None
+        self.rlimits = self.get_rlimits()
+        self.lock = threading.Lock()
 
-    def get_elements(self, cmd, varname):
+    #Templates are fixed, so every template is parsed once per process
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def get_elements(cmd, varname):
         regex = '{0}.*?{1}.*?{2}'.format(re.escape('[['), re.escape(varname), re.escape(']]'))
         return re.findall(regex, cmd, re.DOTALL)
 
@@ -110,115 +348,336 @@ class Checker:
             cmd = cmd.replace(e, replacement)
         return cmd
 
-    def replace_vars(self, cmd):
-        if len(self.solution_files) > 1:
-            cmd = self.replace_multiple(cmd, '$SRC_FILES_TAIL...', self.solution_files[1:])
-            cmd = self.replace_multiple(cmd, '$SRC_FILES_RTAIL...', self.solution_files[:-1])
+    def replace_vars(self, cmd, solution_files=None, target=None, pch_dir=None):
+        if solution_files is None:
+            solution_files = self.solution_files
+        if target is None:
+            target = self.target
+        if len(solution_files) > 1:
+            cmd = self.replace_multiple(cmd, '$SRC_FILES_TAIL...', solution_files[1:])
+            cmd = self.replace_multiple(cmd, '$SRC_FILES_RTAIL...', solution_files[:-1])
         else:
             cmd = self.replace_multiple(cmd, '$SRC_FILES_TAIL...')
             cmd = self.replace_multiple(cmd, '$SRC_FILES_RTAIL...')
-        if len(self.solution_files) > 0:
-            cmd = self.replace_multiple(cmd, '$SRC_FILES...', self.solution_files)
-            cmd = self.replace_single(cmd, '$SRC_FILES_HEAD', self.solution_files[0])
-            cmd = self.replace_single(cmd, '$SRC_FILES_RHEAD', self.solution_files[-1])
+        if len(solution_files) > 0:
+            cmd = self.replace_multiple(cmd, '$SRC_FILES...', solution_files)
+            cmd = self.replace_single(cmd, '$SRC_FILES_HEAD', solution_files[0])
+            cmd = self.replace_single(cmd, '$SRC_FILES_RHEAD', solution_files[-1])
         else:
             cmd = self.replace_multiple(cmd, '$SRC_FILES...')
             cmd = self.replace_single(cmd, '$SRC_FILES_HEAD')
             cmd = self.replace_single(cmd, '$SRC_FILES_RHEAD')
-        cmd = self.replace_single(cmd, '$TARGET_PATH', self.target)
+        cmd = self.replace_single(cmd, '$TARGET_PATH', target)
+        cmd = self.replace_single(cmd, '$PCH_DIR', pch_dir)
         return cmd
 
     def compile_solution(self):
-        cmd = self.replace_vars(COMPILE_COMMANDS[self.language])
-        with open(self.temp_dir + '/compiler_output', 'w') as outfile:
+        compiler_output_path = self.temp_dir + '/compiler_output'
+        if build_cache.is_enabled():
+            cache_key = build_cache.get_key(self.language, COMPILE_COMMANDS[self.language], self.solution_files)
+            status = build_cache.load(cache_key, self.target, compiler_output_path)
+            if status is not None:
+                return status
+        status = self.run_compiler(compiler_output_path)
+        #Compilation timeouts may be caused by the judge load, so they are not cached
+        if build_cache.is_enabled() and status != Status.COMPILATION_TIME_LIMIT_EXCEEDED:
+            build_cache.store(cache_key, status, self.target, compiler_output_path)
+        return status
+
+    def run_compiler(self, compiler_output_path):
+        sources = [file for file in self.solution_files if not file.endswith(HEADER_EXTENSIONS)]
+        if self.language in OBJECT_COMMANDS and len(sources) > 1:
+            return self.run_compiler_incremental(sources, compiler_output_path)
+        cmd = self.replace_vars(COMPILE_COMMANDS[self.language], pch_dir=get_pch_dir(self.language))
+        return self.run_compile_command(cmd, compiler_output_path, config.COMPILATION_TIME_LIMIT)
+
+    def run_compile_command(self, cmd, output_path, timeout):
+        with open(output_path, 'w') as outfile:
             process = psutil.Popen(shlex.split(cmd), stdout=outfile, stderr=outfile)
             try:
-                code = process.wait(timeout=config.COMPILATION_TIME_LIMIT)
-                if code != 0:
-                    outfile.close()
-                    return Status.COMPILATION_ERROR
-                outfile.close()
-                return Status.OK
+                code = process.wait(timeout=max(0, timeout))
             except psutil.TimeoutExpired:
-                outfile.close()
+                process.kill()
+                process.wait()
                 return Status.COMPILATION_TIME_LIMIT_EXCEEDED
-
-    def create_apparmor_profile(self):
-        devnull = open(os.devnull, 'w')
-        cmd = 'sudo aa-disable {0}'.format(self.target)
-        process = psutil.Popen(shlex.split(cmd), stdout=devnull, stderr=devnull)
-        process.wait(timeout=30)
-        profile_name = self.target.replace('/', '.')[1:]
-        profile_path = '/etc/apparmor.d/' + profile_name
-        profile = self.replace_vars(APPARMOR_PROFILES[self.language])
-        file = open(profile_path, 'w')
-        file.write(profile)
-        file.close()
-        cmd = 'sudo aa-enforce {0}'.format(self.target)
-        process = psutil.Popen(shlex.split(cmd), stdout=devnull, stderr=devnull)
-        code = process.wait(timeout=30)
         if code != 0:
-            raise Exception('Unable to enforce apparmor profile.')
+            return Status.COMPILATION_ERROR
+        return Status.OK
+
+    def compile_object(self, source, headers, deadline):
+        #Headers of the solution may be included by any unit, so they are a part of every object key
+        name = self.temp_dir + '/objects/' + os.path.basename(source)
+        object_path = name + '.o'
+        output_path = name + '.txt'
+        if build_cache.is_enabled():
+            command = OBJECT_COMMANDS[self.language] + '\0' + os.path.basename(source)
+            cache_key = build_cache.get_key(self.language, command, [source] + headers)
+            status = build_cache.load(cache_key, object_path, output_path)
+            if status is not None:
+                return status, object_path, output_path
+        cmd = self.replace_vars(OBJECT_COMMANDS[self.language], [source], object_path, get_pch_dir(self.language))
+        status = self.run_compile_command(cmd, output_path, deadline - time.monotonic())
+        if build_cache.is_enabled() and status != Status.COMPILATION_TIME_LIMIT_EXCEEDED:
+            build_cache.store(cache_key, status, object_path, output_path)
+        return status, object_path, output_path
+
+    def get_compilation_workers_count(self):
+        if config.COMPILATION_WORKERS > 0:
+            return config.COMPILATION_WORKERS
+        return os.cpu_count() or 1
+
+    def run_compiler_incremental(self, sources, compiler_output_path):
+        headers = [file for file in self.solution_files if file not in sources]
+        deadline = time.monotonic() + config.COMPILATION_TIME_LIMIT
+        os.makedirs(self.temp_dir + '/objects', exist_ok=True)
+        workers = min(len(sources), self.get_compilation_workers_count())
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            results = list(executor.map(lambda source: self.compile_object(source, headers, deadline), sources))
+        statuses = [status for status, object_path, output_path in results]
+        output_paths = [output_path for status, object_path, output_path in results]
+        if Status.COMPILATION_TIME_LIMIT_EXCEEDED in statuses:
+            status = Status.COMPILATION_TIME_LIMIT_EXCEEDED
+        elif Status.COMPILATION_ERROR in statuses:
+            status = Status.COMPILATION_ERROR
+        else:
+            objects = [object_path for status, object_path, output_path in results]
+            link_output_path = self.temp_dir + '/objects/link.txt'
+            cmd = self.replace_vars(LINK_COMMANDS[self.language], objects)
+            status = self.run_compile_command(cmd, link_output_path, deadline - time.monotonic())
+            output_paths.append(link_output_path)
+        with open(compiler_output_path, 'w') as outfile:
+            for output_path in output_paths:
+                with open(output_path, 'r') as file:
+                    outfile.write(file.read())
+        return status
+
+    def compile_task_checker(self):
+        source_path = self.task_dir + '/' + self.checker_source
+        language = 'C' if source_path.endswith('.c') else 'C++'
+        key = build_cache.get_key(language, COMPILE_COMMANDS[language], [source_path])
+        target = os.path.abspath(config.TASK_CHECKERS_DIR + '/' + key)
+        if os.path.exists(target):
+            return target
+        os.makedirs(config.TASK_CHECKERS_DIR, exist_ok=True)
+        staging = '{0}.{1}'.format(target, os.getpid())
+        cmd = self.replace_vars(COMPILE_COMMANDS[language], [source_path], staging, get_pch_dir(language))
+        process = subprocess.run(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 timeout=config.COMPILATION_TIME_LIMIT)
+        if process.returncode != 0:
+            raise Exception('Unable to compile task checker: ' + process.stdout.decode('utf-8', 'replace'))
+        os.rename(staging, target)
+        return target
+
+    def load_apparmor_profile(self):
+        apparmor.load_profile(self.target, get_apparmor_profile(self.language, self.target))
+
+    def add_timing(self, timing):
+        with self.lock:
+            self.timings.append(timing)
+
+    def get_timings(self):
+        return self.timings
+
+    def is_cancelled(self, test_num):
+        return self.first_failed_test_num is not None and test_num > self.first_failed_test_num
+
+    def get_rlimits(self):
+        cpu_time_limit = int(math.ceil(self.time_limit))
+        output_limit = int(self.output_limit * 1024 * 1024)
+        limits = [(resource.RLIMIT_CPU, cpu_time_limit, cpu_time_limit + 1),
+                  (resource.RLIMIT_CORE, 0, 0),
+                  (resource.RLIMIT_FSIZE, output_limit, output_limit)]
+        memory_rlimit = MEMORY_RLIMITS[self.language]
+        if memory_rlimit is not None:
+            size = int(self.memory_limit * config.MEMORY_RLIMIT_FACTOR * 1024 * 1024)
+            limits.append((memory_rlimit, size, size))
+        return limits
+
+    def get_cgroup_memory(self):
+        #Output files on tmpfs are charged to the cgroup too
+        if not config.MEMORY_CGROUPS:
+            return None
+        return int((self.memory_limit * config.MEMORY_RLIMIT_FACTOR + self.output_limit) * 1024 * 1024)
+
+    def is_allocation_failure(self, stderr_path):
+        message = ALLOCATION_FAILURES[self.language]
+        if message is None:
+            return False
+        try:
+            with open(stderr_path, 'rb') as file:
+                file.seek(max(0, os.fstat(file.fileno()).st_size - 4096))
+                return message in file.read()
+        except OSError:
+            return False
+
+    def get_run_args(self):
+        if self.run_args is None:
+            self.run_args = shlex.split(self.replace_vars(RUN_COMMANDS[self.language]))
+        return self.run_args
 
-    def run_target(self, input_path):
+    def execute_rlimit(self, args, input_path, output_path, stderr_path, test_num):
+        process = TargetProcess(args, input_path, output_path, stderr_path, self.rlimits, self.get_cgroup_memory(),
+                                self.time_limit * config.WALL_TIME_LIMIT_FACTOR)
+        with self.lock:
+            self.processes[test_num] = process
+        code, cpu_time, mem_used = process.wait()
+        with self.lock:
+            del self.processes[test_num]
+        if self.is_cancelled(test_num):
+            return None
+        #ru_maxrss also includes the resident size of the launcher before exec,
+        #which is much less than any sane memory limit
+        self.usage[test_num] = (cpu_time, mem_used)
+        if code == -signal.SIGXFSZ:
+            return Status.OUTPUT_LIMIT_EXCEEDED
+        elif process.oom_killed:
+            return Status.MEMORY_LIMIT_EXCEEDED
+        elif process.killed or code == -signal.SIGXCPU or cpu_time > self.time_limit:
+            return Status.TIME_LIMIT_EXCEEDED
+        elif mem_used > self.memory_limit:
+            return Status.MEMORY_LIMIT_EXCEEDED
+        elif code != 0 and not process.cgroup and MEMORY_RLIMITS[self.language] is not None and \
+             self.is_allocation_failure(stderr_path):
+            return Status.MEMORY_LIMIT_EXCEEDED
+        elif code == -signal.SIGSEGV:
+            return Status.SECURITY_VIOLATION_ERROR
+        elif code != 0:
+            return Status.RUNTIME_ERROR
+        return Status.OK
+
+    def execute_poll(self, args, input_file, output_file, stderr_file, test_num):
         time_limit_exceeded = False
         mem_limit_exceeded = False
-        output_path = self.temp_dir + '/output'
-        stderr_path = self.temp_dir + '/stderr'
+        output_limit_exceeded = False
+        #In parallel mode the time limit is checked against CPU time,
+        #so that tests running side by side don't cause spurious TLEs
+        if self.parallel:
+            wall_time_limit = self.time_limit * config.WALL_TIME_LIMIT_FACTOR
+        else:
+            wall_time_limit = self.time_limit
+        process = psutil.Popen(args, stdout=output_file, stdin=input_file, stderr=stderr_file)
+        start_time = time.time()
+        step = 0.001
+        code = -1
+        peak_mem_used = 0
+        while time.time() - start_time < wall_time_limit:
+            try:
+                if self.is_cancelled(test_num):
+                    process.kill()
+                    process.wait()
+                    return None
+                mem_used = process.memory_info().rss / 1024 / 1024
+                peak_mem_used = max(peak_mem_used, mem_used)
+                self.usage[test_num] = (None, peak_mem_used)
+                if mem_used > self.memory_limit:
+                    mem_limit_exceeded = True
+                    break
+                if os.fstat(output_file.fileno()).st_size > self.output_limit * 1024 * 1024:
+                    output_limit_exceeded = True
+                    break
+                if self.parallel:
+                    cpu_times = process.cpu_times()
+                    if cpu_times.user + cpu_times.system > self.time_limit:
+                        break
+                code = process.wait(timeout=step)
+                break
+            except psutil.TimeoutExpired:
+                continue
+        if process.is_running() and not mem_limit_exceeded and not output_limit_exceeded:
+            time_limit_exceeded = True
+        if output_limit_exceeded:
+            process.kill()
+            return Status.OUTPUT_LIMIT_EXCEEDED
+        elif time_limit_exceeded:
+            process.kill()
+            return Status.TIME_LIMIT_EXCEEDED
+        elif mem_limit_exceeded:
+            process.kill()
+            return Status.MEMORY_LIMIT_EXCEEDED
+        elif code == -11:
+            return Status.SECURITY_VIOLATION_ERROR
+        elif code != 0:
+            return Status.RUNTIME_ERROR
+        return Status.OK
+
+    def run_target(self, input_path, test_num):
+        output_path = self.temp_dir + '/output' + str(test_num)
+        stderr_path = self.temp_dir + '/stderr' + str(test_num)
         name, ext = os.path.splitext(input_path)
         etalon_path = name + '.out'
-        with open(output_path, 'w') as output_file, open(input_path, 'r') as input_file, open(stderr_path, 'w') as stderr_file:
-            cmd = self.replace_vars(RUN_COMMANDS[self.language])
-            process = psutil.Popen(shlex.split(cmd), stdout=output_file, stdin=input_file, stderr=stderr_file)
-            start_time = time.time()
-            step = 0.001
-            code = -1
-            while time.time() - start_time < self.time_limit:
-                try:
-                    mem_used = process.memory_info().rss / 1024 / 1024
-                    if mem_used > self.memory_limit:
-                        mem_limit_exceeded = True
-                        break
-                    code = process.wait(timeout=step)
-                    break
-                except psutil.TimeoutExpired:
-                    continue
-            if process.is_running() and not mem_limit_exceeded:
-                time_limit_exceeded = True
-            if time_limit_exceeded:
-                process.kill()
-                return Status.TIME_LIMIT_EXCEEDED
-            elif mem_limit_exceeded:
-                process.kill()
-                return Status.MEMORY_LIMIT_EXCEEDED
-            else:
-                if code == -11:
-                    return Status.SECURITY_VIOLATION_ERROR
-                elif code != 0:
-                    return Status.RUNTIME_ERROR
-                else:
-                    output_file.close()
-                    output_file = open(output_path, 'r')
-                    etalon_file = open(etalon_path, 'r')
-                    output = output_file.readlines()
-                    etalon = etalon_file.readlines()
-                    output_file.close()
-                    etalon_file.close()
-                    if len(output) != len(etalon):
-                        return Status.WRONG_ANSWER
-                    output[-1] = output[-1].rstrip()
-                    etalon[-1] = etalon[-1].rstrip()
-                    if output == etalon:
-                        return Status.OK
-                    else:
-                        return Status.WRONG_ANSWER
+        args = self.get_run_args()
+        stopwatch = Stopwatch()
+        if config.LIMITS_MODE == 'rlimit':
+            res = self.execute_rlimit(args, input_path, output_path, stderr_path, test_num)
+        else:
+            with open(output_path, 'w') as output_file, open(input_path, 'r') as input_file, open(stderr_path, 'w') as stderr_file:
+                res = self.execute_poll(args, input_file, output_file, stderr_file, test_num)
+        if res is not None:
+            cpu_time, mem_used = self.usage.get(test_num, (None, None))
+            self.add_timing(Timing('test', stopwatch.get_elapsed(), cpu_time, mem_used, test_num))
+        if res != Status.OK:
+            return res
+        stopwatch = Stopwatch()
+        if self.task_checker is not None:
+            res, message = self.task_checker.check(input_path, output_path, etalon_path)
+        else:
+            comparator = Comparator(self.compare_mode, self.epsilon)
+            res = comparator.compare(output_path, etalon_path)
+            message = comparator.get_message()
+        self.add_timing(Timing('compare', stopwatch.get_elapsed(), test_num=test_num))
+        os.remove(output_path)
+        if not res:
+            self.messages[test_num] = message
+            return Status.WRONG_ANSWER
+        return Status.OK
+
+    def get_tests(self, tests_dir):
+        if tests_dir is None:
+            return [test.input_path for test in self.task.tests]
+        return [tests_dir + '/' + os.path.basename(test.input_path) for test in self.task.tests]
+
+    def run_test(self, test_num, input_path):
+        if self.is_cancelled(test_num):
+            return None
+        res = self.run_target(input_path, test_num)
+        if res is not None and res != Status.OK:
+            with self.lock:
+                if self.first_failed_test_num is None or test_num < self.first_failed_test_num:
+                    self.first_failed_test_num = test_num
+                for num, process in self.processes.items():
+                    if num > test_num:
+                        process.kill()
+        return res
+
+    def get_tests_workers_count(self):
+        if config.PARALLEL_TESTS_WORKERS > 0:
+            return config.PARALLEL_TESTS_WORKERS
+        return os.cpu_count() or 1
+
+    def run_tests_parallel(self, tests):
+        with concurrent.futures.ThreadPoolExecutor(self.get_tests_workers_count()) as executor:
+            futures = []
+            for i, test in enumerate(tests, 1):
+                futures.append(executor.submit(self.run_test, i, test))
+        #Only tests after the first failed one can be cancelled
+        for i, future in enumerate(futures, 1):
+            res = future.result()
+            if res != Status.OK:
+                self.failed_test_num = i
+                return res
+        return Status.OK
 
     def get_failed_test_num(self):
         return self.failed_test_num
 
+    def get_message(self):
+        return self.messages.get(self.failed_test_num, '')
+
     def get_stderr(self):
+        if self.cached_stderr is not None:
+            return self.cached_stderr
         try:
-            file = open(self.temp_dir + '/stderr', 'r')
+            file = open(self.temp_dir + '/stderr' + str(self.failed_test_num), 'r')
             stderr = file.read()
             file.close()
             return stderr
@@ -234,25 +693,71 @@ class Checker:
         except:
             return ''
 
+    def recycle_temp_dir(self):
+        #Temp dir is kept by the worker between solutions, only files of the previous solution are removed
+        os.makedirs(self.temp_dir, exist_ok=True)
+        for entry in os.scandir(self.temp_dir):
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+
     def check(self):
         if os.getuid() != 0:
             print('You should run checker with sudo privileges!')
             sys.exit(1)
-        try:
-            shutil.rmtree(self.temp_dir)
-        except:
-            pass
-        os.makedirs(self.temp_dir)
+        self.recycle_temp_dir()
+        stopwatch = Stopwatch()
         compilation_result = self.compile_solution()
+        self.add_timing(Timing('compile', stopwatch.get_elapsed()))
         if compilation_result != Status.OK:
             return compilation_result
-        self.create_apparmor_profile()
-        i = 1
-        for file in os.listdir(self.task_dir):
-            if file.endswith('.in'):
-                res = self.run_target(self.task_dir + '/' + file)
-                if res != Status.OK:
-                    self.failed_test_num = i
-                    return res
-                i += 1
+        verdict_key = None
+        if verdict_cache.is_enabled():
+            verdict_key = verdict_cache.get_key(self.language, self.target, self.task, get_judge_settings(self.language))
+            verdict = verdict_cache.load(verdict_key)
+            if verdict is not None:
+                return self.use_cached_verdict(verdict)
+        if config.APPARMOR:
+            stopwatch = Stopwatch()
+            self.load_apparmor_profile()
+            self.add_timing(Timing('apparmor', stopwatch.get_elapsed()))
+        if self.checker_source:
+            target = self.compile_task_checker()
+            self.task_checker = get_task_checker(target, self.checker_mode == 'persistent')
+        stopwatch = Stopwatch()
+        #The cache entry is locked until the tests are done, so it is not evicted under them
+        tests_dir = test_cache.get(self.task) if test_cache.is_enabled() else None
+        try:
+            res = self.run_tests(self.get_tests(tests_dir))
+        finally:
+            if tests_dir is not None:
+                test_cache.release(tests_dir)
+        self.add_timing(Timing('tests', stopwatch.get_elapsed()))
+        if verdict_key is not None and self.is_verdict_cacheable(res):
+            verdict_cache.store(verdict_key, {'status': res, 'failed_test_num': self.failed_test_num,
+                                              'message': self.get_message(), 'stderr': self.get_stderr()})
+        return res
+
+    def is_verdict_cacheable(self, res):
+        #TLE and verdicts with a test close to the time limit may change on a rerun, so they are judged again
+        if res == Status.TIME_LIMIT_EXCEEDED:
+            return False
+        times = [timing.wall if timing.cpu is None else timing.cpu for timing in self.timings if timing.stage == 'test']
+        return not times or max(times) < self.time_limit * config.VERDICT_CACHE_TIME_MARGIN
+
+    def use_cached_verdict(self, verdict):
+        self.failed_test_num = verdict['failed_test_num']
+        self.messages[self.failed_test_num] = verdict['message']
+        self.cached_stderr = verdict['stderr']
+        return verdict['status']
+
+    def run_tests(self, tests):
+        if self.parallel:
+            return self.run_tests_parallel(tests)
+        for i, test in enumerate(tests, 1):
+            res = self.run_target(test, i)
+            if res != Status.OK:
+                self.failed_test_num = i
+                return res
         return Status.OK
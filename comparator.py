@@ -0,0 +1,190 @@
+import re
+
+#Comparison modes:
+#exact   --> byte by byte, \r\n is the same as \n, trailing whitespace at the end of file is ignored
+#lines   --> line by line, trailing whitespace of every line and trailing empty lines are ignored
+#tokens  --> whitespace separated tokens
+#float   --> whitespace separated tokens, numbers are compared with the given epsilon
+
+MODES = ('exact', 'lines', 'tokens', 'float')
+
+CHUNK_SIZE = 65536
+
+#Float mode: output tokens longer than this and than the expected token are a mismatch without reading them further
+FLOAT_TOKEN_LIMIT = 4096
+
+TOKEN_REGEX = re.compile(rb'\S+')
+
+#Reads a file with \r\n replaced by \n, chunks have the requested size until the end of file
+class NewlineReader:
+    def __init__(self, file):
+        self.file = file
+        self.buffer = b''
+        self.carriage = b''
+        self.eof = False
+
+    def read(self, size):
+        while len(self.buffer) < size and not self.eof:
+            chunk = self.file.read(CHUNK_SIZE)
+            if not chunk:
+                self.eof = True
+                self.buffer += self.carriage
+                self.carriage = b''
+                break
+            data = self.carriage + chunk
+            self.carriage = b''
+            #\r at the end of the chunk may be followed by \n in the next one
+            if data.endswith(b'\r'):
+                data, self.carriage = data[:-1], b'\r'
+            self.buffer += data.replace(b'\r\n', b'\n')
+        result, self.buffer = self.buffer[:size], self.buffer[size:]
+        return result
+
+#Reads whitespace separated tokens, every byte is scanned once however long the tokens are
+class TokenReader:
+    def __init__(self, file):
+        self.file = file
+        self.data = b''
+        self.position = 0
+        self.line = 1
+
+    def fill(self):
+        self.data = self.file.read(CHUNK_SIZE)
+        self.position = 0
+        return len(self.data) > 0
+
+    def next(self, limit=None):
+        #Returns (token, line) or None at the end of file, a token longer than limit is cut to limit + 1 bytes
+        while True:
+            match = TOKEN_REGEX.search(self.data, self.position)
+            if match is not None:
+                break
+            self.line += self.data.count(b'\n', self.position)
+            if not self.fill():
+                return None
+        self.line += self.data.count(b'\n', self.position, match.start())
+        parts = [match.group()]
+        length = len(parts[0])
+        self.position = match.end()
+        #A token touching the end of the chunk may continue in the next one
+        while self.position == len(self.data) and (limit is None or length <= limit):
+            if not self.fill():
+                break
+            match = TOKEN_REGEX.match(self.data)
+            if match is None:
+                break
+            parts.append(match.group())
+            length += len(parts[-1])
+            self.position = match.end()
+        token = b''.join(parts)
+        if limit is not None and length > limit:
+            token = token[:limit + 1]
+        return token, self.line
+
+class Comparator:
+    def __init__(self, mode='exact', epsilon=1e-6):
+        if mode not in MODES:
+            raise ValueError('Unknown comparison mode: {0}'.format(mode))
+        self.mode = mode
+        self.epsilon = epsilon
+        self.message = ''
+
+    def get_message(self):
+        return self.message
+
+    def compare(self, output_path, etalon_path):
+        self.message = ''
+        with open(output_path, 'rb') as output, open(etalon_path, 'rb') as etalon:
+            if self.mode == 'exact':
+                return self.compare_exact(NewlineReader(output), NewlineReader(etalon))
+            elif self.mode == 'lines':
+                return self.compare_lines(output, etalon)
+            else:
+                return self.compare_tokens(output, etalon)
+
+    def is_whitespace_tail(self, head, file):
+        if head.strip():
+            return False
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            if chunk.strip():
+                return False
+        return True
+
+    def compare_exact(self, output, etalon):
+        position = 0
+        line = 1
+        while True:
+            a = output.read(CHUNK_SIZE)
+            b = etalon.read(CHUNK_SIZE)
+            if a == b:
+                if not a:
+                    return True
+                position += len(a)
+                line += a.count(b'\n')
+                continue
+            size = min(len(a), len(b))
+            i = 0
+            while i < size and a[i] == b[i]:
+                i += 1
+            if self.is_whitespace_tail(a[i:], output) and self.is_whitespace_tail(b[i:], etalon):
+                return True
+            line += a.count(b'\n', 0, i)
+            self.message = 'Mismatch at line {0} (byte {1})'.format(line, position + i + 1)
+            return False
+
+    def skip_line_tail(self, file):
+        #Returns False if the rest of a cut line is not only whitespace
+        while True:
+            piece = file.readline(CHUNK_SIZE)
+            if piece.strip():
+                return False
+            if not piece or piece.endswith(b'\n'):
+                return True
+
+    def compare_lines(self, output, etalon):
+        line = 0
+        while True:
+            b = etalon.readline()
+            #Output lines are read at most this long, only whitespace may follow a longer one
+            a = output.readline(len(b) + CHUNK_SIZE)
+            line += 1
+            if not a or not b:
+                break
+            if a.rstrip() != b.rstrip() or not a.endswith(b'\n') and not self.skip_line_tail(output):
+                self.message = 'Mismatch at line {0}'.format(line)
+                return False
+        if self.is_whitespace_tail(a, output) and self.is_whitespace_tail(b, etalon):
+            return True
+        self.message = 'Mismatch at line {0}'.format(line)
+        return False
+
+    def tokens_equal(self, a, b):
+        if a == b:
+            return True
+        if self.mode != 'float':
+            return False
+        try:
+            x = float(a)
+            y = float(b)
+        except ValueError:
+            return False
+        return abs(x - y) <= self.epsilon * max(1.0, abs(y))
+
+    def compare_tokens(self, output, etalon):
+        output_tokens = TokenReader(output)
+        etalon_tokens = TokenReader(etalon)
+        token_num = 0
+        while True:
+            b = etalon_tokens.next()
+            #An output token longer than the expected one can't match, so it is not read to the end
+            limit = 0 if b is None else len(b[0])
+            if self.mode == 'float':
+                limit = max(limit, FLOAT_TOKEN_LIMIT)
+            a = output_tokens.next(limit)
+            token_num += 1
+            if a is None and b is None:
+                return True
+            if a is None or b is None or len(a[0]) > limit or not self.tokens_equal(a[0], b[0]):
+                line = a[1] if a is not None else b[1]
+                self.message = 'Mismatch at token {0} (line {1})'.format(token_num, line)
+                return False
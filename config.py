@@ -1,19 +1,93 @@
 IMAP_SERVER = 'imap.mail.ru'
 IMAP_PORT = 993
+IMAP_SSL = True
 SMTP_SERVER = 'smtp.mail.ru'
 SMTP_PORT = 465
+SMTP_SSL = True
 
 LOGIN = 'checker@example.com'
 PASSWORD = 'password'
 
 TASKS_DIR = '/path/to/tasks'
+TASKS_REFRESH_PERIOD = 5.0    #sec, how often task dirs are checked for changes
 REPORT_FILE = '/path/to/report.html'
 
 ADMINS = ['admin@example.com']
 REPORT_TIME = '16:00'
 
+OUTBOX_DIR = 'outbox'          #queued outgoing messages, undeliverable ones are moved to OUTBOX_DIR/failed
+OUTBOX_UPDATE_PERIOD = 5.0     #sec
+OUTBOX_RETRY_DELAY = 10.0      #sec, doubled after every failed attempt
+OUTBOX_MAX_RETRY_DELAY = 600.0 #sec
+OUTBOX_MAX_ATTEMPTS = 20
+SMTP_TIMEOUT = 30.0            #sec
+SMTP_IDLE_TIMEOUT = 60.0       #sec, idle SMTP connection is closed after this time
+
 BLACKLIST = []
+DAILY_ATTEMPTS_LIMIT = 50     #solutions per e-mail per day, 0 - unlimited
+FIRST_ATTEMPT_PRIORITY = False #judge the first attempt on a task before resubmissions of other tasks
+
+DATABASE_BUSY_TIMEOUT = 30.0  #sec, how long to wait for a write lock held by another process
 
-VERIFIER_UPDATE_PERIOD = 3.0  #sec
-MAILMON_UPDATE_PERIOD = 3.0   #sec
+VERIFIER_UPDATE_PERIOD = 30.0 #sec, fallback poll when no wakeup notification arrives
+MAILMON_UPDATE_PERIOD = 3.0   #sec, used when the IMAP server doesn't support IDLE
+MAILMON_IDLE_TIMEOUT = 120.0  #sec
+MAILMON_FETCH_BATCH = 50      #messages fetched with a single FETCH command
+MESSAGE_SIZE_LIMIT = 4096     #Kb, larger e-mails are not downloaded
+SOLUTION_SIZE_LIMIT = 1024    #Kb, total size of decoded attachments
+ATTACHMENT_SIZE_LIMIT = 256   #Kb
 COMPILATION_TIME_LIMIT = 20.0 #sec
+COMPILATION_WORKERS = 0       #translation units of a multi-file solution compiled at once, 0 - one per CPU core
+PCH_DIR = 'cache/pch'         #precompiled standard headers, built once per compiler version, '' - disable
+VERIFIER_WORKERS = 0          #number of parallel judge processes, 0 - one per CPU core
+NOTIFY_SOCKET = 'verifier.sock' #unix socket used by mailmon to wake up the verifier
+PID_FILE = 'verifier.pid'     #pid of supervisor.py, used by stop.sh and restart.sh
+DRAIN_TIMEOUT = 60.0          #sec, how long solutions being judged may finish on stop, the rest are returned to the queue
+
+COORDINATOR_ADDRESS = '127.0.0.1' #judge agents (agent.py) lease solutions from the verifier at this address
+COORDINATOR_PORT = 0          #0 - no agents, solutions are judged only by the local workers
+COORDINATOR_TOKEN = ''        #shared secret of the verifier and agents, required unless COORDINATOR_ADDRESS is loopback
+COORDINATOR_URL = 'http://127.0.0.1:8470' #used by agents
+COORDINATOR_LOCAL_WORKERS = True #judge on the verifier machine too when agents are enabled
+LEASE_TIMEOUT = 60.0          #sec, a solution leased by an agent without heartbeats is returned to the queue
+LEASE_POLL_TIMEOUT = 20.0     #sec, how long a lease request waits for a solution
+AGENT_WORKERS = 0             #parallel judge processes of an agent, 0 - one per CPU core
+AGENT_CACHE_DIR = 'cache/agent' #solution files and task data fetched by an agent, by content hash
+AGENT_RETRY_DELAY = 5.0       #sec, agent waits after a failed request to the coordinator
+
+HTTP_API_ADDRESS = '127.0.0.1' #solutions can also be sent to httpapi.py at this address
+HTTP_API_PORT = 0             #0 - solutions are received only by mail
+HTTP_API_TOKEN = ''           #required in the X-Verifier-Token header when set, must be set unless the address is loopback
+HTTP_API_MAIL_RESULTS = False #mail results of HTTP solutions unless the request says otherwise, only with a token
+HTTP_API_MAX_WAIT = 60.0      #sec, longest wait for a result requested with ?wait=
+HTTP_RESULTS_RETENTION = 7    #days, verdict details of HTTP solutions are removed after the daily report
+
+PARALLEL_TESTS = False        #run tests of a solution concurrently, can be overridden in task_info.ini
+PARALLEL_TESTS_WORKERS = 0    #0 - one per CPU core
+WALL_TIME_LIMIT_FACTOR = 3.0  #wall clock limit = time limit * factor, when time limit is CPU time
+LIMITS_MODE = 'rlimit'        #'rlimit' - setrlimit and wait4 accounting, time limit is CPU time
+                              #'poll' - psutil polling, time limit is wall clock time unless tests are parallel
+APPARMOR = True               #confine solutions with AppArmor profiles, disable only on trusted or test machines
+MEMORY_RLIMIT_FACTOR = 2.0    #address space limit = memory limit * factor, MLE is decided by peak RSS
+MEMORY_CGROUPS = True         #rlimit mode: a memory cgroup per test instead of the address space limit when
+                              #available, so a solution is OOM killed (MLE) instead of failing to allocate (RE)
+OUTPUT_LIMIT = 64.0           #Mb, can be overridden in task_info.ini
+COMPARE_MODE = 'exact'        #'exact', 'lines', 'tokens' or 'float', can be overridden in task_info.ini
+COMPARE_EPSILON = 1e-6        #used by 'float' compare mode
+TASK_CHECKERS_DIR = 'cache/checkers'
+TASK_CHECKER_TIME_LIMIT = 10.0 #sec
+WORKSPACE_DIR = '/dev/shm/verifier' #temp dirs of the workers, tmpfs saves disk I/O for outputs of every test,
+                              #'' or a noexec mount - 'temp' in the verifier dir
+TEST_CACHE_DIR = '/dev/shm/verifier-tests' #created with mode 0700 like WORKSPACE_DIR
+TEST_CACHE_SIZE = 256         #Mb, copies of task tests kept in memory, 0 - tests are read from TASKS_DIR
+
+METRICS_FILE = 'metrics.prom'  #Prometheus textfile with judging stage timings, '' - disable
+METRICS_UPDATE_PERIOD = 15.0   #sec
+METRICS_WINDOW = 3600.0        #sec, percentiles in the metrics file are computed over this period
+METRICS_RETENTION = 30         #days, older timings are removed after the daily report
+
+BUILD_CACHE_DIR = 'cache/build'
+BUILD_CACHE_SIZE = 512        #Mb, 0 - disable cache of compiled solutions
+VERDICT_CACHE_DIR = 'cache/verdicts'
+VERDICT_CACHE_SIZE = 16       #Mb, 0 - disable cache of verdicts of identical binaries
+VERDICT_CACHE_TIME_MARGIN = 0.8 #verdicts with a test slower than this share of the time limit are not cached, TLE never is
@@ -0,0 +1,253 @@
+import os
+import hmac
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import traceback
+import http.server
+import config
+import database
+from httpapi import is_loopback
+from taskregistry import registry
+from metrics import Timing, Stopwatch
+
+#Judge agents (see agent.py) take solutions from the verifier queue over HTTP, bodies are JSON:
+#POST /lease      {"agent": name}  --> {"lease": id, "solution": [id, datetime, email, task, language, status, queued_at],
+#                                       "files": {name: hash}, "task": {"name": ..., "fingerprint": ..., "files": {name: hash}}}
+#                                      204 if the queue stays empty for LEASE_POLL_TIMEOUT
+#POST /heartbeat  {"lease": id}    --> 200, 410 if the lease has expired
+#POST /result     {"lease": id, "status": ..., "compiler_output": ..., "failed_test_num": ...,
+#                  "stderr": ..., "details": ..., "timings": [[stage, wall, cpu, memory, test_num], ...]} --> 200 or 410
+#GET  /files/hash                  --> content of a file, only files of leased solutions and their tasks are served
+#Requests carry the X-Verifier-Token header when COORDINATOR_TOKEN is set. Without a token the coordinator listens
+#only on a loopback address, anybody reaching it could read sources, tests and answers and post verdicts.
+#A lease without a heartbeat for LEASE_TIMEOUT expires and the solution goes back to the queue.
+
+def get_file_hash(path):
+    content = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(65536), b''):
+            content.update(chunk)
+    return content.hexdigest()
+
+class Lease:
+    def __init__(self, agent, solution, files, queue_wait):
+        self.id = uuid.uuid4().hex
+        self.agent = agent
+        self.solution = solution
+        self.files = files
+        self.queue_wait = queue_wait
+        self.stopwatch = Stopwatch()
+        self.extend()
+
+    def extend(self):
+        self.expires = time.monotonic() + config.LEASE_TIMEOUT
+
+class CoordinatorHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logging.debug('Coordinator: ' + format % args)
+
+    def send_json(self, code, response=None):
+        data = b'' if response is None else json.dumps(response).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def check_token(self):
+        #Headers are decoded as latin-1, compare_digest takes only ASCII strings
+        token = self.headers.get('X-Verifier-Token', '').encode('latin-1')
+        if config.COORDINATOR_TOKEN and not hmac.compare_digest(token, config.COORDINATOR_TOKEN.encode('utf-8')):
+            self.send_json(403)
+            return False
+        return True
+
+    def do_POST(self):
+        coordinator = self.server.coordinator
+        try:
+            if not self.check_token():
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if self.path == '/lease':
+                response = coordinator.lease(str(request.get('agent', '')))
+                self.send_json(204 if response is None else 200, response)
+            elif self.path == '/heartbeat':
+                self.send_json(200 if coordinator.heartbeat(request['lease']) else 410)
+            elif self.path == '/result':
+                self.send_json(200 if coordinator.finish(request['lease'], request) else 410)
+            else:
+                self.send_json(404)
+        except:
+            logging.warning('Coordinator request failed: ' + traceback.format_exc())
+            self.send_json(500)
+
+    def do_GET(self):
+        try:
+            if not self.check_token():
+                return
+            path = None
+            if self.path.startswith('/files/'):
+                path = self.server.coordinator.get_file_path(self.path[len('/files/'):])
+            if path is None:
+                self.send_json(404)
+                return
+            with open(path, 'rb') as file:
+                data = file.read()
+        except:
+            logging.warning('Coordinator request failed: ' + traceback.format_exc())
+            self.send_json(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class CoordinatorServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, coordinator):
+        super().__init__(address, CoordinatorHandler)
+        self.coordinator = coordinator
+
+class Coordinator:
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.leases = {}
+        #File hash --> path, for files of leased solutions and of tasks
+        self.files = {}
+        #Task fingerprint --> {file name: hash}
+        self.task_files = {}
+
+    def start(self, address):
+        if not config.COORDINATOR_TOKEN and not is_loopback(address[0]):
+            raise Exception('COORDINATOR_TOKEN must be set to listen on {0}'.format(address[0]))
+        server = CoordinatorServer(address, self)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.info('Coordinator is listening on {0}:{1}'.format(*server.server_address))
+        return server
+
+    def get_file_path(self, file_hash):
+        with self.lock:
+            return self.files.get(file_hash)
+
+    def hash_files(self, dir_path, names):
+        #Done without the lock, files are registered with add_files
+        files = {}
+        for name in names:
+            files[name] = get_file_hash(dir_path + '/' + name)
+        return files
+
+    def add_files(self, dir_path, files):
+        #Called under the lock
+        for name, file_hash in files.items():
+            self.files[file_hash] = dir_path + '/' + name
+
+    def get_task(self, name):
+        task = registry.get(name)
+        fingerprint = task.get_fingerprint()
+        with self.lock:
+            files = self.task_files.get(fingerprint)
+        if files is None:
+            names = [f for f in os.listdir(task.path) if os.path.isfile(task.path + '/' + f)]
+            files = self.hash_files(task.path, names)
+            with self.lock:
+                #Another lease may have added the task meanwhile
+                files = self.task_files.setdefault(fingerprint, files)
+                self.add_files(task.path, files)
+        return {'name': task.name, 'fingerprint': fingerprint, 'files': files}
+
+    def lease(self, agent):
+        deadline = time.monotonic() + config.LEASE_POLL_TIMEOUT
+        conn = database.connect()
+        try:
+            while True:
+                #A draining verifier doesn't hand out solutions, agents keep polling until it restarts
+                if self.app.draining.is_set():
+                    return None
+                solution = self.app.claim_solution(conn)
+                if solution is None:
+                    if time.monotonic() >= deadline:
+                        return None
+                    self.app.wakeup.wait(min(1.0, deadline - time.monotonic()))
+                    continue
+                #Solutions that are not judged get the error right away
+                if self.app.get_early_status(solution) is not None:
+                    self.app.process_solution(conn, solution, None)
+                    continue
+                try:
+                    queue_wait = self.app.start_solution(solution)
+                    solution_dir = self.app.solutions_dir + '/' + str(solution[0])
+                    task = self.get_task(solution[3])
+                    lease = Lease(agent, solution, self.hash_files(solution_dir, os.listdir(solution_dir)), queue_wait)
+                except:
+                    self.app.requeue_solution(conn, solution[0])
+                    raise
+                with self.lock:
+                    self.add_files(solution_dir, lease.files)
+                    self.leases[lease.id] = lease
+                logging.info('Solution {0} is leased to agent {1}'.format(solution[0], agent))
+                return {'lease': lease.id, 'solution': list(solution), 'files': lease.files, 'task': task}
+        finally:
+            conn.close()
+
+    def get_leases_count(self):
+        with self.lock:
+            return len(self.leases)
+
+    def drop_leases(self):
+        #Solutions of the dropped leases are returned to the queue by the caller, late results get 410
+        with self.lock:
+            for lease in list(self.leases.values()):
+                del self.leases[lease.id]
+                self.release(lease)
+
+    def heartbeat(self, lease_id):
+        with self.lock:
+            lease = self.leases.get(lease_id)
+            if lease is None:
+                return False
+            lease.extend()
+            return True
+
+    def release(self, lease):
+        #Solution files are served only while the solution is leased
+        for file_hash in lease.files.values():
+            if not any(file_hash in other.files.values() for other in self.leases.values()) and \
+               not any(file_hash in files.values() for files in self.task_files.values()):
+                self.files.pop(file_hash, None)
+
+    def finish(self, lease_id, result):
+        with self.lock:
+            lease = self.leases.pop(lease_id, None)
+            if lease is None:
+                return False
+            self.release(lease)
+        timings = [Timing(*timing) for timing in result.get('timings', [])]
+        conn = database.connect()
+        try:
+            self.app.finish_solution(conn, lease.solution,
+                                     (result['status'], result.get('compiler_output', ''), result.get('failed_test_num', -1),
+                                      result.get('stderr', ''), result.get('details', ''), timings),
+                                     lease.stopwatch.get_elapsed(), lease.queue_wait)
+        finally:
+            conn.close()
+        return True
+
+    def expire_leases(self, conn):
+        now = time.monotonic()
+        with self.lock:
+            expired = [lease for lease in self.leases.values() if lease.expires <= now]
+            for lease in expired:
+                del self.leases[lease.id]
+                self.release(lease)
+        for lease in expired:
+            self.app.requeue_solution(conn, lease.solution[0])
+            logging.warning('Lease of solution {0} by agent {1} has expired, returned it to the queue'.format(
+                lease.solution[0], lease.agent))
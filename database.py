@@ -0,0 +1,135 @@
+import sqlite3
+import config
+from status import Status
+
+DATABASE_FILE = 'database.db'
+
+#Statuses of solutions that are waiting for a worker. The values are inlined into the queries,
+#because SQLite uses a partial index only when the query has the same literal condition,
+#and the partial index has to be recreated by a new migration whenever this list changes
+PENDING_STATUSES = (Status.WAITING,
+                    Status.INVALID_SOLUTION_FORMAT_WAITING,
+                    Status.SIZE_LIMIT_EXCEEDED_WAITING,
+                    Status.ATTEMPTS_LIMIT_EXCEEDED_WAITING)
+PENDING_CONDITION = 'status IN ({0})'.format(', '.join(str(s) for s in PENDING_STATUSES))
+
+#Migration i brings the schema from version i to i + 1, the version is kept in PRAGMA user_version.
+#Applied migrations must never be changed, add a new one instead.
+MIGRATIONS = [
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS solutions (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            datetime    INTEGER,
+            email       TEXT,
+            task        TEXT,
+            language    TEXT,
+            status      INTEGER
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS report (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            solution_id INTEGER,
+            datetime    INTEGER,
+            email       TEXT,
+            task        TEXT,
+            language    TEXT,
+            status      INTEGER
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS settings (
+            name        TEXT PRIMARY KEY,
+            value       TEXT
+        )
+        ''',
+    ],
+    [
+        #Unix timestamps of the judging stages, NULL for solutions queued before this migration
+        'ALTER TABLE solutions ADD COLUMN queued_at REAL',
+        'ALTER TABLE solutions ADD COLUMN started_at REAL',
+        'ALTER TABLE solutions ADD COLUMN finished_at REAL',
+        'CREATE INDEX solutions_pending ON solutions (id) WHERE status IN (2, 11, 15)',
+        'CREATE INDEX solutions_email ON solutions (email, datetime)',
+        'CREATE INDEX solutions_task ON solutions (task, status)',
+    ],
+    [
+        'DROP INDEX solutions_pending',
+        'CREATE INDEX solutions_pending ON solutions (id) WHERE status IN (2, 11, 15, 17)',
+        #Daily attempts are counted by the time the solution was received, the Date header can be forged
+        'CREATE INDEX solutions_email_queued ON solutions (email, queued_at)',
+        'CREATE INDEX solutions_email_task ON solutions (email, task)',
+        'ALTER TABLE report ADD COLUMN queue_wait REAL',
+    ],
+    [
+        #See metrics.py
+        '''
+        CREATE TABLE timings (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            recorded_at REAL,
+            stage       TEXT,
+            solution_id INTEGER,
+            task        TEXT,
+            language    TEXT,
+            test_num    INTEGER,
+            wall        REAL,
+            cpu         REAL,
+            memory      REAL
+        )
+        ''',
+        'CREATE INDEX timings_recorded ON timings (recorded_at)',
+        'CREATE INDEX timings_solution ON timings (solution_id)',
+    ],
+    [
+        #Solutions sent over the HTTP API (see httpapi.py), their verdict details are kept for polling
+        "ALTER TABLE solutions ADD COLUMN source TEXT NOT NULL DEFAULT 'mail'",
+        'ALTER TABLE solutions ADD COLUMN mail_result INTEGER NOT NULL DEFAULT 1',
+        '''
+        CREATE TABLE results (
+            solution_id     INTEGER PRIMARY KEY,
+            failed_test_num INTEGER,
+            compiler_output TEXT,
+            stderr          TEXT,
+            details         TEXT
+        )
+        ''',
+    ],
+    [
+        #Solutions of the HTTP API are looked up by a random key, ids are easy to guess
+        'ALTER TABLE solutions ADD COLUMN access_key TEXT',
+        'CREATE UNIQUE INDEX solutions_access_key ON solutions (access_key) WHERE access_key IS NOT NULL',
+    ],
+]
+
+def connect():
+    conn = sqlite3.connect(DATABASE_FILE, timeout=config.DATABASE_BUSY_TIMEOUT)
+    #Readers don't block the writer and vice versa, so app and mailmon don't wait for each other
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+def get_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn):
+    if get_version(conn) >= len(MIGRATIONS):
+        return
+    #App and mailmon may start at the same time, so the version is checked again under the write lock
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        version = get_version(conn)
+        for i in range(version, len(MIGRATIONS)):
+            for statement in MIGRATIONS[i]:
+                conn.execute(statement)
+        conn.execute('PRAGMA user_version = {0}'.format(max(version, len(MIGRATIONS))))
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+
+def get_setting(conn, name):
+    res = conn.execute('SELECT value FROM settings WHERE name = ?', (name,)).fetchone()
+    return None if res is None else res[0]
+
+def set_setting(conn, name, value):
+    conn.execute('INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)', (name, value))
@@ -0,0 +1,251 @@
+#HTTP API for sending solutions without mail, runs as a separate process next to mailmon.py.
+#Solutions get into the same queue and solutions/<id> dirs as mailed ones, see mailmon.Ingest.
+#POST /solutions                multipart/form-data with fields email, task, language, mail (optional, 1 - also mail
+#                               the result) and one or more files --> 201 {"id": ..., "key": ..., "status": ..., "result": ...}
+#GET  /solutions/<key>[?wait=N] --> 200 {"id": ..., "status": ..., "result": ..., "judged": bool, "task": ..., "language": ...,
+#                                   "queued_at": ..., "finished_at": ..., "failed_test_num": ..., "compiler_output": ...,
+#                                   "stderr": ..., "details": ...}
+#                               with wait the response is delayed until the solution is judged, at most N seconds
+#The random key returned by POST is known only to the submitter, so nobody else can read the result.
+#Requests carry the X-Verifier-Token header when HTTP_API_TOKEN is set. Without a token the API listens only on
+#a loopback address and doesn't mail results, the e-mail field is whatever the client says.
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import uuid
+import email
+import secrets
+import ipaddress
+import email.policy
+import shutil
+import asyncio
+import logging
+import traceback
+import urllib.parse
+import config
+import database
+from status import Status
+from mailmon import Ingest, Message, Attachment
+from metrics import Timing, Stopwatch
+
+RESULT_POLL_PERIOD = 0.25 #sec
+
+REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed', 411: 'Length Required', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+class HTTPError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+def is_loopback(address):
+    if address == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        return False
+
+class SubmissionAPI(Ingest):
+    def __init__(self, address, port):
+        super().__init__('.staging-http')
+        self.address = address
+        self.port = port
+
+    def parse_form(self, content_type, body):
+        if not content_type.lower().startswith('multipart/form-data'):
+            raise HTTPError(400, 'multipart/form-data expected')
+        form = email.message_from_bytes(b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body,
+                                        policy=email.policy.compat32)
+        if not form.is_multipart():
+            raise HTTPError(400, 'Invalid multipart body')
+        fields = {}
+        files = []
+        for part in form.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            filename = part.get_filename()
+            data = part.get_payload(decode=True) or b''
+            if filename is not None:
+                files.append((filename, data))
+            elif name:
+                fields[name] = data.decode('utf-8', 'replace').strip()
+        return fields, files
+
+    def get_message(self, fields, files):
+        if not fields.get('email'):
+            raise HTTPError(400, 'email is required')
+        #Without a token anybody could make the verifier mail any address
+        mail_result = bool(config.HTTP_API_TOKEN) and \
+                      fields.get('mail', '1' if config.HTTP_API_MAIL_RESULTS else '0') == '1'
+        staging_dir = self.staging_dir + '/' + uuid.uuid4().hex
+        os.makedirs(staging_dir)
+        result = Message(fields['email'], int(time.time()), fields.get('task') or None, fields.get('language') or None,
+                         [], staging_dir, source='http', mail_result=mail_result, access_key=secrets.token_urlsafe(16))
+        total_size = 0
+        for filename, data in files:
+            filename = os.path.basename(filename)
+            total_size += len(data)
+            if len(data) > config.ATTACHMENT_SIZE_LIMIT * 1024 or total_size > config.SOLUTION_SIZE_LIMIT * 1024:
+                result.oversized = True
+                break
+            if not filename or filename.startswith('.'):
+                continue
+            path = staging_dir + '/' + filename
+            with open(path, 'wb') as file:
+                file.write(data)
+            result.attachments.append(Attachment(filename, path, len(data)))
+        return self.filter_attachments(result)
+
+    def submit(self, content_type, body):
+        stopwatch = Stopwatch()
+        fields, files = self.parse_form(content_type, body)
+        message = self.get_message(fields, files)
+        try:
+            self.apply_messages([message])
+        finally:
+            self.remove_staging_dir(message)
+        if message.solution_id is None:
+            raise HTTPError(403, 'Sender is blacklisted')
+        self.record_timings([Timing('ingest', stopwatch.get_elapsed())])
+        logging.info('Got solution {0} over HTTP: {1}'.format(message.solution_id, message))
+        return message.access_key
+
+    def get_solution(self, access_key):
+        conn = database.connect()
+        try:
+            row = conn.execute('''
+            SELECT s.id, s.status, s.task, s.language, s.queued_at, s.finished_at,
+                   r.failed_test_num, r.compiler_output, r.stderr, r.details
+            FROM solutions AS s LEFT JOIN results AS r ON r.solution_id = s.id
+            WHERE s.access_key = ? AND s.source = 'http'
+            ''', (access_key,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            raise HTTPError(404, 'No such solution')
+        keys = ('id', 'status', 'task', 'language', 'queued_at', 'finished_at',
+                'failed_test_num', 'compiler_output', 'stderr', 'details')
+        solution = dict(zip(keys, row))
+        solution['result'] = Status.get_string(solution['status'])
+        solution['judged'] = solution['status'] not in database.PENDING_STATUSES + (Status.JUDGING, Status.COPYING)
+        return solution
+
+    async def wait_for_solution(self, access_key, wait):
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + wait
+        while True:
+            solution = await loop.run_in_executor(None, self.get_solution, access_key)
+            if solution['judged'] or time.monotonic() >= deadline:
+                return solution
+            await asyncio.sleep(RESULT_POLL_PERIOD)
+
+    async def dispatch(self, method, target, headers, body):
+        token = headers.get('x-verifier-token', '')
+        if config.HTTP_API_TOKEN and not hmac.compare_digest(token, config.HTTP_API_TOKEN):
+            raise HTTPError(403, 'Invalid token')
+        url = urllib.parse.urlsplit(target)
+        match = re.fullmatch(r'/solutions/([\w-]+)', url.path)
+        if url.path == '/solutions':
+            if method != 'POST':
+                raise HTTPError(405, 'POST expected')
+            loop = asyncio.get_running_loop()
+            access_key = await loop.run_in_executor(None, self.submit, headers.get('content-type', ''), body)
+            solution = await loop.run_in_executor(None, self.get_solution, access_key)
+            return 201, {'id': solution['id'], 'key': access_key, 'status': solution['status'], 'result': solution['result']}
+        elif match is not None:
+            if method != 'GET':
+                raise HTTPError(405, 'GET expected')
+            query = urllib.parse.parse_qs(url.query)
+            try:
+                wait = min(max(float(query.get('wait', ['0'])[0]), 0), config.HTTP_API_MAX_WAIT)
+            except ValueError:
+                raise HTTPError(400, 'Invalid wait')
+            return 200, await self.wait_for_solution(match.group(1), wait)
+        raise HTTPError(404, 'Not found')
+
+    async def respond(self, writer, code, response, keep_alive):
+        data = json.dumps(response).encode('utf-8')
+        head = 'HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\nConnection: {3}\r\n\r\n'.format(
+            code, REASONS.get(code, ''), len(data), 'keep-alive' if keep_alive else 'close')
+        writer.write(head.encode('latin-1') + data)
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    return
+                lines = head.decode('latin-1').split('\r\n')
+                parts = lines[0].split(' ')
+                if len(parts) != 3:
+                    await self.respond(writer, 400, {'error': 'Invalid request line'}, False)
+                    return
+                method, target, version = parts
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                #Whole e-mails are limited by MESSAGE_SIZE_LIMIT, so are requests
+                if 'transfer-encoding' in headers:
+                    await self.respond(writer, 411, {'error': 'Content-Length is required'}, False)
+                    return
+                length = int(headers.get('content-length', '0'))
+                if length > config.MESSAGE_SIZE_LIMIT * 1024:
+                    await self.respond(writer, 413, {'error': 'Request is too large'}, False)
+                    return
+                body = await reader.readexactly(length)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                try:
+                    code, response = await self.dispatch(method, target, headers, body)
+                except HTTPError as e:
+                    code, response = e.code, {'error': str(e)}
+                except Exception:
+                    logging.warning('HTTP request failed: ' + traceback.format_exc())
+                    code, response = 500, {'error': 'Internal error'}
+                await self.respond(writer, code, response, keep_alive)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        #Also used by supervisor.py, which runs the API on its own loop
+        if not config.HTTP_API_TOKEN and not is_loopback(self.address):
+            raise Exception('HTTP_API_TOKEN must be set to listen on {0}'.format(self.address))
+        conn = database.connect()
+        database.migrate(conn)
+        conn.close()
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        server = await asyncio.start_server(self.handle, self.address, self.port)
+        logging.info('HTTP API is listening on {0}:{1}'.format(self.address, self.port))
+        return server
+
+    async def serve(self):
+        server = await self.start()
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+if __name__ == '__main__':
+    if not config.HTTP_API_PORT:
+        print('HTTP API is disabled, set HTTP_API_PORT in config.py')
+        sys.exit(0)
+    logging.basicConfig(filename='log.txt',
+                        format='[%(asctime)s][%(levelname)s]: %(message)s',
+                        datefmt='%d %b %Y %H:%M:%S',
+                        level=logging.DEBUG)
+    logging.info('HTTP API started')
+    try:
+        SubmissionAPI(config.HTTP_API_ADDRESS, config.HTTP_API_PORT).run()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,288 @@
+#Small helper process that starts solutions for a judge worker. It is started once per worker as a fresh
+#interpreter, so every test forks a tiny process instead of the whole judge, and ru_maxrss of a solution
+#doesn't include the resident size of the process it was forked from.
+#Protocol, one JSON object per line:
+#request  --> {"id": 1, "args": [...], "stdin": path, "stdout": path, "stderr": path,
+#              "limits": [[resource, soft, hard], ...], "memory": bytes or null, "timeout": wall clock limit in sec}
+#             {"id": 1, "kill": true}
+#response --> {"id": 1, "code": exit code, "utime": sec, "stime": sec, "maxrss": Kb, "killed": bool,
+#              "cgroup": bool, "oom_killed": bool}
+#             {"id": 1, "error": message} if the target can't be started
+#With "memory" the target runs in a memory cgroup of its own when the memory controller is available,
+#RLIMIT_AS from the limits is skipped then. A solution that allocates more than the limit at once is
+#killed by the OOM killer instead of getting a failed allocation, so it is reported as MLE, not RE.
+import os
+import sys
+import json
+import time
+import signal
+import select
+import resource
+import threading
+import subprocess
+
+#Python ignores these signals, the target must get the default behaviour (SIGXFSZ means OLE)
+RESTORED_SIGNALS = (signal.SIGPIPE, signal.SIGXFSZ)
+
+CGROUP_V2_ROOT = '/sys/fs/cgroup'
+CGROUP_V1_ROOT = '/sys/fs/cgroup/memory'
+CGROUP_NAME = 'verifier'
+
+class Launcher:
+    def __init__(self):
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.results = {}
+        self.reading = False
+        self.last_id = 0
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def send(self, request):
+        with self.lock:
+            self.process.stdin.write(json.dumps(request).encode('utf-8') + b'\n')
+            self.process.stdin.flush()
+
+    def start(self, args, stdin, stdout, stderr, limits, memory, timeout):
+        with self.lock:
+            self.last_id += 1
+            request_id = self.last_id
+        self.send({'id': request_id, 'args': args, 'stdin': os.path.abspath(stdin),
+                   'stdout': os.path.abspath(stdout), 'stderr': os.path.abspath(stderr),
+                   'limits': limits, 'memory': memory, 'timeout': timeout})
+        return request_id
+
+    def kill(self, request_id):
+        self.send({'id': request_id, 'kill': True})
+
+    def wait(self, request_id):
+        #Tests may run in parallel threads, one of them reads responses for everybody
+        with self.condition:
+            while request_id not in self.results:
+                if self.reading:
+                    self.condition.wait()
+                    continue
+                self.reading = True
+                self.condition.release()
+                try:
+                    line = self.process.stdout.readline()
+                finally:
+                    self.condition.acquire()
+                    self.reading = False
+                    self.condition.notify_all()
+                if not line:
+                    raise Exception('Launcher has stopped')
+                response = json.loads(line)
+                self.results[response['id']] = response
+            response = self.results.pop(request_id)
+        if 'error' in response:
+            raise Exception('Unable to start target: ' + response['error'])
+        return response
+
+#Every worker process has its own launcher
+launchers = {}
+
+def get_launcher():
+    pid = os.getpid()
+    if pid not in launchers or not launchers[pid].is_alive():
+        launchers[pid] = Launcher()
+    return launchers[pid]
+
+def write_file(path, value):
+    with open(path, 'w') as file:
+        file.write(value)
+
+#Cgroup per target: <root>/verifier/<launcher pid>-<request id>
+class MemoryCgroups:
+    def __init__(self):
+        self.base = None
+        self.version = None
+        try:
+            if os.path.exists(CGROUP_V2_ROOT + '/cgroup.controllers'):
+                with open(CGROUP_V2_ROOT + '/cgroup.controllers', 'r') as file:
+                    if 'memory' not in file.read().split():
+                        return
+                base = CGROUP_V2_ROOT + '/' + CGROUP_NAME
+                os.makedirs(base, exist_ok=True)
+                write_file(CGROUP_V2_ROOT + '/cgroup.subtree_control', '+memory')
+                write_file(base + '/cgroup.subtree_control', '+memory')
+                self.version = 2
+            elif os.path.exists(CGROUP_V1_ROOT + '/memory.limit_in_bytes'):
+                base = CGROUP_V1_ROOT + '/' + CGROUP_NAME
+                os.makedirs(base, exist_ok=True)
+                self.version = 1
+            else:
+                return
+        except OSError:
+            return
+        self.base = base
+        self.remove_stale()
+
+    def remove_stale(self):
+        #Left by launchers that were killed together with their targets
+        for name in os.listdir(self.base):
+            pid = name.split('-')[0]
+            if not pid.isdigit():
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                self.remove(self.base + '/' + name)
+            except PermissionError:
+                pass
+
+    def create(self, request_id, limit):
+        path = '{0}/{1}-{2}'.format(self.base, os.getpid(), request_id)
+        try:
+            os.mkdir(path)
+            if self.version == 2:
+                write_file(path + '/memory.max', str(limit))
+                swap_files = ['/memory.swap.max']
+            else:
+                write_file(path + '/memory.limit_in_bytes', str(limit))
+                swap_files = ['/memory.memsw.limit_in_bytes']
+        except OSError:
+            self.remove(path)
+            return None
+        for name in swap_files:
+            try:
+                write_file(path + name, '0' if self.version == 2 else str(limit))
+            except OSError:
+                #No swap accounting
+                pass
+        return path
+
+    def get_oom_kills(self, path):
+        name = '/memory.events' if self.version == 2 else '/memory.oom_control'
+        try:
+            with open(path + name, 'r') as file:
+                for line in file:
+                    key, value = line.split()
+                    if key == 'oom_kill':
+                        return int(value)
+        except OSError:
+            pass
+        return 0
+
+    def remove(self, path):
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+
+def exec_target(request, error_pipe, cgroup):
+    try:
+        if cgroup is not None:
+            write_file(cgroup + '/cgroup.procs', str(os.getpid()))
+        for signum in RESTORED_SIGNALS:
+            signal.signal(signum, signal.SIG_DFL)
+        stdin = os.open(request['stdin'], os.O_RDONLY)
+        stdout = os.open(request['stdout'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        stderr = os.open(request['stderr'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.dup2(stdin, 0)
+        os.dup2(stdout, 1)
+        os.dup2(stderr, 2)
+        os.closerange(3, error_pipe)
+        os.closerange(error_pipe + 1, resource.getrlimit(resource.RLIMIT_NOFILE)[0])
+        for name, soft, hard in request['limits']:
+            if cgroup is not None and name == resource.RLIMIT_AS:
+                continue
+            resource.setrlimit(name, (soft, hard))
+        os.execv(request['args'][0], request['args'])
+    except BaseException as e:
+        os.write(error_pipe, str(e).encode('utf-8', 'replace'))
+    os._exit(127)
+
+def spawn(request, cgroup):
+    #The pipe is closed on exec, so an empty read means the target has started
+    read_end, write_end = os.pipe2(os.O_CLOEXEC)
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        exec_target(request, write_end, cgroup)
+    os.close(write_end)
+    error = b''
+    while True:
+        chunk = os.read(read_end, 4096)
+        if not chunk:
+            break
+        error += chunk
+    os.close(read_end)
+    if error:
+        os.waitpid(pid, 0)
+        raise Exception(error.decode('utf-8', 'replace'))
+    return pid
+
+def respond(response):
+    data = json.dumps(response).encode('utf-8') + b'\n'
+    while data:
+        data = data[os.write(1, data):]
+
+def serve():
+    #pidfd --> [request id, pid, deadline or None once killed, killed, cgroup]
+    running = {}
+    cgroups = MemoryCgroups()
+    by_id = {}
+    buffer = b''
+    while True:
+        now = time.monotonic()
+        timeout = None
+        deadlines = [target[2] for target in running.values() if target[2] is not None]
+        if deadlines:
+            timeout = max(0, min(deadlines) - now)
+        readable, _, _ = select.select([0] + list(running), [], [], timeout)
+        for fd in readable:
+            if fd != 0:
+                request_id, pid, deadline, killed, cgroup = running.pop(fd)
+                del by_id[request_id]
+                os.close(fd)
+                pid, status, rusage = os.wait4(pid, 0)
+                oom_killed = False
+                if cgroup is not None:
+                    oom_killed = cgroups.get_oom_kills(cgroup) > 0
+                    cgroups.remove(cgroup)
+                respond({'id': request_id, 'code': os.waitstatus_to_exitcode(status),
+                         'utime': rusage.ru_utime, 'stime': rusage.ru_stime,
+                         'maxrss': rusage.ru_maxrss, 'killed': killed,
+                         'cgroup': cgroup is not None, 'oom_killed': oom_killed})
+                continue
+            chunk = os.read(0, 65536)
+            if not chunk:
+                #Worker has gone away
+                for target in running.values():
+                    os.kill(target[1], signal.SIGKILL)
+                return
+            buffer += chunk
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                request = json.loads(line)
+                if request.get('kill'):
+                    fd = by_id.get(request['id'])
+                    if fd is not None:
+                        signal.pidfd_send_signal(fd, signal.SIGKILL)
+                        running[fd][2:4] = [None, True]
+                    continue
+                cgroup = None
+                if request.get('memory') and cgroups.base is not None:
+                    cgroup = cgroups.create(request['id'], request['memory'])
+                try:
+                    pid = spawn(request, cgroup)
+                except Exception as e:
+                    if cgroup is not None:
+                        cgroups.remove(cgroup)
+                    respond({'id': request['id'], 'error': str(e)})
+                    continue
+                fd = os.pidfd_open(pid)
+                running[fd] = [request['id'], pid, time.monotonic() + request['timeout'], False, cgroup]
+                by_id[request['id']] = fd
+        now = time.monotonic()
+        for fd, target in running.items():
+            if target[2] is not None and target[2] <= now:
+                signal.pidfd_send_signal(fd, signal.SIGKILL)
+                target[2:4] = [None, True]
+
+if __name__ == '__main__':
+    serve()
@@ -1,51 +1,230 @@
-import sqlite3
 import imaplib
 import email
+import email.policy
+import email.header
+import email.utils
+import uuid
+import shutil
+import binascii
 import time
 import re
 import os
 import sys
+import socket
+import select
+import threading
 import logging
 import traceback
 import checker
 import config
+import database
+import scheduler
+import metrics
 from status import Status
+from taskregistry import registry
+from metrics import Timing, Stopwatch
+
+#Bytes of the body of an oversized message downloaded to find task and language
+OVERSIZED_TEXT_SIZE = 65536
 
 class Attachment:
-    def __init__(self, filename, data):
+    def __init__(self, filename, path, size):
         self.filename = filename
-        self.data = data
+        self.path = path
+        self.size = size
     def __repr__(self):
-        return str((self.filename, self.data))
+        return str((self.filename, self.size))
 
 class Message:
-    def __init__(self, sender, datetime, task=None, language=None, attachments=None):
+    def __init__(self, sender, datetime, task=None, language=None, attachments=None, staging_dir=None, oversized=False,
+                 source='mail', mail_result=True, access_key=None):
         self.sender = sender
         self.datetime = datetime
         self.task = task
         self.language = language
         self.attachments = attachments
+        self.staging_dir = staging_dir
+        self.oversized = oversized
+        self.source = source
+        self.mail_result = mail_result
+        self.access_key = access_key
+        self.solution_id = None
     def __repr__(self):
-        return str((self.sender, self.task, self.language, self.attachments))
+        return str((self.sender, self.task, self.language, self.attachments, self.oversized))
 
-class MailMonitor:
-    def __init__(self, server, port, user, password):
+#Common part of the ways solutions get into the queue: mail (MailMonitor) and the HTTP API (see httpapi.py)
+class Ingest:
+    def __init__(self, staging_name):
         self.solutions_dir = 'solutions'
-        self.tasks_dir = config.TASKS_DIR
+        self.staging_dir = self.solutions_dir + '/' + staging_name
+
+    def get_available_tasks(self):
+        return registry.get_names()
+
+    def notify_verifier(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.sendto(b'1', config.NOTIFY_SOCKET)
+        except OSError:
+            #Verifier is not running, it will poll the database on start
+            pass
+        finally:
+            sock.close()
+
+    def remove_staging_dir(self, message):
+        if message.staging_dir is not None:
+            shutil.rmtree(message.staging_dir, ignore_errors=True)
+
+    def filter_attachments(self, result):
+        #Language name is normalized, files with unknown extensions are dropped
+        if result.task is None or result.language is None or not result.attachments:
+            return result
+        for lang in checker.RUN_COMMANDS:
+            if lang.lower() == result.language.lower():
+                result.language = lang
+        if result.language not in checker.RUN_COMMANDS:
+            return result
+        attachments = result.attachments
+        result.attachments = []
+        for attachment in attachments:
+            if attachment.filename.endswith(checker.EXTENSIONS[result.language]):
+                result.attachments.append(attachment)
+            else:
+                os.remove(attachment.path)
+        return result
+
+    def apply_messages(self, messages, uids=None):
+        if not messages and not uids:
+            return
+        conn = database.connect()
+        cur = conn.cursor()
+        notify = False
+        #The whole batch is a single transaction, solution files are moved into place before commit,
+        #so a solution becomes WAITING together with its files or not at all
+        try:
+            for m in messages:
+                if m.sender in config.BLACKLIST:
+                    logging.info('Message from blacklisted sender: {0}. Ignoring.'.format(m.sender))
+                    continue
+                if not m.sender:
+                    #totally incorrect, don't send response
+                    status = Status.INVALID_SOLUTION_FORMAT_ERROR
+                    m.task = m.language = None
+                elif not m.task and not m.language:
+                    #totally incorrect, don't send response
+                    status = Status.INVALID_SOLUTION_FORMAT_ERROR
+                    m.task = m.language = None
+                elif m.oversized:
+                    status = Status.SIZE_LIMIT_EXCEEDED_WAITING
+                elif not m.task or not m.language or not m.attachments:
+                    status = Status.INVALID_SOLUTION_FORMAT_WAITING
+                    m.task = m.language = None
+                else:
+                    status = Status.WAITING
+                if status != Status.INVALID_SOLUTION_FORMAT_ERROR and config.DAILY_ATTEMPTS_LIMIT > 0:
+                    #Counted in the same transaction, so earlier messages of this batch are included
+                    attempts, rejected = scheduler.count_attempts(conn, m.sender)
+                    if attempts >= config.DAILY_ATTEMPTS_LIMIT:
+                        #Only the first rejected attempt of the day gets a response
+                        status = Status.ATTEMPTS_LIMIT_EXCEEDED if rejected else Status.ATTEMPTS_LIMIT_EXCEEDED_WAITING
+                        logging.info('Daily attempts limit exceeded by {0}'.format(m.sender))
+                cur.execute('''
+                INSERT INTO solutions (datetime, email, task, language, status, queued_at, source, mail_result, access_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (m.datetime, m.sender, m.task, m.language, status, time.time(), m.source, int(m.mail_result),
+                      m.access_key))
+                m.solution_id = cur.lastrowid
+                if status == Status.WAITING:
+                    solution_dir = self.solutions_dir + '/' + str(cur.lastrowid)
+                    #Left from a batch that was rolled back
+                    shutil.rmtree(solution_dir, ignore_errors=True)
+                    os.rename(m.staging_dir, solution_dir)
+                if status not in (Status.INVALID_SOLUTION_FORMAT_ERROR, Status.ATTEMPTS_LIMIT_EXCEEDED):
+                    notify = True
+            if uids:
+                database.set_setting(conn, 'imap_uidvalidity', self.uidvalidity)
+                database.set_setting(conn, 'imap_last_uid', str(max(uids)))
+            conn.commit()
+        finally:
+            conn.close()
+            for m in messages:
+                self.remove_staging_dir(m)
+        if notify:
+            self.notify_verifier()
+
+    def record_timings(self, timings):
+        conn = database.connect()
+        try:
+            metrics.record(conn, timings)
+            conn.commit()
+        except:
+            logging.warning('Unable to record timings: ' + traceback.format_exc())
+        finally:
+            conn.close()
+
+class MailMonitor(Ingest):
+    def __init__(self, server, port, user, password, use_ssl=True):
+        super().__init__('.staging')
         self.server = server
         self.port = port
         self.user = user
         self.password = password
-
-    def get_available_tasks(self):
-        return os.listdir(self.tasks_dir)
+        self.use_ssl = use_ssl
+        self.conn = None
+        self.idle_supported = False
+        self.uidvalidity = None
+        self.stopping = threading.Event()
 
     def connect(self):
-        conn = imaplib.IMAP4_SSL(self.server, self.port)
+        if self.use_ssl:
+            conn = imaplib.IMAP4_SSL(self.server, self.port)
+        else:
+            conn = imaplib.IMAP4(self.server, self.port)
         conn.login(self.user, self.password)
         conn.select()
+        res, data = conn.response('UIDVALIDITY')
+        self.uidvalidity = data[0].decode('ascii') if data and data[0] else None
+        res, data = conn.capability()
+        self.idle_supported = res == 'OK' and b'IDLE' in data[0].upper().split()
         return conn
 
+    def get_connection(self):
+        if self.conn is None:
+            self.conn = self.connect()
+        return self.conn
+
+    def disconnect(self):
+        if self.conn is None:
+            return
+        try:
+            self.conn.logout()
+        except:
+            pass
+        self.conn = None
+
+    def idle(self, conn, timeout):
+        tag = conn._new_tag()
+        conn.send(tag + b' IDLE\r\n')
+        response = conn.readline()
+        if not response.startswith(b'+'):
+            raise imaplib.IMAP4.error('IDLE is rejected: ' + response.decode('utf-8', 'replace'))
+        #Any untagged response (EXISTS, RECENT, ...) means the mailbox has changed
+        if not hasattr(conn.sock, 'pending') or not conn.sock.pending():
+            select.select([conn.sock], [], [], timeout)
+        conn.send(b'DONE\r\n')
+        while True:
+            response = conn.readline()
+            if not response:
+                raise imaplib.IMAP4.abort('Connection closed during IDLE')
+            if response.startswith(tag):
+                break
+
+    def wait_for_messages(self):
+        if self.conn is not None and self.idle_supported:
+            self.idle(self.conn, config.MAILMON_IDLE_TIMEOUT)
+        else:
+            self.stopping.wait(config.MAILMON_UPDATE_PERIOD)
+
     def find_value(self, text, value):
         regex = '{0}\s*?=\s*?([^<>\s]+)'.format(re.escape(value))
         res = re.findall(regex, text, re.DOTALL | re.IGNORECASE)
@@ -57,118 +236,248 @@ class MailMonitor:
                 item = item[:-1]
             return item
 
-    def get_message(self, conn, email_id):
-        resp, data = conn.fetch(email_id, '(BODY.PEEK[])')
-        email_body = data[0][1].decode('utf-8')
-        message = email.message_from_string(email_body)
-        sender = message['From'].split()[-1]
-        sender = re.sub(r'[<>]', '', sender)
+    def get_sender_and_datetime(self, message):
+        #None if there is no address to respond to
+        sender = None
+        if message['From'] is not None:
+            name, address = email.utils.parseaddr(str(message['From']))
+            if '@' in address:
+                sender = address
         try:
-            datetime = email.utils.parsedate(message['Date'])
+            datetime = email.utils.parsedate(str(message['Date']))
             datetime = int(time.mktime(datetime))
         except:
             datetime = 0
+        return sender, datetime
+
+    def get_payload_size(self, part):
+        payload = part.get_payload()
+        if str(part.get('Content-Transfer-Encoding', '')).lower() == 'base64':
+            return len(payload) * 3 // 4
+        return len(payload)
+
+    def write_payload(self, part, path):
+        #Base64 is decoded in chunks, so the decoded attachment is never kept in memory
+        with open(path, 'wb') as file:
+            if str(part.get('Content-Transfer-Encoding', '')).lower() != 'base64':
+                data = part.get_payload(decode=True)
+                file.write(data)
+                return len(data)
+            payload = part.get_payload()
+            size = 0
+            rest = ''
+            chunk_size = 65536
+            for i in range(0, len(payload), chunk_size):
+                data = rest + ''.join(payload[i:i + chunk_size].split())
+                end = len(data) - len(data) % 4
+                rest = data[end:]
+                size += file.write(binascii.a2b_base64(data[:end]))
+            if rest:
+                size += file.write(binascii.a2b_base64(rest + '=' * (-len(rest) % 4)))
+            return size
+
+    def get_oversized_message(self, raw_header, raw_text):
+        #Only the beginning of the body is known, text parts there may be cut
+        message = email.message_from_bytes(raw_header + raw_text, policy=email.policy.compat32)
+        sender, datetime = self.get_sender_and_datetime(message)
+        result = Message(sender, datetime, oversized=True)
+        for part in message.walk():
+            if part.is_multipart() or part.get_content_maintype() != 'text' or \
+               part.get('Content-Disposition') is not None:
+                continue
+            try:
+                charset = part.get_content_charset() or 'utf-8'
+                text = part.get_payload(decode=True).decode(charset, 'replace')
+            except:
+                continue
+            result.task = result.task or self.find_value(text, 'task')
+            result.language = result.language or self.find_value(text, 'language')
+        return result
+
+    def get_message(self, raw):
+        #compat32 is several times faster than the default policy, which parses every header it touches
+        message = email.message_from_bytes(raw, policy=email.policy.compat32)
+        sender, datetime = self.get_sender_and_datetime(message)
         task = None
         language = None
         attachments = []
+        staging_dir = self.staging_dir + '/' + uuid.uuid4().hex
+        os.makedirs(staging_dir)
+        result = Message(sender, datetime, task, language, attachments, staging_dir)
         try:
+            total_size = 0
             for part in message.walk():
+                if part.is_multipart():
+                    continue
                 if part.get_content_maintype() == 'text' and part.get('Content-Disposition') is None:
-                    text = part.get_payload(decode=True).decode('utf-8')
+                    charset = part.get_content_charset() or 'utf-8'
+                    text = part.get_payload(decode=True).decode(charset, 'replace')
                     if task is None or language is None:
                         task = self.find_value(text, 'task')
                         language = self.find_value(text, 'language')
                 elif part.get('Content-Disposition') is not None:
-                    filename = None
-                    data = None
-                    header = email.header.decode_header(part.get_filename())
-                    encoding = header[0][1]
-                    filename = header[0][0]
-                    if encoding is not None:
-                        filename = filename.decode(encoding)
-                    data = part.get_payload(decode=True)
-                    attachments.append(Attachment(filename, data))
+                    filename = part.get_filename() or ''
+                    filename = str(email.header.make_header(email.header.decode_header(filename)))
+                    filename = os.path.basename(filename)
+                    size = self.get_payload_size(part)
+                    total_size += size
+                    if size > config.ATTACHMENT_SIZE_LIMIT * 1024 or total_size > config.SOLUTION_SIZE_LIMIT * 1024:
+                        result.oversized = True
+                        break
+                    if not filename or filename.startswith('.'):
+                        continue
+                    path = staging_dir + '/' + filename
+                    attachments.append(Attachment(filename, path, self.write_payload(part, path)))
         except:
-            return Message(sender, datetime, task, language, attachments)
-        if task is None or language is None or not attachments:
-            return Message(sender, datetime, task, language, attachments)
-        language_ok = False
-        for lang in checker.RUN_COMMANDS:
-            if lang.lower() == language.lower():
-                language_ok = True
-                language = lang
-        for attachment in attachments:
-            if not attachment.filename.endswith(checker.EXTENSIONS[language]):
-                attachments.remove(attachment)
-        if task not in self.get_available_tasks() or \
-           not language_ok or not attachments:
-            return Message(sender, datetime, task, language, attachments)
-        return Message(sender, datetime, task, language, attachments)
+            pass
+        result.task = task
+        result.language = language
+        return self.filter_attachments(result)
 
-    def get_new_messages(self):
+    def get_last_uid(self):
+        conn = database.connect()
+        database.migrate(conn)
+        uidvalidity = database.get_setting(conn, 'imap_uidvalidity')
+        last_uid = database.get_setting(conn, 'imap_last_uid')
+        conn.close()
+        #UIDs of the old mailbox are meaningless, so start over with unseen messages
+        if last_uid is None or uidvalidity != self.uidvalidity:
+            return 0
+        return int(last_uid)
+
+    def fetch_messages(self, conn, uids):
         messages = []
-        conn = self.connect()
-        res, email_ids = conn.search(None, 'UnSeen')
-        if res == 'OK':
-            email_ids = email_ids[0].split()
-            for email_id in email_ids:
-                try:
-                    conn.store(email_id, '+FLAGS', '\\Seen')
-                    messages.append(self.get_message(conn, email_id))
-                except:
-                    logging.warning('Failed to process message: ' + traceback.format_exc())
+        uid_set = ','.join(str(uid) for uid in uids)
+        #Sizes and headers first, so that oversized messages are never downloaded
+        res, data = conn.uid('FETCH', uid_set, '(UID RFC822.SIZE BODY.PEEK[HEADER])')
+        if res != 'OK':
+            raise imaplib.IMAP4.error('Unable to fetch messages: ' + str(data))
+        uids = []
+        #UID --> header of an oversized message
+        oversized = {}
+        for item in data:
+            if not isinstance(item, tuple):
+                continue
+            uid = int(re.search(rb'UID (\d+)', item[0]).group(1))
+            size = int(re.search(rb'RFC822\.SIZE (\d+)', item[0]).group(1))
+            if size > config.MESSAGE_SIZE_LIMIT * 1024:
+                oversized[uid] = item[1]
+            else:
+                uids.append(uid)
+        if oversized:
+            messages += self.fetch_oversized_messages(conn, oversized)
+        if not uids:
+            return messages
+        uid_set = ','.join(str(uid) for uid in uids)
+        res, data = conn.uid('FETCH', uid_set, '(UID BODY.PEEK[])')
+        if res != 'OK':
+            raise imaplib.IMAP4.error('Unable to fetch messages: ' + str(data))
+        for i, item in enumerate(data):
+            if not isinstance(item, tuple):
+                continue
+            try:
+                messages.append(self.get_message(item[1]))
+            except:
+                logging.warning('Failed to process message: ' + traceback.format_exc())
+            data[i] = None
         return messages
 
-    def apply_messages(self, messages):
-        if not messages:
-            return
-        conn = sqlite3.connect("database.db")
+    def fetch_oversized_messages(self, conn, headers):
+        #Only the beginning of the body, so that the response goes only to messages with task or language
+        messages = []
+        uid_set = ','.join(str(uid) for uid in headers)
+        res, data = conn.uid('FETCH', uid_set, '(UID BODY.PEEK[TEXT]<0.{0}>)'.format(OVERSIZED_TEXT_SIZE))
+        if res != 'OK':
+            raise imaplib.IMAP4.error('Unable to fetch messages: ' + str(data))
+        texts = {}
+        for item in data:
+            if isinstance(item, tuple):
+                texts[int(re.search(rb'UID (\d+)', item[0]).group(1))] = item[1]
+        for uid, header in headers.items():
+            try:
+                messages.append(self.get_oversized_message(header, texts.get(uid, b'')))
+            except:
+                logging.warning('Failed to process message: ' + traceback.format_exc())
+        return messages
+
+    def get_new_messages(self):
+        messages = []
+        conn = self.get_connection()
+        last_uid = self.get_last_uid()
+        res, data = conn.uid('SEARCH', None, 'UNSEEN UID {0}:*'.format(last_uid + 1))
+        if res != 'OK':
+            return messages, []
+        #'N:*' always contains the last message, even if its UID is less than N
+        uids = [int(uid) for uid in data[0].split() if int(uid) > last_uid]
+        for i in range(0, len(uids), config.MAILMON_FETCH_BATCH):
+            messages += self.fetch_messages(conn, uids[i:i + config.MAILMON_FETCH_BATCH])
+        return messages, uids
+
+    def mark_seen(self, uids):
+        for i in range(0, len(uids), config.MAILMON_FETCH_BATCH):
+            uid_set = ','.join(str(uid) for uid in uids[i:i + config.MAILMON_FETCH_BATCH])
+            self.get_connection().uid('STORE', uid_set, '+FLAGS.SILENT', '(\\Seen)')
+
+    def recover(self):
+        conn = database.connect()
+        database.migrate(conn)
         cur = conn.cursor()
-        for m in messages:
-            if m.sender in config.BLACKLIST:
-                logging.info('Message from blacklisted sender: {0}. Ignoring.'.format(m.sender))
-                continue
-            if not m.sender or not m.task and not m.language:
-                #totally incorrect, don't send response
-                status = Status.INVALID_SOLUTION_FORMAT_ERROR
-                m.task = m.language = None
-            elif not m.task or not m.language or not m.attachments:
-                status = Status.INVALID_SOLUTION_FORMAT_WAITING
-                m.task = m.language = None
+        #Write lock is taken first, so no other ingest has uncommitted solutions with dirs already in place
+        cur.execute('BEGIN IMMEDIATE')
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        #Solutions that were being copied when the previous version of mailmon stopped
+        solutions = cur.execute('SELECT id FROM solutions WHERE status = ?', (Status.COPYING,)).fetchall()
+        for solution_id, in solutions:
+            solution_dir = self.solutions_dir + '/' + str(solution_id)
+            if os.path.isdir(solution_dir) and os.listdir(solution_dir):
+                status = Status.WAITING
             else:
-                status = Status.COPYING
-            cur.execute('INSERT INTO solutions (datetime, email, task, language, status) VALUES (?, ?, ?, ?, ?)',
-                        (m.datetime, m.sender, m.task, m.language, status))
-            conn.commit()
-            if status == Status.COPYING:
-                solution_id = cur.lastrowid
-                solution_dir = self.solutions_dir + '/' + str(solution_id)
-                os.mkdir(solution_dir)
-                for attachment in m.attachments:
-                    file = open(solution_dir + '/' + attachment.filename, 'wb')
-                    file.write(attachment.data)
-                    file.close()
-                cur.execute('UPDATE solutions SET status = ? WHERE id = ?',
-                            (Status.WAITING, solution_id))
-                conn.commit()
+                status = Status.INVALID_SOLUTION_FORMAT_WAITING
+                cur.execute('UPDATE solutions SET task = NULL, language = NULL WHERE id = ?', (solution_id,))
+            cur.execute('UPDATE solutions SET status = ? WHERE id = ?', (status, solution_id))
+            logging.info('Recovered solution {0}: {1}'.format(solution_id, Status.get_string(status)))
+        #Solution dirs of rolled back batches
+        last_id = cur.execute('SELECT coalesce(max(id), 0) FROM solutions').fetchone()[0]
+        if os.path.isdir(self.solutions_dir):
+            for name in os.listdir(self.solutions_dir):
+                if name.isdigit() and int(name) > last_id:
+                    shutil.rmtree(self.solutions_dir + '/' + name, ignore_errors=True)
+        conn.commit()
         conn.close()
+        if solutions:
+            self.notify_verifier()
+
+    def stop(self):
+        #Every batch is a single transaction, so an unfinished one is just fetched again after restart
+        self.stopping.set()
 
     def run(self):
-        while True:
+        self.recover()
+        while not self.stopping.is_set():
             try:
-                messages = self.get_new_messages()
-                self.apply_messages(messages)
+                stopwatch = Stopwatch()
+                messages, uids = self.get_new_messages()
+                fetch_time = stopwatch.get_elapsed()
+                stopwatch = Stopwatch()
+                self.apply_messages(messages, uids)
+                if uids:
+                    self.record_timings([Timing('fetch', fetch_time), Timing('ingest', stopwatch.get_elapsed())])
+                self.mark_seen(uids)
+                self.wait_for_messages()
+                continue
             except:
                 logging.warning('Failed to process new messages: ' + traceback.format_exc())
-            time.sleep(config.MAILMON_UPDATE_PERIOD)
-
-logging.basicConfig(filename='log.txt',
-                    format='[%(asctime)s][%(levelname)s]: %(message)s',
-                    datefmt='%d %b %Y %H:%M:%S',
-                    level=logging.DEBUG)
-logging.info('Mail Monitor started')
-try:
-    mailmon = MailMonitor(config.IMAP_SERVER, config.IMAP_PORT, config.LOGIN, config.PASSWORD)
-    mailmon.run()
-except KeyboardInterrupt:
-    sys.exit(0)
+                self.disconnect()
+            self.stopping.wait(config.MAILMON_UPDATE_PERIOD)
+
+if __name__ == '__main__':
+    logging.basicConfig(filename='log.txt',
+                        format='[%(asctime)s][%(levelname)s]: %(message)s',
+                        datefmt='%d %b %Y %H:%M:%S',
+                        level=logging.DEBUG)
+    logging.info('Mail Monitor started')
+    try:
+        mailmon = MailMonitor(config.IMAP_SERVER, config.IMAP_PORT, config.LOGIN, config.PASSWORD, config.IMAP_SSL)
+        mailmon.run()
+    except KeyboardInterrupt:
+        sys.exit(0)
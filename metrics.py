@@ -0,0 +1,98 @@
+import os
+import math
+import time
+import database
+
+#Every judging stage is stored as a row of the timings table. Times are in seconds, memory in Mb,
+#cpu and memory are known only for test runs.
+#Stages: fetch, ingest (per mail batch), queue, compile, apparmor, test, compare, tests, judge (per solution),
+#send (time from the verdict to delivery of the response),
+#startup, drain, restart (time from the restart signal until the new process is ready),
+#requeue (per solution interrupted by a stop, time it had been judged, i.e. work to be repeated)
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+class Timing:
+    def __init__(self, stage, wall, cpu=None, memory=None, test_num=None):
+        self.stage = stage
+        self.wall = wall
+        self.cpu = cpu
+        self.memory = memory
+        self.test_num = test_num
+
+    def __repr__(self):
+        return str((self.stage, self.wall, self.cpu, self.memory, self.test_num))
+
+class Stopwatch:
+    def __init__(self):
+        self.start = time.perf_counter()
+
+    def get_elapsed(self):
+        return time.perf_counter() - self.start
+
+def record(conn, timings, solution_id=None, task=None, language=None):
+    now = time.time()
+    conn.executemany('''
+    INSERT INTO timings (recorded_at, stage, solution_id, task, language, test_num, wall, cpu, memory)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(now, t.stage, solution_id, task, language, t.test_num, t.wall, t.cpu, t.memory) for t in timings])
+
+def prune(conn, before):
+    conn.execute('DELETE FROM timings WHERE recorded_at < ?', (before,))
+
+def percentile(values, q):
+    #Nearest rank, values must be sorted
+    if not values:
+        return None
+    return values[max(0, int(math.ceil(q * len(values))) - 1)]
+
+def get_values(conn, column, since, until, by_task=False):
+    key = 'task, stage' if by_task else 'stage'
+    rows = conn.execute('''
+    SELECT {0}, {1} FROM timings WHERE recorded_at >= ? AND recorded_at < ? AND {1} IS NOT NULL
+    ORDER BY {0}, {1}
+    '''.format(key, column), (since, until)).fetchall()
+    values = {}
+    for row in rows:
+        values.setdefault(row[:-1] if by_task else row[0], []).append(row[-1])
+    return values
+
+def add_summary(lines, name, description, values):
+    lines.append('# HELP {0} {1}'.format(name, description))
+    lines.append('# TYPE {0} summary'.format(name))
+    for stage in sorted(values):
+        stage_values = values[stage]
+        for q in QUANTILES:
+            lines.append('{0}{{stage="{1}",quantile="{2}"}} {3}'.format(name, stage, q, percentile(stage_values, q)))
+        lines.append('{0}_sum{{stage="{1}"}} {2}'.format(name, stage, sum(stage_values)))
+        lines.append('{0}_count{{stage="{1}"}} {2}'.format(name, stage, len(stage_values)))
+
+def add_gauge(lines, name, description, value):
+    lines.append('# HELP {0} {1}'.format(name, description))
+    lines.append('# TYPE {0} gauge'.format(name))
+    lines.append('{0} {1}'.format(name, value))
+
+def render_textfile(conn, window):
+    now = time.time()
+    since = now - window
+    lines = []
+    add_summary(lines, 'verifier_stage_seconds',
+                'Wall time of judging stages over the last {0:g} sec'.format(window),
+                get_values(conn, 'wall', since, now))
+    add_summary(lines, 'verifier_stage_cpu_seconds',
+                'CPU time of test runs over the last {0:g} sec'.format(window),
+                get_values(conn, 'cpu', since, now))
+    add_summary(lines, 'verifier_stage_memory_megabytes',
+                'Peak memory of test runs over the last {0:g} sec'.format(window),
+                get_values(conn, 'memory', since, now))
+    pending = conn.execute('SELECT count(*) FROM solutions WHERE ' + database.PENDING_CONDITION).fetchone()[0]
+    add_gauge(lines, 'verifier_queue_length', 'Solutions waiting for a worker', pending)
+    add_gauge(lines, 'verifier_metrics_timestamp_seconds', 'Time of the last update', now)
+    return '\n'.join(lines) + '\n'
+
+def write_textfile(conn, path, window):
+    #Prometheus node exporter may read the file at any moment, so it is replaced atomically
+    temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'w') as file:
+        file.write(render_textfile(conn, window))
+    os.rename(temp_path, path)
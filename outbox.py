@@ -0,0 +1,169 @@
+import os
+import time
+import json
+import uuid
+import smtplib
+import logging
+import traceback
+import threading
+import multiprocessing
+import config
+
+#Connecting or logging in has failed, so nothing is known about the message being sent
+class SessionError(Exception):
+    pass
+
+class SMTPSession:
+    def __init__(self, server, port, user, password, use_ssl=True):
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_ssl = use_ssl
+        self.smtp = None
+        self.last_used = 0
+
+    def connect(self):
+        try:
+            if self.use_ssl:
+                smtp = smtplib.SMTP_SSL(self.server, self.port, timeout=config.SMTP_TIMEOUT)
+            else:
+                smtp = smtplib.SMTP(self.server, self.port, timeout=config.SMTP_TIMEOUT)
+        except Exception as e:
+            raise SessionError('Unable to connect to {0}:{1}: {2!r}'.format(self.server, self.port, e))
+        try:
+            smtp.login(self.user, self.password)
+        except Exception as e:
+            smtp.close()
+            raise SessionError('Unable to log in to {0}:{1}: {2!r}'.format(self.server, self.port, e))
+        return smtp
+
+    def close(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except:
+            pass
+        self.smtp = None
+
+    def try_close_idle(self):
+        if self.smtp is not None and time.time() - self.last_used > config.SMTP_IDLE_TIMEOUT:
+            self.close()
+
+    def sendmail(self, sender, receivers, message):
+        #Server may have dropped an idle connection, so reconnect once
+        for attempt in range(2):
+            if self.smtp is None:
+                self.smtp = self.connect()
+            try:
+                self.smtp.sendmail(sender, receivers, message)
+                self.last_used = time.time()
+                return
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException):
+                #Server has answered, so the connection is fine
+                raise
+            except OSError:
+                self.smtp = None
+                if attempt == 1:
+                    raise
+
+def is_permanent_error(e):
+    #Only answers of the server to MAIL, RCPT and DATA of the message itself
+    if isinstance(e, SessionError):
+        return False
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(e, smtplib.SMTPResponseException) and e.smtp_code >= 500
+
+#Every queued message is a json file in the outbox dir:
+#{"receivers": [...], "message": "...", "attempts": 0, "next_try": 0, "created": 0, "solution_id": null}
+
+class Outbox:
+    def __init__(self, outbox_dir, session, sender, on_delivered=None):
+        self.outbox_dir = outbox_dir
+        self.failed_dir = outbox_dir + '/failed'
+        self.session = session
+        self.sender = sender
+        self.on_delivered = on_delivered
+        self.pending = multiprocessing.Event()
+        self.stopping = threading.Event()
+        #Backoff while the server can't be connected to, messages keep their attempts
+        self.session_failures = 0
+        self.next_session_try = 0
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+    def write_item(self, path, item):
+        temp_path = '{0}/.{1}.tmp'.format(self.outbox_dir, uuid.uuid4().hex)
+        with open(temp_path, 'w') as file:
+            json.dump(item, file)
+        os.rename(temp_path, path)
+
+    def put(self, receivers, message, solution_id=None):
+        now = time.time()
+        name = '{0:.6f}-{1}.json'.format(now, uuid.uuid4().hex)
+        item = {'receivers': receivers, 'message': message, 'attempts': 0, 'next_try': 0,
+                'created': now, 'solution_id': solution_id}
+        self.write_item(self.outbox_dir + '/' + name, item)
+        self.pending.set()
+
+    def get_queued(self):
+        return sorted(f for f in os.listdir(self.outbox_dir) if f.endswith('.json'))
+
+    def get_retry_delay(self, failures):
+        return min(config.OUTBOX_RETRY_DELAY * 2 ** (failures - 1), config.OUTBOX_MAX_RETRY_DELAY)
+
+    def deliver(self):
+        if self.next_session_try > time.time():
+            return
+        for name in self.get_queued():
+            if self.stopping.is_set():
+                break
+            path = self.outbox_dir + '/' + name
+            with open(path, 'r') as file:
+                item = json.load(file)
+            if item['next_try'] > time.time():
+                continue
+            try:
+                self.session.sendmail(self.sender, item['receivers'], item['message'])
+            except SessionError as e:
+                self.session_failures += 1
+                self.next_session_try = time.time() + self.get_retry_delay(self.session_failures)
+                logging.warning('Unable to send messages: {0}'.format(e))
+                break
+            except Exception as e:
+                if is_permanent_error(e):
+                    logging.warning('Message to {0} is rejected: {1}'.format(item['receivers'], traceback.format_exc()))
+                    os.rename(path, self.failed_dir + '/' + name)
+                    continue
+                logging.warning('Unable to send message to {0}: {1}'.format(item['receivers'], traceback.format_exc()))
+                item['attempts'] += 1
+                if item['attempts'] >= config.OUTBOX_MAX_ATTEMPTS:
+                    os.rename(path, self.failed_dir + '/' + name)
+                    continue
+                item['next_try'] = time.time() + self.get_retry_delay(item['attempts'])
+                self.write_item(path, item)
+                #Server is probably unavailable, try the rest later
+                break
+            self.session_failures = 0
+            os.remove(path)
+            if self.on_delivered is not None:
+                try:
+                    self.on_delivered(item)
+                except:
+                    logging.warning('Delivery callback failed: ' + traceback.format_exc())
+
+    def stop(self):
+        #Messages that are not sent yet stay in the outbox dir
+        self.stopping.set()
+        self.pending.set()
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.pending.clear()
+            try:
+                self.deliver()
+            except:
+                logging.warning('Unable to deliver messages: ' + traceback.format_exc())
+            self.session.try_close_idle()
+            self.pending.wait(config.OUTBOX_UPDATE_PERIOD)
@@ -0,0 +1,8 @@
+#!/usr/bin/env bash
+#Drains like stop.sh, then the same process starts again with the new code and config
+if [ ! -f verifier.pid ]; then
+   echo "Verifier is not running."
+   exit 1
+fi
+sudo kill -HUP $(cat verifier.pid)
+echo Verifier is restarting.
@@ -0,0 +1,44 @@
+import datetime
+import database
+from status import Status
+
+#Pending solutions are taken round-robin across senders: a solution is ordered by how many solutions
+#its sender had already sent today, so the n-th attempt of every sender goes before the (n + 1)-th attempt
+#of anyone, and a sender with many resubmissions doesn't delay the others.
+#With first attempt priority, solutions for tasks the sender has never submitted before go first.
+
+class Scheduler:
+    def __init__(self, first_attempt_priority=False):
+        order = 'turn, id'
+        if first_attempt_priority:
+            order = 'first_attempt DESC, ' + order
+        #The pending index is forced, otherwise the planner may scan the whole table by email
+        self.query = '''
+        SELECT id, datetime, email, task, language, status, queued_at FROM (
+            SELECT id, datetime, email, task, language, status, queued_at,
+                   (SELECT count(*) FROM solutions AS earlier
+                    WHERE earlier.email = pending.email AND
+                          earlier.queued_at >= ? AND
+                          earlier.id < pending.id) AS turn,
+                   NOT EXISTS (SELECT 1 FROM solutions AS previous
+                               WHERE previous.email = pending.email AND
+                                     previous.task = pending.task AND
+                                     previous.id < pending.id) AS first_attempt
+            FROM solutions AS pending INDEXED BY solutions_pending WHERE {0}
+        ) ORDER BY {1} LIMIT 1
+        '''.format(database.PENDING_CONDITION, order)
+
+    def get_next(self, conn):
+        return conn.execute(self.query, (get_day_start(),)).fetchone()
+
+def get_day_start():
+    return datetime.datetime.combine(datetime.date.today(), datetime.time()).timestamp()
+
+def count_attempts(conn, email):
+    #Attempts of the current day, and how many of them were already rejected because of the limit
+    attempts, rejected = conn.execute('''
+    SELECT count(*), coalesce(sum(status IN (?, ?)), 0) FROM solutions
+    WHERE email = ? AND queued_at >= ? AND status != ?
+    ''', (Status.ATTEMPTS_LIMIT_EXCEEDED_WAITING, Status.ATTEMPTS_LIMIT_EXCEEDED,
+          email, get_day_start(), Status.INVALID_SOLUTION_FORMAT_ERROR)).fetchone()
+    return attempts - rejected, rejected
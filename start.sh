@@ -4,6 +4,5 @@ if [ "$(id -u)" != "0" ]; then
    exit 1
 fi
 rm -f log.txt
-sudo nohup python3 app.py > /dev/null 2>&1 &
-sudo nohup python3 mailmon.py > /dev/null 2>&1 &
+sudo nohup python3 supervisor.py > /dev/null 2>&1 &
 echo "Verifier started."
@@ -12,6 +12,12 @@ class Status:
     INVALID_SOLUTION_FORMAT_ERROR   = 10
     INVALID_SOLUTION_FORMAT_WAITING = 11
     COMPILATION_TIME_LIMIT_EXCEEDED = 12
+    JUDGING                         = 13
+    OUTPUT_LIMIT_EXCEEDED           = 14
+    SIZE_LIMIT_EXCEEDED_WAITING     = 15
+    SIZE_LIMIT_EXCEEDED             = 16
+    ATTEMPTS_LIMIT_EXCEEDED_WAITING = 17
+    ATTEMPTS_LIMIT_EXCEEDED         = 18
 
     def get_string(status):
         strings = {
@@ -28,5 +34,11 @@ class Status:
             Status.INVALID_SOLUTION_FORMAT_ERROR   : 'Invalid Solution Format Error',
             Status.INVALID_SOLUTION_FORMAT_WAITING : 'Invalid Solution Format Waiting',
             Status.COMPILATION_TIME_LIMIT_EXCEEDED : 'Compilation Time Limit Exceeded',
+            Status.JUDGING                         : 'Judging',
+            Status.OUTPUT_LIMIT_EXCEEDED           : 'Output Limit Exceeded',
+            Status.SIZE_LIMIT_EXCEEDED_WAITING     : 'Size Limit Exceeded Waiting',
+            Status.SIZE_LIMIT_EXCEEDED             : 'Size Limit Exceeded',
+            Status.ATTEMPTS_LIMIT_EXCEEDED_WAITING : 'Attempts Limit Exceeded Waiting',
+            Status.ATTEMPTS_LIMIT_EXCEEDED         : 'Attempts Limit Exceeded',
         }
         return strings[status]
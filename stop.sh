@@ -1,5 +1,12 @@
 #!/usr/bin/env bash
-#todo: kill by pids
-sudo pkill -f app.py
-sudo pkill -f mailmon.py
+#Solutions being judged are finished or returned to the queue, see supervisor.py
+if [ ! -f verifier.pid ]; then
+   echo "Verifier is not running."
+   exit 0
+fi
+pid=$(cat verifier.pid)
+sudo kill -TERM $pid
+while sudo kill -0 $pid 2> /dev/null; do
+   sleep 0.2
+done
 echo Verifier stopped.
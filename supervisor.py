@@ -0,0 +1,151 @@
+#Single entry point of the verifier, started by start.sh: judging (App), the mail ingest (MailMonitor) and
+#the HTTP API (SubmissionAPI) run in one process around one asyncio loop. CPU work is done by the forked
+#judge workers of App, the blocking IMAP client runs in a thread.
+#SIGTERM, SIGINT - graceful drain: ingest stops, workers finish the solutions they judge, solutions still
+#judged after DRAIN_TIMEOUT are returned to the queue, unsent responses stay in the outbox.
+#SIGHUP - drain and restart in place, the pid doesn't change.
+#Startup, drain and restart times and the judging time lost by interrupted solutions are recorded
+#as timings, see metrics.py.
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+import threading
+import config
+import database
+import metrics
+from app import App
+from mailmon import MailMonitor
+from httpapi import SubmissionAPI
+from metrics import Timing
+
+#Time of the SIGHUP that restarted the process, passed to the new process image
+RESTARTED_AT_VARIABLE = 'VERIFIER_RESTARTED_AT'
+
+def read_pid_file(path):
+    try:
+        with open(path, 'r') as file:
+            return int(file.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class Supervisor:
+    def __init__(self):
+        self.created = time.time()
+        self.app = App(config.SMTP_SERVER, config.SMTP_PORT, config.LOGIN, config.PASSWORD)
+        self.mailmon = MailMonitor(config.IMAP_SERVER, config.IMAP_PORT, config.LOGIN, config.PASSWORD, config.IMAP_SSL)
+        self.http_api = SubmissionAPI(config.HTTP_API_ADDRESS, config.HTTP_API_PORT) if config.HTTP_API_PORT else None
+        self.events = None
+        self.stopping = False
+        self.restart = False
+        self.stopped_at = None
+
+    def stop(self, restart=False):
+        if not self.stopping:
+            logging.info('Got {0} request, draining'.format('restart' if restart else 'stop'))
+            self.stopped_at = time.time()
+        self.stopping = True
+        self.restart = self.restart or restart
+        self.events.set()
+
+    def record_startup(self):
+        now = time.time()
+        timings = [Timing('startup', now - self.created)]
+        restarted_at = os.environ.pop(RESTARTED_AT_VARIABLE, None)
+        if restarted_at is not None:
+            timings.append(Timing('restart', now - float(restarted_at)))
+        conn = database.connect()
+        try:
+            metrics.record(conn, timings)
+            conn.commit()
+        finally:
+            conn.close()
+        logging.info('Verifier is ready in {0:.2f} sec'.format(timings[-1].wall))
+
+    async def wait_for_events(self, fds, timeout):
+        loop = asyncio.get_running_loop()
+        self.events.clear()
+        if self.stopping:
+            return
+        for fd in fds:
+            loop.add_reader(fd, self.events.set)
+        try:
+            await asyncio.wait_for(self.events.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for fd in fds:
+                loop.remove_reader(fd)
+
+    async def run_app(self, sock):
+        #Same as App.run, but the loop stays free for the HTTP API and signals
+        conn = database.connect()
+        try:
+            while not self.stopping:
+                await self.wait_for_events([sock] + self.app.get_sentinels(), self.app.get_poll_timeout())
+                if not self.stopping:
+                    self.app.poll(conn, sock)
+        finally:
+            conn.close()
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        self.events = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, self.stop)
+        loop.add_signal_handler(signal.SIGINT, self.stop)
+        loop.add_signal_handler(signal.SIGHUP, self.stop, True)
+        sock = self.app.start()
+        threading.Thread(target=self.mailmon.run, daemon=True).start()
+        server = None
+        if self.http_api is not None:
+            server = await self.http_api.start()
+        self.record_startup()
+        await self.run_app(sock)
+        #Ingest stops first, so nothing new is queued while the workers drain
+        self.mailmon.stop()
+        if server is not None:
+            server.close()
+        await loop.run_in_executor(None, self.app.drain, config.DRAIN_TIMEOUT)
+        sock.close()
+
+    def run(self):
+        pid = read_pid_file(config.PID_FILE)
+        #The pid is kept on restart
+        if pid is not None and pid != os.getpid() and is_running(pid):
+            print('Verifier is already running, pid {0}'.format(pid))
+            sys.exit(1)
+        with open(config.PID_FILE + '.tmp', 'w') as file:
+            file.write(str(os.getpid()))
+        os.rename(config.PID_FILE + '.tmp', config.PID_FILE)
+        try:
+            asyncio.run(self.serve())
+        finally:
+            if not self.restart:
+                os.remove(config.PID_FILE)
+        if self.restart:
+            logging.info('Restarting')
+            os.environ[RESTARTED_AT_VARIABLE] = str(self.stopped_at)
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+        logging.info('Verifier stopped')
+
+if __name__ == '__main__':
+    logging.basicConfig(filename='log.txt',
+                        format='[%(asctime)s][%(levelname)s]: %(message)s',
+                        datefmt='%d %b %Y %H:%M:%S',
+                        level=logging.DEBUG)
+    if os.getuid() != 0:
+        print('You should run verifier with sudo privileges!')
+        sys.exit(1)
+    logging.info('Supervisor started')
+    Supervisor().run()
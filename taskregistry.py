@@ -0,0 +1,136 @@
+import os
+import re
+import time
+import hashlib
+import threading
+import configparser
+import config
+
+def natural_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+def get_stat(path):
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+class Test:
+    def __init__(self, num, input_path, etalon_path):
+        self.num = num
+        self.input_path = input_path
+        self.etalon_path = etalon_path
+        self.input_size = os.path.getsize(input_path)
+        self.etalon_size = os.path.getsize(etalon_path) if os.path.exists(etalon_path) else 0
+
+class Task:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.info_path = path + '/task_info.ini'
+        self.info = configparser.ConfigParser()
+        self.info.read(self.info_path)
+        checker = self.info.get('general', 'checker', fallback=None)
+        self.checker_path = None if checker is None else path + '/' + checker
+        self.tests = []
+        names = [f for f in os.listdir(path) if f.endswith('.in')]
+        for i, file in enumerate(sorted(names, key=natural_key), 1):
+            name = os.path.splitext(file)[0]
+            self.tests.append(Test(i, path + '/' + file, path + '/' + name + '.out'))
+        self.stamp = self.get_stamp()
+        self.fingerprint = None
+
+    def get_stamp(self):
+        stamp = [get_stat(self.path), get_stat(self.info_path)]
+        if self.checker_path is not None:
+            stamp.append(get_stat(self.checker_path))
+        for test in self.tests:
+            stamp.append(get_stat(test.input_path))
+            stamp.append(get_stat(test.etalon_path))
+        return stamp
+
+    def get_fingerprint(self):
+        #Hash of everything that affects verdicts, computed once per task version
+        if self.fingerprint is None:
+            paths = [self.info_path]
+            if self.checker_path is not None:
+                paths.append(self.checker_path)
+            for test in self.tests:
+                paths += [test.input_path, test.etalon_path]
+            fingerprint = hashlib.sha256()
+            for path in paths:
+                fingerprint.update(os.path.basename(path).encode('utf-8') + b'\0')
+                content = hashlib.sha256()
+                try:
+                    with open(path, 'rb') as file:
+                        for chunk in iter(lambda: file.read(65536), b''):
+                            content.update(chunk)
+                except FileNotFoundError:
+                    content.update(b'missing')
+                fingerprint.update(content.digest())
+            self.fingerprint = fingerprint.hexdigest()
+        return self.fingerprint
+
+    def is_changed(self):
+        return self.get_stamp() != self.stamp
+
+    def get_limits(self, language):
+        memory = float(self.info[language]['memory'])
+        time = float(self.info[language]['time'])
+        return memory, time
+
+#Shared by the judge loop, the coordinator, mailmon and the HTTP API threads of the supervisor
+class TaskRegistry:
+    def __init__(self, tasks_dir, refresh_period):
+        self.tasks_dir = tasks_dir
+        self.refresh_period = refresh_period
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.tasks_dir_stat = None
+        self.last_refresh = None
+        #Judge workers are forked while other threads may hold the lock
+        os.register_at_fork(after_in_child=self.reset_lock)
+
+    def reset_lock(self):
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        with self.lock:
+            self.load()
+
+    def load(self):
+        #Called under the lock
+        tasks_dir_stat = get_stat(self.tasks_dir)
+        if tasks_dir_stat != self.tasks_dir_stat:
+            self.tasks_dir_stat = tasks_dir_stat
+            names = set()
+            if tasks_dir_stat is not None:
+                names = set(f for f in os.listdir(self.tasks_dir) if os.path.isdir(self.tasks_dir + '/' + f))
+            for name in list(self.tasks):
+                if name not in names:
+                    del self.tasks[name]
+            for name in names:
+                if name not in self.tasks:
+                    self.tasks[name] = Task(name, self.tasks_dir + '/' + name)
+        for name, task in self.tasks.items():
+            if task.is_changed():
+                self.tasks[name] = Task(name, task.path)
+        self.last_refresh = time.time()
+
+    def try_refresh(self):
+        #Called under the lock
+        if self.last_refresh is None or time.time() - self.last_refresh >= self.refresh_period:
+            self.load()
+
+    def get_names(self):
+        with self.lock:
+            self.try_refresh()
+            return list(self.tasks)
+
+    def get(self, name):
+        with self.lock:
+            self.try_refresh()
+            return self.tasks.get(name)
+
+registry = TaskRegistry(config.TASKS_DIR, config.TASKS_REFRESH_PERIOD)
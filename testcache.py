@@ -0,0 +1,161 @@
+import os
+import stat
+import fcntl
+import shutil
+import hashlib
+import logging
+import tempfile
+import traceback
+
+#Copies of task tests, normally on tmpfs, so tests are not read from a slow disk for every solution.
+#Cache entry layout:
+#<cache_dir>/<key>/<test name>.in   --> copy of the test input
+#<cache_dir>/<key>/<test name>.out  --> copy of the etalon output
+#Key depends on the task path and stamp, so a changed task gets a new entry.
+#Entry mtime is used as the last access time for LRU eviction. Workers hold a shared flock on the entry
+#(and on their staging dir while copying) until their tests are done, eviction takes an exclusive one
+#without waiting, so only entries nobody uses are removed.
+
+def make_private_dir(path):
+    #Shared tmpfs like /dev/shm is writable by everybody, a dir created there by another user first
+    #would let that user replace tests or solutions
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise OSError('{0} is not a dir owned by uid {1}'.format(path, os.getuid()))
+    if stat.S_IMODE(info.st_mode) != 0o700:
+        os.chmod(path, 0o700)
+
+def lock_dir(path, operation):
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        fcntl.flock(fd, operation)
+    except:
+        os.close(fd)
+        raise
+    return fd
+
+class TestCache:
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.checked = False
+        #Entry path --> fds of the locks held by this process
+        self.locks = {}
+
+    def is_enabled(self):
+        return self.max_size > 0
+
+    def get_key(self, task):
+        return hashlib.sha256(repr((os.path.abspath(task.path), task.stamp)).encode('utf-8')).hexdigest()
+
+    def get(self, task):
+        #Returns the dir with copies of the task tests or None if the task can't be cached
+        size = sum(test.input_size + test.etalon_size for test in task.tests)
+        if size > self.max_size:
+            return None
+        if not self.checked:
+            try:
+                make_private_dir(self.cache_dir)
+            except OSError:
+                logging.warning('Unable to create test cache: ' + traceback.format_exc())
+                return None
+            self.checked = True
+        entry = os.path.join(self.cache_dir, self.get_key(task))
+        fd = self.lock_entry(entry)
+        if fd is None:
+            fd = self.store(task, entry)
+        if fd is None:
+            return None
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        self.locks.setdefault(entry, []).append(fd)
+        self.evict()
+        return entry
+
+    def release(self, entry):
+        #Called when the tests of the entry returned by get are done
+        os.close(self.locks[entry].pop())
+        if not self.locks[entry]:
+            del self.locks[entry]
+
+    def lock_entry(self, entry):
+        #Returns the fd of a shared lock on the entry or None if there is no such entry
+        try:
+            fd = lock_dir(entry, fcntl.LOCK_SH)
+        except OSError:
+            return None
+        try:
+            #Evicted while waiting for the lock
+            if os.path.samestat(os.fstat(fd), os.stat(entry)):
+                return fd
+        except OSError:
+            pass
+        os.close(fd)
+        return None
+
+    def store(self, task, entry):
+        staging = None
+        fd = None
+        try:
+            staging = tempfile.mkdtemp(prefix='.tmp-', dir=self.cache_dir)
+            fd = lock_dir(staging, fcntl.LOCK_SH)
+            for test in task.tests:
+                shutil.copyfile(test.input_path, staging + '/' + os.path.basename(test.input_path))
+                if os.path.exists(test.etalon_path):
+                    shutil.copyfile(test.etalon_path, staging + '/' + os.path.basename(test.etalon_path))
+            #The lock stays with the dir
+            os.rename(staging, entry)
+            logging.info('Cached tests of task {0}: {1}'.format(task.name, entry))
+            return fd
+        except OSError:
+            #Another worker has stored the same entry or there is no space left
+            if fd is not None:
+                os.close(fd)
+            if staging is not None:
+                shutil.rmtree(staging, ignore_errors=True)
+            return self.lock_entry(entry)
+
+    def get_entry_size(self, path):
+        size = 0
+        for file in os.scandir(path):
+            size += file.stat().st_size
+        return size
+
+    def remove_unused(self, path):
+        #Returns False if somebody holds a lock on the dir
+        try:
+            fd = lock_dir(path, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+        try:
+            shutil.rmtree(path, ignore_errors=True)
+        finally:
+            os.close(fd)
+        return True
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            try:
+                if entry.name.startswith('.'):
+                    #Staging dirs left by crashed workers
+                    self.remove_unused(entry.path)
+                    continue
+                mtime = entry.stat().st_mtime
+                size = self.get_entry_size(entry.path)
+            except OSError:
+                continue
+            total_size += size
+            entries.append((mtime, size, entry.path))
+        entries.sort()
+        for mtime, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            if self.remove_unused(path):
+                total_size -= size
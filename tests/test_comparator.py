@@ -0,0 +1,80 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import comparator
+from comparator import Comparator
+
+class ComparatorTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def compare(self, output, etalon, mode='exact'):
+        output_path = self.dir + '/output.txt'
+        etalon_path = self.dir + '/etalon.txt'
+        with open(output_path, 'wb') as file:
+            file.write(output)
+        with open(etalon_path, 'wb') as file:
+            file.write(etalon)
+        return Comparator(mode).compare(output_path, etalon_path)
+
+    def test_crlf_etalon(self):
+        self.assertTrue(self.compare(b'1 2\n3\n', b'1 2\r\n3\r\n'))
+
+    def test_crlf_output(self):
+        self.assertTrue(self.compare(b'1 2\r\n3\r\n', b'1 2\n3\n'))
+
+    def test_crlf_etalon_trailing_whitespace(self):
+        self.assertTrue(self.compare(b'1 2\n3', b'1 2\r\n3\r\n\r\n'))
+
+    def test_crlf_etalon_mismatch(self):
+        self.assertFalse(self.compare(b'1 2\n4\n', b'1 2\r\n3\r\n'))
+
+    def test_lone_carriage_return(self):
+        self.assertFalse(self.compare(b'1\n2\n', b'1\r2\n'))
+
+    def test_crlf_across_chunks(self):
+        line = b'x' * (comparator.CHUNK_SIZE - 1)
+        self.assertTrue(self.compare(line + b'\n' * 3 + b'y\n', line + b'\r\n' * 3 + b'y\r\n'))
+
+    def test_long_tokens(self):
+        token = b'7' * (3 * comparator.CHUNK_SIZE + 5)
+        for mode in ('tokens', 'float'):
+            self.assertTrue(self.compare(b'1 ' + token + b'\n2', b'1\n' + token + b' 2\n', mode))
+            self.assertFalse(self.compare(b'1 ' + token + b'7 2', b'1 ' + token + b' 2', mode))
+            self.assertFalse(self.compare(b'1 ' + token + b' 2 3', b'1 ' + token + b' 2', mode))
+
+    def test_long_output_token_is_not_read_to_the_end(self):
+        #A huge token stops the comparison right away
+        with open(self.dir + '/output.txt', 'wb') as file:
+            file.write(b'1' * (64 * 1024 * 1024))
+        with open(self.dir + '/etalon.txt', 'wb') as file:
+            file.write(b'1\n')
+        with open(self.dir + '/output.txt', 'rb') as output, open(self.dir + '/etalon.txt', 'rb') as etalon:
+            self.assertFalse(Comparator('tokens').compare_tokens(output, etalon))
+            self.assertLess(output.tell(), 4 * comparator.CHUNK_SIZE)
+
+    def test_token_lines(self):
+        c = Comparator('tokens')
+        self.compare(b'1\n\n2 3', b'1\n\n2 4')
+        with open(self.dir + '/output.txt', 'rb') as output, open(self.dir + '/etalon.txt', 'rb') as etalon:
+            self.assertFalse(c.compare_tokens(output, etalon))
+        self.assertEqual(c.get_message(), 'Mismatch at token 3 (line 3)')
+
+    def test_long_lines(self):
+        line = b'x' * (2 * comparator.CHUNK_SIZE + 3)
+        self.assertTrue(self.compare(line + b'  \t\n' + b'y\n', line + b'\n' + b'y', 'lines'))
+        self.assertTrue(self.compare(line + b' ' * (3 * comparator.CHUNK_SIZE) + b'\ny', line + b'\ny\n', 'lines'))
+        self.assertFalse(self.compare(line + b'z\ny\n', line + b'\ny\n', 'lines'))
+        self.assertFalse(self.compare(line + b' ' * (3 * comparator.CHUNK_SIZE) + b'z\ny', line + b'\ny', 'lines'))
+        self.assertFalse(self.compare(line + b'\nz\n', line + b'\ny\n', 'lines'))
+
+if __name__ == '__main__':
+    unittest.main()
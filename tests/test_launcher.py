@@ -0,0 +1,44 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from launcher import Launcher
+
+class LauncherTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        open(self.dir + '/input.txt', 'w').close()
+        self.launcher = Launcher()
+
+    def tearDown(self):
+        self.launcher.process.stdin.close()
+        self.launcher.process.wait()
+        shutil.rmtree(self.dir)
+
+    def start(self, args, timeout):
+        return self.launcher.start(args, self.dir + '/input.txt', self.dir + '/output.txt', self.dir + '/stderr.txt',
+                                   [], None, timeout)
+
+    def test_exit_code(self):
+        result = self.launcher.wait(self.start(['/bin/sh', '-c', 'exit 3'], 10))
+        self.assertEqual(result['code'], 3)
+        self.assertFalse(result['killed'])
+
+    def test_sleeping_target_is_killed(self):
+        result = self.launcher.wait(self.start(['/bin/sleep', '30'], 0.2))
+        self.assertTrue(result['killed'])
+        self.assertTrue(self.launcher.is_alive())
+
+    def test_kill_last_target(self):
+        request_id = self.start(['/bin/sleep', '30'], 30)
+        self.launcher.kill(request_id)
+        self.assertTrue(self.launcher.wait(request_id)['killed'])
+        #The launcher keeps serving after all targets were killed
+        self.assertEqual(self.launcher.wait(self.start(['/bin/true'], 10))['code'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
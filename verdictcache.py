@@ -0,0 +1,87 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+
+#Verdicts of compiled solutions, so a resent solution is not judged again.
+#Cache entry layout:
+#<cache_dir>/<key>.json --> {"status": ..., "failed_test_num": ..., "message": ..., "stderr": ...}
+#Key covers the binary, the task fingerprint and the judge settings, so a changed task or limit
+#never hits old entries, they are just evicted later.
+#Entry mtime is used as the last access time for LRU eviction.
+
+class VerdictCache:
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def is_enabled(self):
+        return self.max_size > 0
+
+    def get_key(self, language, target, task, settings):
+        key = hashlib.sha256()
+        key.update(language.encode('utf-8') + b'\0')
+        key.update(repr(settings).encode('utf-8') + b'\0')
+        key.update(task.get_fingerprint().encode('ascii') + b'\0')
+        content = hashlib.sha256()
+        with open(target, 'rb') as file:
+            for chunk in iter(lambda: file.read(65536), b''):
+                content.update(chunk)
+        key.update(content.digest())
+        return key.hexdigest()
+
+    def load(self, key):
+        path = os.path.join(self.cache_dir, key + '.json')
+        try:
+            with open(path, 'r') as file:
+                verdict = json.load(file)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        logging.info('Verdict cache hit: {0} (hits: {1}, misses: {2})'.format(key, self.hits, self.misses))
+        return verdict
+
+    def store(self, key, verdict):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, staging = tempfile.mkstemp(prefix='.tmp-', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(verdict, file)
+            os.rename(staging, os.path.join(self.cache_dir, key + '.json'))
+        except OSError:
+            try:
+                os.remove(staging)
+            except OSError:
+                pass
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            try:
+                stat = entry.stat()
+                if entry.name.startswith('.'):
+                    #Staging files left by crashed workers
+                    if time.time() - stat.st_mtime > 3600:
+                        os.remove(entry.path)
+                    continue
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size